@@ -0,0 +1,468 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+A compact binary archive of games with random access.
+
+An archive is one file of game records appended one after another, each
+holding a 6-byte header, the start position packed into 37 bytes (only if
+it is not the standard one), the tags and the moves as 16-bit ints, so a
+game costs two bytes per move plus its tags. Two index files sit next to
+it:
+
+* ARCHIVE.idx holds the offset of every record as a 64-bit int, so game N
+  is found with one lookup; it grows with every appended game.
+* ARCHIVE.keys holds (Zobrist key, game, ply) for every position of every
+  game, sorted by key, so the games passing through a position are found
+  by binary search. It is rebuilt by build_key_index() after appending.
+
+Archive reads all three through mmap; the moves of a game are handed out
+as a memoryview of the mapped file, without copying. Any game can be
+rebuilt as a Game at any ply, and archives convert from and to PGN.
+
+Run as a script: python -m archive import|export|index|info|find|show ...
+"""
+
+import argparse
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+
+from pyChess import START_FEN, Game, Position
+
+__author__ = "Michael Krisper"
+
+MAGIC = b"PYGA"
+VERSION = 1
+# magic, version
+FILE_HEADER = struct.Struct("<4sH10x")
+# number of moves, result, flags, length of the tags
+RECORD = struct.Struct("<HBBH")
+KEYS_MAGIC = b"PYGK"
+# magic, number of games covered
+KEYS_HEADER = struct.Struct("<4sI8x")
+# Zobrist key, game, ply
+KEY_ENTRY = struct.Struct("<QIH")
+_KEY = struct.Struct("<Q")
+OFFSET = struct.Struct("<Q")
+
+RESULTS = ("*", "1-0", "0-1", "1/2-1/2")
+CUSTOM_START = 1
+PACKED_SIZE = 37
+# the header and the packed start position are padded to keep the moves 2-byte aligned
+PACKED_SLOT = PACKED_SIZE + 1
+MAX_MOVES = 0xffff
+
+class GameRecord(object):
+    """One game of an archive: its tags, start position, result and moves."""
+    __slots__ = ("index", "headers", "fen", "result", "moves")
+
+    def __init__(self, index, headers, fen, result, moves):
+        """
+        Initializes a GameRecord.
+
+        Args:
+            index (int): The number of the game in the archive, from 0.
+            headers (dict): The tags of the game.
+            fen (str): The start position.
+            result (str): The result, '1-0', '0-1', '1/2-1/2' or '*'.
+            moves: The encoded moves, a memoryview of the archive where possible.
+        """
+        self.index = index
+        self.headers = headers
+        self.fen = fen
+        self.result = result
+        self.moves = moves
+
+def _encode_tags(headers):
+    # Result and FEN have their own fields, and pgn.write_game() fills in unknown tags again.
+    return "".join("%s\t%s\n" % (name, value) for name, value in headers.items()
+                   if name not in ("Result", "SetUp", "FEN") and value not in ("?", "????.??.??")).encode("utf-8")
+
+def _decode_tags(data):
+    headers = {}
+    for line in bytes(data).decode("utf-8", "replace").splitlines():
+        name, _, value = line.partition("\t")
+        headers[name] = value
+    return headers
+
+def encode_record(moves, headers=None, fen=START_FEN, result="*"):
+    """
+    Encodes one game as an archive record.
+
+    Args:
+        moves (list): The moves as ints, encoded as by Position.generate_moves.
+        headers (dict): Tag pairs; Result, SetUp and FEN are stored in other ways.
+        fen (str): The start position.
+        result (str): The game termination marker.
+
+    Returns:
+        bytes: The record, of even length.
+
+    Raises:
+        ValueError: If the game is too long or the result or FEN are invalid.
+    """
+    if len(moves) > MAX_MOVES:
+        raise ValueError("Error: A game can have at most %d moves." % MAX_MOVES)
+    if result not in RESULTS:
+        raise ValueError("Error: Invalid result: %s" % result)
+    tags = _encode_tags(headers or {})
+    flags = 0
+    data = bytearray()
+    if fen != START_FEN:
+        flags |= CUSTOM_START
+        data += Position.from_fen(fen).pack().ljust(PACKED_SLOT, b"\0")
+    data += tags
+    if len(tags) & 1:
+        data.append(0)
+    data += array("H", moves).tobytes() if sys.byteorder == "little" else _swapped(array("H", moves)).tobytes()
+    return RECORD.pack(len(moves), RESULTS.index(result), flags, len(tags)) + bytes(data)
+
+def _swapped(values):
+    values.byteswap()
+    return values
+
+class ArchiveWriter(object):
+    """Appends games to an archive and its offset index."""
+
+    def __init__(self, path):
+        """
+        Opens an archive for appending, creating it if needed.
+
+        Raises:
+            ValueError: If the file exists but is not an archive.
+        """
+        self.path = path
+        self._file = open(path, "ab+")
+        self._file.seek(0, os.SEEK_END)
+        if self._file.tell() == 0:
+            self._file.write(FILE_HEADER.pack(MAGIC, VERSION))
+        else:
+            self._file.seek(0)
+            magic, _ = FILE_HEADER.unpack(self._file.read(FILE_HEADER.size))
+            if magic != MAGIC:
+                self._file.close()
+                raise ValueError("Error: %s is not a game archive." % path)
+            self._file.seek(0, os.SEEK_END)
+        self._index = open(path + ".idx", "ab")
+        self.count = self._index.tell() // OFFSET.size
+
+    def append(self, moves, headers=None, fen=START_FEN, result="*"):
+        """
+        Appends one game (see encode_record for the arguments).
+
+        Returns:
+            int: The number of the game in the archive, from 0.
+        """
+        record = encode_record(moves, headers, fen, result)
+        offset = self._file.tell()
+        self._file.write(record)
+        self._index.write(OFFSET.pack(offset))
+        self.count += 1
+        return self.count - 1
+
+    def append_game(self, game, headers=None):
+        """Appends the moves played in a Game, with its players' names and its result so far."""
+        tags = {"White": game.players[0]._name, "Black": game.players[1]._name}
+        tags.update(headers or {})
+        return self.append(game.get_moves(), tags, game.start_fen, game_result(game))
+
+    def close(self):
+        self._file.close()
+        self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def game_result(game):
+    """Returns the result of a Game as a PGN result, '*' while it goes on."""
+    if game.get_result() is None:
+        return "*"
+    if game.position.checkers and not game.has_legal_moves(game.current_player()):
+        return "0-1" if game.position.side == 0 else "1-0"
+    return "1/2-1/2"
+
+def _map(path):
+    """Memory-maps a file for reading; returns None for an empty file."""
+    with open(path, "rb") as f:
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return None
+
+class Archive(object):
+    """A read-only, memory-mapped game archive."""
+
+    def __init__(self, path):
+        """
+        Opens an archive.
+
+        Raises:
+            OSError: If the archive or its offset index cannot be opened.
+            ValueError: If the file is not an archive.
+        """
+        self.path = path
+        self._data = _map(path)
+        if self._data is None or FILE_HEADER.unpack_from(self._data)[0] != MAGIC:
+            self.close()
+            raise ValueError("Error: %s is not a game archive." % path)
+        self._index = _map(path + ".idx")
+        self._offsets = memoryview(self._index).cast("Q") if self._index is not None else []
+        self._keys = None
+        self._key_count = 0
+
+    def close(self):
+        """Unmaps the files; memoryviews of moves handed out before must not be used afterwards."""
+        self._offsets = []
+        for name in ("_data", "_index", "_keys"):
+            buffer = getattr(self, name, None)
+            if buffer is not None:
+                try:
+                    buffer.close()
+                except BufferError:
+                    pass  # a memoryview of it is still alive; it is closed when collected
+                setattr(self, name, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.record(index)
+
+    def record(self, index):
+        """
+        Reads game number index, counted from 0.
+
+        Raises:
+            IndexError: If the archive has no such game.
+        """
+        if not 0 <= index < len(self._offsets):
+            raise IndexError("Error: %s has no game %d." % (self.path, index + 1))
+        offset = self._offsets[index]
+        count, result, flags, tags_length = RECORD.unpack_from(self._data, offset)
+        offset += RECORD.size
+        fen = START_FEN
+        if flags & CUSTOM_START:
+            fen = Position.unpack(self._data[offset:offset + PACKED_SIZE]).to_fen()
+            offset += PACKED_SLOT
+        headers = _decode_tags(self._data[offset:offset + tags_length])
+        offset += tags_length + (tags_length & 1)
+        moves = memoryview(self._data)[offset:offset + 2 * count].cast("H")
+        if sys.byteorder != "little":
+            moves = _swapped(array("H", moves))
+        return GameRecord(index, headers, fen, RESULTS[result], moves)
+
+    def game(self, index, ply=None, game=None):
+        """
+        Rebuilds a game as a Game.
+
+        The moves are played straight onto the position and the repetition
+        history is counted once at the end; the moves can be taken back.
+
+        Args:
+            index (int): The number of the game, from 0.
+            ply (int): The number of moves to play, by default all.
+            game (Game): The Game to set up, by default a new one.
+
+        Returns:
+            Game: The game after ply moves.
+        """
+        record = self.record(index)
+        moves = record.moves if ply is None else record.moves[:max(0, ply)]
+        if game is None:
+            game = Game(record.fen)
+        else:
+            game.set_fen(record.fen)
+        position = game.position
+        for move in moves:
+            position.make_move(move)
+        game._rebuild_position_history()
+        game.players[0].set_name(record.headers.get("White", game.players[0]._name))
+        game.players[1].set_name(record.headers.get("Black", game.players[1]._name))
+        return game
+
+    def _load_keys(self):
+        """Maps the key index, checking that it covers every game."""
+        if self._keys is None:
+            path = self.path + ".keys"
+            self._keys = _map(path) if os.path.exists(path) else None
+            if self._keys is not None:
+                magic, self._key_count = KEYS_HEADER.unpack_from(self._keys)
+                if magic != KEYS_MAGIC:
+                    raise ValueError("Error: %s is not a key index." % path)
+        if self._keys is None or self._key_count != len(self):
+            raise ValueError("Error: The key index of %s is missing or out of date (run: python -m archive index %s)"
+                             % (self.path, self.path))
+
+    def find(self, key):
+        """
+        Finds the positions with a Zobrist key by binary search in the key index.
+
+        Returns:
+            list: (game, ply) pairs, the game counted from 0 and ply the number
+                  of moves played before the position, by game.
+
+        Raises:
+            ValueError: If the key index is missing or does not cover every game.
+        """
+        self._load_keys()
+        keys = self._keys
+        low, high = 0, (len(keys) - KEYS_HEADER.size) // KEY_ENTRY.size
+        size = high
+        while low < high:
+            middle = (low + high) // 2
+            if _KEY.unpack_from(keys, KEYS_HEADER.size + middle * KEY_ENTRY.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        found = []
+        while low < size:
+            entry_key, game, ply = KEY_ENTRY.unpack_from(keys, KEYS_HEADER.size + low * KEY_ENTRY.size)
+            if entry_key != key:
+                break
+            found.append((game, ply))
+            low += 1
+        return sorted(found)
+
+    def write_pgn(self, out, indexes=None):
+        """
+        Writes games as PGN.
+
+        Args:
+            out: A file object opened for writing text.
+            indexes: The numbers of the games to write, by default all.
+
+        Returns:
+            int: The number of games written.
+        """
+        import pgn
+        written = 0
+        for index in range(len(self)) if indexes is None else indexes:
+            record = self.record(index)
+            pgn.write_game(out, list(record.moves), record.headers, record.fen, record.result)
+            written += 1
+        return written
+
+def build_key_index(path):
+    """
+    Writes the key index of an archive: every position of every game, sorted by Zobrist key.
+
+    Returns:
+        int: The number of positions indexed.
+    """
+    entries = []
+    with Archive(path) as archive:
+        for record in archive:
+            position = Position.from_fen(record.fen)
+            entries.append((position.key, record.index, 0))
+            for ply, move in enumerate(record.moves, start=1):
+                position.make_move(move)
+                entries.append((position.key, record.index, ply))
+            del record
+        games = len(archive)
+    entries.sort()
+    with open(path + ".keys", "wb") as f:
+        f.write(KEYS_HEADER.pack(KEYS_MAGIC, games))
+        for entry in entries:
+            f.write(KEY_ENTRY.pack(*entry))
+    return len(entries)
+
+def import_pgn(source, path):
+    """
+    Appends the games of a PGN source to an archive and rebuilds its key index.
+
+    Games that break the rules are stored with their legal moves.
+
+    Returns:
+        int: The number of games appended.
+    """
+    import pgn
+    count = 0
+    with ArchiveWriter(path) as writer:
+        for pgn_game in pgn.read_games(source):
+            result = pgn_game.result if pgn_game.result in RESULTS else "*"
+            writer.append(pgn_game.moves, pgn_game.headers, pgn_game.fen, result)
+            count += 1
+    build_key_index(path)
+    return count
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stores games in a compact binary archive and looks them up.")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+    import_parser = subparsers.add_parser("import", help="append the games of a PGN file to an archive")
+    import_parser.add_argument("pgn", help="the PGN file to read ('-' for standard input)")
+    import_parser.add_argument("archive", help="the archive to append to")
+    export_parser = subparsers.add_parser("export", help="write games of an archive as PGN")
+    export_parser.add_argument("archive", help="the archive to read")
+    export_parser.add_argument("pgn", nargs="?", default="-", help="the PGN file to write (default: standard output)")
+    export_parser.add_argument("--game", type=int, action="append", metavar="N",
+                               help="export only game N, counted from 1 (repeatable)")
+    index_parser = subparsers.add_parser("index", help="rebuild the key index of an archive")
+    index_parser.add_argument("archive", help="the archive")
+    info_parser = subparsers.add_parser("info", help="count the games and moves of an archive")
+    info_parser.add_argument("archive", help="the archive")
+    find_parser = subparsers.add_parser("find", help="list the games passing through a position")
+    find_parser.add_argument("archive", help="the archive")
+    find_parser.add_argument("--fen", default=START_FEN, help="the position (default: the start position)")
+    show_parser = subparsers.add_parser("show", help="print the position of a game after a number of moves")
+    show_parser.add_argument("archive", help="the archive")
+    show_parser.add_argument("game", type=int, help="the game, counted from 1")
+    show_parser.add_argument("ply", type=int, nargs="?", help="the number of moves played (default: all)")
+    args = parser.parse_args(argv)
+    start = time.perf_counter()
+    try:
+        if args.action == "import":
+            count = import_pgn(sys.stdin if args.pgn == "-" else args.pgn, args.archive)
+            print("%d games appended to %s in %.2fs" % (count, args.archive, time.perf_counter() - start))
+        elif args.action == "index":
+            count = build_key_index(args.archive)
+            print("%d positions indexed in %.2fs" % (count, time.perf_counter() - start))
+        elif args.action == "export":
+            with Archive(args.archive) as archive:
+                indexes = None if args.game is None else [number - 1 for number in args.game]
+                if args.pgn == "-":
+                    archive.write_pgn(sys.stdout, indexes)
+                else:
+                    with open(args.pgn, "w") as out:
+                        count = archive.write_pgn(out, indexes)
+                    print("%d games written to %s in %.2fs" % (count, args.pgn, time.perf_counter() - start))
+        elif args.action == "info":
+            with Archive(args.archive) as archive:
+                moves = sum(len(record.moves) for record in archive)
+                size = os.path.getsize(args.archive)
+                print("%d games, %d moves, %d bytes (%.2f bytes per move) in %s"
+                      % (len(archive), moves, size, size / moves if moves else 0, args.archive))
+        elif args.action == "find":
+            with Archive(args.archive) as archive:
+                found = archive.find(Position.from_fen(args.fen).key)
+                lookup = time.perf_counter() - start
+                for game, ply in found:
+                    headers = archive.record(game).headers
+                    print("game %d ply %d (%s - %s)" % (game + 1, ply, headers.get("White", "?"),
+                                                        headers.get("Black", "?")))
+                print("%d positions found in %.1f ms" % (len(found), lookup * 1e3))
+        else:
+            with Archive(args.archive) as archive:
+                game = archive.game(args.game - 1, args.ply)
+                game.renderer.set_mode("plain")
+                game.print_board()
+                print(game.to_fen())
+    except (OSError, ValueError, IndexError) as err:
+        print(err)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
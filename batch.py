@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Headless analysis of many positions at once.
+
+analyze() looks at one position given in FEN: whether it is valid, its
+legal moves, check, mate or stalemate, the static evaluation and,
+optionally, the best move found by a search. analyze_batch() streams any
+number of positions through it in chunks, spread over a pool of worker
+processes, and yields the results in input order while only a few chunks
+are in flight. Nothing here builds a Game; a position costs one FEN parse
+and one move generation.
+
+pyChess.py --batch FILE runs it from the command line, writing JSON lines
+or CSV.
+"""
+
+import csv
+import json
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from pyChess import Position, move_to_text
+
+__author__ = "Michael Krisper"
+
+CSV_FIELDS = ("fen", "valid", "error", "side", "check", "status", "move_count", "legal_moves", "eval",
+              "best_move", "score", "depth", "nodes")
+
+_worker_engine = None
+
+def analyze(fen, depth=0):
+    """
+    Analyzes a single position.
+
+    Args:
+        fen (str): The position in Forsyth-Edwards Notation.
+        depth (int): The search depth for the best move; 0 skips the search.
+
+    Returns:
+        dict: The results; 'valid' is False and 'error' holds the reason if
+              the FEN could not be parsed. Scores are centipawns from the
+              point of view of the side to move.
+    """
+    global _worker_engine
+    fen = fen.strip()
+    try:
+        position = Position.from_fen(fen)
+    except ValueError as e:
+        return {"fen": fen, "valid": False, "error": str(e)}
+    from engine import Engine
+    from evaluate import evaluate
+    moves = list(position.generate_moves())
+    check = position.is_in_check(position.side)
+    if not moves:
+        status = "checkmate" if check else "stalemate"
+    elif position.halfmove >= 100:
+        status = "fifty-move rule"
+    else:
+        status = "ongoing"
+    result = {"fen": fen, "valid": True, "error": None, "side": "wb"[position.side], "check": check,
+              "status": status, "move_count": len(moves), "legal_moves": [move_to_text(move) for move in moves],
+              "eval": evaluate(position)}
+    if depth > 0 and moves:
+        if _worker_engine is None:
+            _worker_engine = Engine(hash_mb=4)
+        found = _worker_engine.search(position, max_depth=depth)
+        result.update(best_move=move_to_text(found.move), score=found.score, depth=found.depth, nodes=found.nodes)
+    return result
+
+def _analyze_chunk(task):
+    """Analyzes a chunk of FENs in a worker process."""
+    fens, depth = task
+    return [analyze(fen, depth) for fen in fens]
+
+def _chunks(lines, chunk_size):
+    """Groups the non-empty lines that are not comments ('#') into lists of chunk_size."""
+    chunk = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        chunk.append(line)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def analyze_batch(fens, depth=0, workers=1, chunk_size=256):
+    """
+    Analyzes a stream of positions, in chunks spread over worker processes.
+
+    At most two chunks per worker are in flight, so the input may be an
+    endless stream (e.g. standard input) and memory stays bounded.
+
+    Args:
+        fens: An iterable of FEN strings, one per position; blank lines and
+              lines starting with '#' are skipped.
+        depth (int): The search depth for the best move; 0 skips the search.
+        workers (int): The number of worker processes; 1 analyzes in this process.
+        chunk_size (int): The number of positions sent to a worker at once.
+
+    Yields:
+        dict: The result of analyze() for every position, in input order.
+    """
+    chunks = _chunks(fens, chunk_size)
+    if workers <= 1:
+        for chunk in chunks:
+            yield from _analyze_chunk((chunk, depth))
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(_analyze_chunk, (chunk, depth)))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+def write_json(results, out):
+    """Writes results as JSON lines, one object per position."""
+    for result in results:
+        out.write(json.dumps(result) + "\n")
+
+def write_csv(results, out):
+    """Writes results as CSV with a header row; legal moves are separated by spaces."""
+    writer = csv.DictWriter(out, CSV_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    for result in results:
+        if "legal_moves" in result:
+            result = dict(result, legal_moves=" ".join(result["legal_moves"]))
+        writer.writerow(result)
+
+def run(source, output="-", output_format="json", depth=0, workers=1):
+    """
+    Analyzes the positions of a FEN file and writes the results.
+
+    Args:
+        source (str): The file with one FEN per line, '-' for standard input.
+        output (str): The file to write, '-' for standard output.
+        output_format (str): 'json' for JSON lines or 'csv'.
+        depth (int): The search depth for the best move; 0 skips the search.
+        workers (int): The number of worker processes.
+
+    Returns:
+        int: The exit status, 1 if any position was invalid.
+    """
+    invalid = [0]
+
+    def counted(results):
+        for result in results:
+            if not result["valid"]:
+                invalid[0] += 1
+            yield result
+
+    fens = sys.stdin if source == "-" else open(source)
+    out = sys.stdout if output == "-" else open(output, "w", newline="")
+    try:
+        results = counted(analyze_batch(fens, depth, workers))
+        (write_csv if output_format == "csv" else write_json)(results, out)
+    finally:
+        if fens is not sys.stdin:
+            fens.close()
+        if out is not sys.stdout:
+            out.close()
+    return 1 if invalid[0] else 0
@@ -0,0 +1,635 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+A negamax alpha-beta search engine for pyChess.
+
+The engine searches a private copy of a Position, playing and taking back
+moves through an evaluate.Evaluator, which keeps the static evaluation up
+to date. Iterative deepening runs the search one ply deeper at a time
+until the time or node budget is spent; the best move of the last
+completed iteration is the answer. Captures are followed
+to quiet positions by a quiescence search, and moves are tried in the order
+hash move, principal variation, captures by MVV-LVA, killer moves, history.
+Search results are kept in a fixed-size transposition table.
+
+parallel_search() spreads the root moves over a pool of processes, each
+searching its moves with an Engine of its own.
+"""
+
+import argparse
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from pyChess import EMPTY, PAWN, QUEEN, MOVE_EN_PASSANT, MOVE_PROMOTION, START_FEN, Position
+from evaluate import Evaluator
+
+__author__ = "Michael Krisper"
+
+MATE = 100000
+MAX_PLY = 64
+INFINITY = MATE + 1
+
+# Bounds of a transposition table score.
+EXACT, LOWER_BOUND, UPPER_BOUND = 1, 2, 3
+
+class TranspositionTable(object):
+    """
+    A fixed-size hash table of search results, keyed by Zobrist key.
+
+    The table is two preallocated arrays of unsigned 64-bit ints, one for
+    the keys and one for the entries, packed as move | score << 16 |
+    depth << 36 | bound << 44 | age << 46 (the score is offset to be
+    non-negative). Every bucket has two slots: the first keeps the deepest
+    result of the current search, the second always takes the newest
+    result that did not qualify for the first. The age is advanced by
+    new_search(), so entries of earlier moves are the first to be evicted.
+
+    The hits, misses and collisions counters tell how well the table fits
+    the host; a collision is a miss on a bucket that holds other positions.
+    """
+    ENTRY_SIZE = 16
+    SCORE_OFFSET = 1 << 19
+
+    def __init__(self, size_mb=16):
+        """
+        Initializes a TranspositionTable.
+
+        Args:
+            size_mb (float): The memory budget in megabytes; the number of
+                             buckets is rounded down to a power of two.
+        """
+        self.resize(size_mb)
+
+    def resize(self, size_mb):
+        """Reallocates the table for a new memory budget, discarding all entries."""
+        buckets = 1
+        while buckets * 4 * self.ENTRY_SIZE <= size_mb * (1 << 20):
+            buckets *= 2
+        self.size_mb = size_mb
+        self.mask = buckets - 1
+        self.keys = array("Q", [0]) * (2 * buckets)
+        self.entries = array("Q", [0]) * (2 * buckets)
+        self.age = 0
+        self.reset_counters()
+
+    def clear(self):
+        """Discards all entries."""
+        self.resize(self.size_mb)
+
+    def reset_counters(self):
+        """Sets the hit, miss, collision and store counters to zero."""
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0
+        self.stores = 0
+
+    def new_search(self):
+        """Starts a new age; entries of earlier searches become replaceable."""
+        self.age = (self.age + 1) & 63
+
+    def probe(self, key):
+        """
+        Looks up a position.
+
+        Returns:
+            int: The packed entry, or 0 if the position is not in the table.
+        """
+        index = (key & self.mask) << 1
+        keys = self.keys
+        if keys[index] == key:
+            self.hits += 1
+            return self.entries[index]
+        if keys[index + 1] == key:
+            self.hits += 1
+            return self.entries[index + 1]
+        self.misses += 1
+        if keys[index] or keys[index + 1]:
+            self.collisions += 1
+        return 0
+
+    def store(self, key, move, score, depth, bound):
+        """
+        Stores a search result.
+
+        Args:
+            key (int): The Zobrist key of the position.
+            move (int): The best move found, or 0.
+            score (int): The score, already adjusted for mates (see to_table_score).
+            depth (int): The remaining depth the position was searched to.
+            bound (int): EXACT, LOWER_BOUND or UPPER_BOUND.
+        """
+        index = (key & self.mask) << 1
+        keys, entries = self.keys, self.entries
+        entry = entries[index]
+        if not (keys[index] == key or entry >> 46 != self.age or depth >= entry >> 36 & 255):
+            index += 1
+            entry = entries[index]
+        if not move and keys[index] == key:
+            move = entry & 0xffff
+        keys[index] = key
+        entries[index] = (move | (score + self.SCORE_OFFSET) << 16 | depth << 36
+                          | bound << 44 | self.age << 46)
+        self.stores += 1
+
+    def hashfull(self):
+        """Returns the permille of sampled slots holding entries of the current search."""
+        keys, entries = self.keys, self.entries
+        sample = min(1000, len(keys))
+        used = sum(1 for i in range(sample) if keys[i] and entries[i] >> 46 == self.age)
+        return used * 1000 // sample
+
+def to_table_score(score, ply):
+    """Makes a mate score relative to the position instead of the root, for storing."""
+    if score > MATE - MAX_PLY:
+        return score + ply
+    if score < MAX_PLY - MATE:
+        return score - ply
+    return score
+
+def from_table_score(entry, ply):
+    """Unpacks the score of a table entry and makes a mate score relative to the root again."""
+    score = (entry >> 16 & 0xfffff) - TranspositionTable.SCORE_OFFSET
+    if score > MATE - MAX_PLY:
+        return score - ply
+    if score < MAX_PLY - MATE:
+        return score + ply
+    return score
+
+class SearchAborted(Exception):
+    """Raised inside the search when the time or node budget is exhausted."""
+
+class SearchResult(object):
+    """The outcome of a search: best move, score and statistics of the deepest completed iteration."""
+    __slots__ = ("move", "score", "depth", "nodes", "time", "pv")
+
+    def __init__(self, move, score, depth, nodes, time, pv):
+        self.move = move
+        self.score = score
+        self.depth = depth
+        self.nodes = nodes
+        self.time = time
+        self.pv = pv
+
+    @property
+    def nps(self):
+        """Searched nodes per second."""
+        return int(self.nodes / self.time) if self.time > 0 else 0
+
+    @property
+    def mate_in(self):
+        """The number of moves to mate (negative when being mated), or None."""
+        if abs(self.score) < MATE - MAX_PLY:
+            return None
+        plies = MATE - abs(self.score)
+        return (plies + 1) // 2 if self.score > 0 else -(plies // 2)
+
+class Engine(object):
+    """
+    Searches for the best move in a position.
+
+    An Engine keeps its transposition table, killer and history tables
+    between searches, so one instance should be reused for the moves of a game.
+    With tablebases (tablebase.Tablebases) set, the positions they cover are
+    scored exactly instead of being searched.
+    """
+
+    def __init__(self, hash_mb=16):
+        """
+        Initializes an Engine.
+
+        Args:
+            hash_mb (float): The memory budget of the transposition table in megabytes.
+        """
+        self.tt = TranspositionTable(hash_mb)
+        self.position = None
+        self.evaluator = None
+        self.nodes = 0
+        self.killers = [[0, 0] for _ in range(MAX_PLY + 1)]
+        self.history = [[0] * 64 for _ in range(16)]
+        self._pv = [[] for _ in range(MAX_PLY + 1)]
+        self._previous_pv = []
+        self._stop = False
+        self._deadline = None
+        self._max_nodes = None
+        self._next_check = 0
+        self.tablebases = None
+
+    def stop(self):
+        """Asks a running search to return its best move as soon as possible."""
+        self._stop = True
+
+    def clear(self):
+        """Forgets everything learned in earlier searches: transposition table, killers and history."""
+        self.tt.clear()
+        self.killers = [[0, 0] for _ in range(MAX_PLY + 1)]
+        self.history = [[0] * 64 for _ in range(16)]
+
+    def search(self, position, max_time=None, max_nodes=None, max_depth=MAX_PLY, info=None):
+        """
+        Searches a position by iterative deepening.
+
+        The budget is hard: the search stops as soon as it is exhausted. If
+        not even the first iteration completed by then, the best root move
+        found so far (or else any legal move) is returned.
+
+        Args:
+            position (Position): The position to search; it is not modified.
+            max_time (float): The time budget in seconds, or None.
+            max_nodes (int): The node budget, or None.
+            max_depth (int): The deepest iteration to run.
+            info (callable): Called with a SearchResult after every completed iteration.
+
+        Returns:
+            SearchResult: The result of the deepest completed iteration; its move
+                          is 0 if the side to move has no legal moves.
+        """
+        self.position = position.copy()
+        self.evaluator = Evaluator(self.position)
+        self.nodes = 0
+        self.killers = [[0, 0] for _ in range(MAX_PLY + 1)]
+        for row in self.history:
+            for i in range(64):
+                row[i] >>= 3
+        self._previous_pv = []
+        self.tt.new_search()
+        self._stop = False
+        self._max_nodes = max_nodes
+        start = time.perf_counter()
+        self._deadline = None if max_time is None else start + max_time
+        result = SearchResult(0, 0, 0, 0, 0.0, [])
+        first_move = next(self.position.generate_moves(), None)
+        if first_move is None:
+            return result
+        undo_depth = len(self.position.undo_stack)
+        self._next_check = self._limit_check_after(0)
+        for depth in range(1, max_depth + 1):
+            try:
+                score = self._search(depth, -INFINITY, INFINITY, 0)
+            except SearchAborted:
+                while len(self.position.undo_stack) > undo_depth:
+                    self.evaluator.unmake_move()
+                if not result.move:
+                    result.pv = self._pv[0][:1] or [first_move]
+                    result.move = result.pv[0]
+                break
+            elapsed = time.perf_counter() - start
+            self._previous_pv = self._complete_pv(self._pv[0], depth)
+            result = SearchResult(self._previous_pv[0], score, depth, self.nodes, elapsed, self._previous_pv)
+            if info:
+                info(result)
+            if result.mate_in is not None or self._stop:
+                break
+            # An iteration takes several times longer than the one before.
+            if self._deadline is not None and elapsed > max_time / 2:
+                break
+        result.nodes = self.nodes
+        result.time = time.perf_counter() - start
+        return result
+
+    def _complete_pv(self, pv, depth):
+        """
+        Extends a principal variation cut short by a table hit with the stored best moves.
+
+        Returns:
+            list: The moves of the principal variation, at most depth long.
+        """
+        position = self.position
+        pv = pv[:depth]
+        for move in pv:
+            position.make_move(move)
+        while len(pv) < depth and not self._is_draw():
+            entry = self.tt.probe(position.key)
+            move = entry & 0xffff
+            if not entry or move not in position.generate_moves():
+                break
+            position.make_move(move)
+            pv.append(move)
+        for _ in pv:
+            position.unmake_move()
+        return pv
+
+    def _limit_check_after(self, nodes):
+        """Returns the node count at which the budget is checked next."""
+        next_check = nodes + 1024
+        if self._max_nodes is not None:
+            next_check = min(next_check, self._max_nodes)
+        return next_check
+
+    def _check_limits(self):
+        """Raises SearchAborted once the budget is exhausted or stop() was called."""
+        if self._stop or (self._max_nodes is not None and self.nodes >= self._max_nodes) \
+           or (self._deadline is not None and time.perf_counter() >= self._deadline):
+            raise SearchAborted()
+        self._next_check = self._limit_check_after(self.nodes)
+
+    def _is_draw(self):
+        """Checks for the 50-move rule and for a repetition of any earlier position."""
+        position = self.position
+        if position.halfmove >= 100:
+            return True
+        keys = position.key_stack
+        return position.key in keys[max(0, len(keys) - position.halfmove):]
+
+    def _search(self, depth, alpha, beta, ply):
+        """
+        Searches the position to a depth with an alpha-beta window.
+
+        Returns:
+            int: The score from the point of view of the side to move.
+        """
+        self.nodes += 1
+        if self.nodes >= self._next_check:
+            self._check_limits()
+        position = self.position
+        self._pv[ply] = []
+        if ply and self._is_draw():
+            return 0
+        if ply and self.tablebases is not None:
+            found = self.tablebases.probe(position)
+            if found is not None:
+                wdl, plies = found
+                return wdl * (MATE - ply - plies)
+        if ply >= MAX_PLY:
+            return self.evaluator.evaluate()
+        in_check = position.checkers != 0
+        if in_check:
+            depth += 1
+        if depth <= 0:
+            return self._quiesce(alpha, beta, ply)
+
+        key = position.key
+        entry = self.tt.probe(key)
+        hash_move = entry & 0xffff
+        if entry and ply and entry >> 36 & 255 >= depth:
+            score = from_table_score(entry, ply)
+            bound = entry >> 44 & 3
+            if bound == EXACT or (bound == LOWER_BOUND and score >= beta) \
+               or (bound == UPPER_BOUND and score <= alpha):
+                return score
+
+        moves = list(position.generate_moves())
+        if not moves:
+            return -MATE + ply if in_check else 0
+        self._order(moves, ply, hash_move)
+
+        board = position.board
+        original_alpha = alpha
+        best = -INFINITY
+        best_move = 0
+        for move in moves:
+            self.evaluator.make_move(move)
+            score = -self._search(depth - 1, -beta, -alpha, ply + 1)
+            self.evaluator.unmake_move()
+            if score > best:
+                best = score
+                best_move = move
+                if score > alpha:
+                    alpha = score
+                    self._pv[ply] = [move] + self._pv[ply + 1]
+                    if score >= beta:
+                        if not board[move >> 6 & 63] and move >> 12 < MOVE_EN_PASSANT:
+                            self._store_quiet_cutoff(move, depth, ply)
+                        break
+        if best >= beta:
+            bound = LOWER_BOUND
+        elif best > original_alpha:
+            bound = EXACT
+        else:
+            bound = UPPER_BOUND
+            best_move = 0
+        self.tt.store(key, best_move, to_table_score(best, ply), depth, bound)
+        return best
+
+    def _quiesce(self, alpha, beta, ply):
+        """
+        Searches captures and queen promotions until the position is quiet.
+
+        The side to move may always decline to capture ("stand pat"), unless
+        it is in check, where all evasions are searched.
+
+        Returns:
+            int: The score from the point of view of the side to move.
+        """
+        self.nodes += 1
+        if self.nodes >= self._next_check:
+            self._check_limits()
+        position = self.position
+        self._pv[ply] = []
+        if ply >= MAX_PLY:
+            return self.evaluator.evaluate()
+        board = position.board
+        if position.checkers:
+            moves = list(position.generate_moves())
+            if not moves:
+                return -MATE + ply
+            best = -INFINITY
+        else:
+            best = self.evaluator.evaluate()
+            if best >= beta:
+                return best
+            if best > alpha:
+                alpha = best
+            moves = [move for move in position.generate_moves()
+                     if board[move >> 6 & 63] or move >> 12 == MOVE_EN_PASSANT or move >> 12 == QUEEN + 2]
+        self._order(moves, ply)
+        for move in moves:
+            self.evaluator.make_move(move)
+            score = -self._quiesce(-beta, -alpha, ply + 1)
+            self.evaluator.unmake_move()
+            if score > best:
+                best = score
+                if score > alpha:
+                    alpha = score
+                    self._pv[ply] = [move] + self._pv[ply + 1]
+                    if score >= beta:
+                        break
+        return best
+
+    def _order(self, moves, ply, hash_move=0):
+        """
+        Sorts moves so that the most promising are searched first.
+
+        The move of the previous iteration's principal variation comes first,
+        then the best move stored in the transposition table, then captures and promotions by MVV-LVA (most valuable victim, least
+        valuable attacker), then the killer moves of this ply and finally the
+        quiet moves by their history score.
+        """
+        board = self.position.board
+        history = self.history
+        pv_move = self._previous_pv[ply] if ply < len(self._previous_pv) else 0
+        killer1, killer2 = self.killers[ply]
+
+        def score(move):
+            if move == pv_move:
+                return 1 << 30
+            if move == hash_move:
+                return 1 << 29
+            to_square, flag = move >> 6 & 63, move >> 12
+            victim = board[to_square] & 7
+            if flag == MOVE_EN_PASSANT:
+                victim = PAWN
+            if victim or flag >= MOVE_PROMOTION:
+                promotion = flag - 2 if flag >= MOVE_PROMOTION else EMPTY
+                return (1 << 28) + (victim + promotion) * 16 - (board[move & 63] & 7)
+            if move == killer1:
+                return (1 << 27) + 1
+            if move == killer2:
+                return 1 << 27
+            return history[board[move & 63]][to_square]
+
+        moves.sort(key=score, reverse=True)
+
+    def _store_quiet_cutoff(self, move, depth, ply):
+        """Remembers a quiet move that caused a beta cutoff as killer and in the history table."""
+        killers = self.killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+        row = self.history[self.position.board[move & 63]]
+        row[move >> 6 & 63] = min(row[move >> 6 & 63] + depth * depth, 1 << 26)
+
+_worker_engine = None
+
+def _search_root_move(task):
+    """
+    Searches the position after one root move in a worker process.
+
+    The position arrives packed, together with the keys of the earlier
+    positions that can still be repeated. The engine's tables are cleared
+    first, so the outcome does not depend on which tasks a worker ran before.
+
+    Returns:
+        tuple: (score from the root's point of view, nodes, pv, completed)
+    """
+    global _worker_engine
+    data, history, depth, deadline, max_nodes, hash_mb = task
+    position = Position.unpack(data)
+    position.key_stack = list(history)
+    if position.halfmove >= 100 or position.key in history:
+        return 0, 1, [], True
+    if next(position.generate_moves(), None) is None:
+        return (MATE - 1 if position.checkers else 0), 1, [], True
+    if _worker_engine is None or _worker_engine.tt.size_mb != hash_mb:
+        _worker_engine = Engine(hash_mb)
+    else:
+        _worker_engine.clear()
+    max_time = None
+    if deadline is not None:
+        max_time = deadline - time.time()
+        if max_time <= 0:
+            return 0, 0, [], False
+    result = _worker_engine.search(position, max_time, max_nodes, max_depth=depth)
+    score = -result.score
+    if score > MATE - MAX_PLY:
+        score -= 1
+    elif score < MAX_PLY - MATE:
+        score += 1
+    return score, result.nodes, result.pv, result.depth == depth
+
+def parallel_search(position, workers, max_time=None, max_nodes=None, max_depth=MAX_PLY, info=None,
+                    hash_mb=16):
+    """
+    Searches a position with a pool of worker processes.
+
+    Every iteration searches all root moves one ply less deep, spread over
+    the workers as compact packed positions. The best score wins and ties
+    go to the move searched first, so a search to a fixed depth gives the
+    same answer for any number of workers. The node budget is divided
+    evenly between the root moves of an iteration. A search one ply deep
+    is left to a single Engine, as it has no iteration to spread.
+
+    Args:
+        position (Position): The position to search; it is not modified.
+        workers (int): The number of worker processes.
+        max_time (float): The time budget in seconds, or None.
+        max_nodes (int): The node budget, or None.
+        max_depth (int): The deepest iteration to run.
+        info (callable): Called with a SearchResult after every completed iteration.
+        hash_mb (float): The transposition table size of every worker.
+
+    Returns:
+        SearchResult: The result of the deepest completed iteration.
+    """
+    if max_depth <= 1:
+        return Engine(hash_mb).search(position, max_time, max_nodes, max_depth, info)
+    start = time.perf_counter()
+    deadline = None if max_time is None else time.time() + max_time
+    position = position.copy()
+    moves = list(position.generate_moves())
+    result = SearchResult(0, 0, 0, 0, 0.0, [])
+    if not moves:
+        return result
+    keys = position.key_stack
+    history = keys[max(0, len(keys) - position.halfmove):] + [position.key]
+    packed = []
+    for move in moves:
+        position.make_move(move)
+        packed.append(position.pack())
+        position.unmake_move()
+    nodes = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for depth in range(1, max_depth):
+            node_share = None
+            if max_nodes is not None:
+                node_share = (max_nodes - nodes) // len(moves)
+                if node_share < 1:
+                    break
+            tasks = [(data, history, depth, deadline, node_share, hash_mb) for data in packed]
+            outcomes = list(executor.map(_search_root_move, tasks))
+            nodes += sum(outcome[1] for outcome in outcomes)
+            if not all(outcome[3] for outcome in outcomes):
+                break
+            order = sorted(range(len(moves)), key=lambda i: -outcomes[i][0])
+            moves = [moves[i] for i in order]
+            packed = [packed[i] for i in order]
+            outcomes = [outcomes[i] for i in order]
+            elapsed = time.perf_counter() - start
+            result = SearchResult(moves[0], outcomes[0][0], depth + 1, nodes, elapsed, [moves[0]] + outcomes[0][2])
+            if info:
+                info(result)
+            if result.mate_in is not None:
+                break
+            if max_time is not None and elapsed > max_time / 2:
+                break
+    if not result.move:
+        result.move = moves[0]
+        result.pv = [moves[0]]
+    result.nodes = nodes
+    result.time = time.perf_counter() - start
+    return result
+
+def format_score(result):
+    """Formats the score of a SearchResult in pawns or as a mate announcement."""
+    if result.mate_in is not None:
+        return "mate %d" % result.mate_in
+    return "%+.2f" % (result.score / 100.0)
+
+def bench(depth=5, workers=1):
+    """
+    Searches the start position to a fixed depth and reports the engine's throughput.
+
+    Args:
+        depth (int): The depth to search.
+        workers (int): The number of processes; more than one uses parallel_search.
+
+    Returns:
+        SearchResult: The result of the search.
+    """
+    position = Position.from_fen(START_FEN)
+    if workers > 1:
+        result = parallel_search(position, workers, max_depth=depth)
+    else:
+        result = Engine().search(position, max_depth=depth)
+    print("depth %d  nodes %d  time %.2fs  nps %d" % (result.depth, result.nodes, result.time, result.nps))
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Searches the start position to a fixed depth to measure the engine's speed.")
+    parser.add_argument("depth", type=int, nargs="?", default=5, help="depth to search (default: 5)")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes (default: 1)")
+    args = parser.parse_args(argv)
+    bench(args.depth, args.workers)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,587 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Static evaluation of chess positions.
+
+The score sums five terms, each with a middlegame and an endgame weight:
+material, piece-square tables, mobility (the squares attacked by the
+knights, bishops, rooks and queens of a side), pawn structure (doubled,
+isolated and passed pawns) and king safety (the pawn shield and the
+attacks on the squares around the king). The two sums are blended by the
+game phase, which falls from 24 with all pieces on the board to 0 when
+only kings and pawns are left.
+
+There are two ways to evaluate:
+
+* evaluate() and Evaluator score one Position at a time, for the search.
+  An Evaluator updates material and piece-square sums with every move it
+  plays and keeps the pawn structure of recent positions cached, so only
+  mobility and king safety are computed afresh.
+* evaluate_planes() scores a whole batch of positions at once with NumPy,
+  from an (N, 12, 64) array of piece planes (see to_planes()). It gives
+  the same scores as evaluate() and is meant for grading game databases.
+  NumPy is only needed for this path.
+
+Run as a script (python -m evaluate GAMES.pgn) it scores every position of
+a PGN archive in batches and reports the positions per second.
+"""
+
+import argparse
+import csv
+import sys
+import time
+
+from pyChess import (WHITE, BLACK, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, MOVE_CASTLING, MOVE_EN_PASSANT,
+                     MOVE_PROMOTION, CASTLING_ROOK_MOVES, KNIGHT_ATTACKS, KING_ATTACKS,
+                     bishop_attacks, rook_attacks, queen_attacks)
+
+__author__ = "Michael Krisper"
+
+MIDDLEGAME_VALUES = (0, 100, 320, 330, 500, 900, 0, 0)
+ENDGAME_VALUES = (0, 120, 300, 320, 520, 940, 0, 0)
+
+# Game phase: a knight or bishop counts 1, a rook 2, a queen 4.
+PHASE_WEIGHTS = (0, 0, 1, 1, 2, 4, 0, 0)
+MAX_PHASE = 24
+
+# Piece-square tables from white's point of view, written with rank 8 at the top.
+_MIDDLEGAME_SQUARES = {
+    PAWN: (0,  0,  0,  0,  0,  0,  0,  0,
+           50, 50, 50, 50, 50, 50, 50, 50,
+           10, 10, 20, 30, 30, 20, 10, 10,
+           5,  5, 10, 25, 25, 10,  5,  5,
+           0,  0,  0, 20, 20,  0,  0,  0,
+           5, -5,-10,  0,  0,-10, -5,  5,
+           5, 10, 10,-20,-20, 10, 10,  5,
+           0,  0,  0,  0,  0,  0,  0,  0),
+    KNIGHT: (-50,-40,-30,-30,-30,-30,-40,-50,
+             -40,-20,  0,  0,  0,  0,-20,-40,
+             -30,  0, 10, 15, 15, 10,  0,-30,
+             -30,  5, 15, 20, 20, 15,  5,-30,
+             -30,  0, 15, 20, 20, 15,  0,-30,
+             -30,  5, 10, 15, 15, 10,  5,-30,
+             -40,-20,  0,  5,  5,  0,-20,-40,
+             -50,-40,-30,-30,-30,-30,-40,-50),
+    BISHOP: (-20,-10,-10,-10,-10,-10,-10,-20,
+             -10,  0,  0,  0,  0,  0,  0,-10,
+             -10,  0,  5, 10, 10,  5,  0,-10,
+             -10,  5,  5, 10, 10,  5,  5,-10,
+             -10,  0, 10, 10, 10, 10,  0,-10,
+             -10, 10, 10, 10, 10, 10, 10,-10,
+             -10,  5,  0,  0,  0,  0,  5,-10,
+             -20,-10,-10,-10,-10,-10,-10,-20),
+    ROOK: (0,  0,  0,  0,  0,  0,  0,  0,
+           5, 10, 10, 10, 10, 10, 10,  5,
+           -5,  0,  0,  0,  0,  0,  0, -5,
+           -5,  0,  0,  0,  0,  0,  0, -5,
+           -5,  0,  0,  0,  0,  0,  0, -5,
+           -5,  0,  0,  0,  0,  0,  0, -5,
+           -5,  0,  0,  0,  0,  0,  0, -5,
+           0,  0,  0,  5,  5,  0,  0,  0),
+    QUEEN: (-20,-10,-10, -5, -5,-10,-10,-20,
+            -10,  0,  0,  0,  0,  0,  0,-10,
+            -10,  0,  5,  5,  5,  5,  0,-10,
+            -5,  0,  5,  5,  5,  5,  0, -5,
+            0,  0,  5,  5,  5,  5,  0, -5,
+            -10,  5,  5,  5,  5,  5,  0,-10,
+            -10,  0,  5,  0,  0,  0,  0,-10,
+            -20,-10,-10, -5, -5,-10,-10,-20),
+    KING: (-30,-40,-40,-50,-50,-40,-40,-30,
+           -30,-40,-40,-50,-50,-40,-40,-30,
+           -30,-40,-40,-50,-50,-40,-40,-30,
+           -30,-40,-40,-50,-50,-40,-40,-30,
+           -20,-30,-30,-40,-40,-30,-30,-20,
+           -10,-20,-20,-20,-20,-20,-20,-10,
+           20, 20,  0,  0,  0,  0, 20, 20,
+           20, 30, 10,  0,  0, 10, 30, 20),
+}
+
+# In the endgame pawns gain by advancing and the king belongs in the centre.
+_ENDGAME_SQUARES = dict(_MIDDLEGAME_SQUARES)
+_ENDGAME_SQUARES[PAWN] = (0,  0,  0,  0,  0,  0,  0,  0,
+                          80, 80, 80, 80, 80, 80, 80, 80,
+                          50, 50, 50, 50, 50, 50, 50, 50,
+                          30, 30, 30, 30, 30, 30, 30, 30,
+                          15, 15, 15, 15, 15, 15, 15, 15,
+                          5,  5,  5,  5,  5,  5,  5,  5,
+                          0,  0,  0,  0,  0,  0,  0,  0,
+                          0,  0,  0,  0,  0,  0,  0,  0)
+_ENDGAME_SQUARES[KING] = (-50,-40,-30,-20,-20,-30,-40,-50,
+                          -30,-20,-10,  0,  0,-10,-20,-30,
+                          -30,-10, 20, 30, 30, 20,-10,-30,
+                          -30,-10, 30, 40, 40, 30,-10,-30,
+                          -30,-10, 30, 40, 40, 30,-10,-30,
+                          -30,-10, 20, 30, 30, 20,-10,-30,
+                          -30,-30,  0,  0,  0,  0,-30,-30,
+                          -50,-30,-30,-30,-30,-30,-30,-50)
+
+def _score_table(values, squares):
+    """Returns [code][square] scores, material plus placement, positive for white."""
+    table = [[0] * 64 for _ in range(16)]
+    for kind, kind_squares in squares.items():
+        for square in range(64):
+            table[kind | WHITE << 3][square] = values[kind] + kind_squares[square ^ 56]
+            table[kind | BLACK << 3][square] = -values[kind] - kind_squares[square]
+    return table
+
+MIDDLEGAME_SCORES = _score_table(MIDDLEGAME_VALUES, _MIDDLEGAME_SQUARES)
+ENDGAME_SCORES = _score_table(ENDGAME_VALUES, _ENDGAME_SQUARES)
+
+# (middlegame, endgame) per attacked square not occupied by an own piece.
+MOBILITY_WEIGHTS = {KNIGHT: (4, 4), BISHOP: (5, 5), ROOK: (2, 4), QUEEN: (1, 2)}
+# (middlegame, endgame) per pawn
+DOUBLED_PAWN = (-10, -20)
+ISOLATED_PAWN = (-10, -15)
+# (middlegame, endgame) for a passed pawn by the rank it has reached, counted from its own side
+PASSED_PAWN = ((0, 0), (5, 10), (10, 20), (15, 35), (25, 55), (40, 80), (60, 110), (0, 0))
+# Middlegame only: per shield pawn one and two ranks in front of the king, per attacked square around it.
+PAWN_SHIELD = (10, 5)
+KING_ZONE_ATTACK = -8
+
+FILES = [0x0101010101010101 << file for file in range(8)]
+ADJACENT_FILES = [(FILES[file - 1] if file > 0 else 0) | (FILES[file + 1] if file < 7 else 0) for file in range(8)]
+
+def _front_span(color, square):
+    """The squares in front of a square, on its own and the adjacent files, seen from a colour."""
+    row = square >> 3
+    rows = range(row + 1, 8) if color == WHITE else range(row)
+    files = FILES[square & 7] | ADJACENT_FILES[square & 7]
+    return sum(0xff << 8 * other for other in rows) & files
+
+# PASSED_SPANS[color][square]: a pawn there is passed if no enemy pawn stands on these squares.
+PASSED_SPANS = [[_front_span(color, square) for square in range(64)] for color in (WHITE, BLACK)]
+
+def _shield(color, square, distance):
+    """The three squares distance ranks in front of a king."""
+    row = (square >> 3) + (distance if color == WHITE else -distance)
+    if not 0 <= row < 8:
+        return 0
+    return 0xff << 8 * row & (FILES[square & 7] | ADJACENT_FILES[square & 7])
+
+SHIELDS = [[(_shield(color, square, 1), _shield(color, square, 2)) for square in range(64)]
+           for color in (WHITE, BLACK)]
+KING_ZONES = [KING_ATTACKS[square] | 1 << square for square in range(64)]
+
+# (kind, attack function, middlegame weight, endgame weight) for the mobility term
+_MOBILITY = tuple((kind, attacks) + MOBILITY_WEIGHTS[kind]
+                  for kind, attacks in ((KNIGHT, lambda square, occupied: KNIGHT_ATTACKS[square]),
+                                        (BISHOP, bishop_attacks), (ROOK, rook_attacks), (QUEEN, queen_attacks)))
+
+def _count(bitboard):
+    return bin(bitboard).count("1")
+
+def _squares(bitboard):
+    while bitboard:
+        low = bitboard & -bitboard
+        yield low.bit_length() - 1
+        bitboard ^= low
+
+def material(position):
+    """
+    Sums the material and piece-square scores of a position.
+
+    Returns:
+        tuple: (middlegame score, endgame score, phase), the scores positive for white.
+    """
+    middlegame = endgame = phase = 0
+    for color in (WHITE, BLACK):
+        for square, code in position.pieces(color):
+            middlegame += MIDDLEGAME_SCORES[code][square]
+            endgame += ENDGAME_SCORES[code][square]
+            phase += PHASE_WEIGHTS[code & 7]
+    return middlegame, endgame, phase
+
+def pawn_structure(white_pawns, black_pawns):
+    """
+    Scores doubled, isolated and passed pawns.
+
+    Returns:
+        tuple: (middlegame score, endgame score), positive for white.
+    """
+    middlegame = endgame = 0
+    for color, pawns, enemy_pawns, sign in ((WHITE, white_pawns, black_pawns, 1), (BLACK, black_pawns, white_pawns, -1)):
+        for file in range(8):
+            count = _count(pawns & FILES[file])
+            if count > 1:
+                middlegame += sign * DOUBLED_PAWN[0] * (count - 1)
+                endgame += sign * DOUBLED_PAWN[1] * (count - 1)
+            if count and not pawns & ADJACENT_FILES[file]:
+                middlegame += sign * ISOLATED_PAWN[0] * count
+                endgame += sign * ISOLATED_PAWN[1] * count
+        for square in _squares(pawns):
+            if not PASSED_SPANS[color][square] & enemy_pawns:
+                rank = square >> 3 if color == WHITE else 7 - (square >> 3)
+                middlegame += sign * PASSED_PAWN[rank][0]
+                endgame += sign * PASSED_PAWN[rank][1]
+    return middlegame, endgame
+
+def activity(position):
+    """
+    Scores mobility and king safety.
+
+    Mobility counts, per side and piece type, the squares attacked by any
+    piece of that type that are not occupied by an own piece. King safety
+    counts the own pawns in front of the king and the squares around it
+    attacked by enemy knights, bishops, rooks and queens.
+
+    Returns:
+        tuple: (middlegame score, endgame score), positive for white.
+    """
+    bitboards = position.bitboards
+    occupied = position.occupied[WHITE] | position.occupied[BLACK]
+    middlegame = endgame = 0
+    attacked = [0, 0]
+    for color, sign in ((WHITE, 1), (BLACK, -1)):
+        not_own = ~position.occupied[color]
+        for kind, attacks, middlegame_weight, endgame_weight in _MOBILITY:
+            pieces = bitboards[kind | color << 3]
+            if not pieces:
+                continue
+            union = 0
+            while pieces:
+                low = pieces & -pieces
+                union |= attacks(low.bit_length() - 1, occupied)
+                pieces ^= low
+            attacked[color] |= union
+            count = bin(union & not_own).count("1")
+            middlegame += sign * middlegame_weight * count
+            endgame += sign * endgame_weight * count
+    for color, sign in ((WHITE, 1), (BLACK, -1)):
+        king = bitboards[KING | color << 3]
+        if not king:
+            continue
+        square = king.bit_length() - 1
+        pawns = bitboards[PAWN | color << 3]
+        near, far = SHIELDS[color][square]
+        middlegame += sign * (PAWN_SHIELD[0] * _count(pawns & near) + PAWN_SHIELD[1] * _count(pawns & far)
+                              + KING_ZONE_ATTACK * _count(KING_ZONES[square] & attacked[color ^ 1]))
+    return middlegame, endgame
+
+def taper(middlegame, endgame, phase):
+    """Blends a middlegame and an endgame score by the game phase."""
+    phase = min(phase, MAX_PHASE)
+    return (middlegame * phase + endgame * (MAX_PHASE - phase)) // MAX_PHASE
+
+def evaluate(position):
+    """
+    Evaluates a position statically.
+
+    Returns:
+        int: The score in centipawns from the point of view of the side to move.
+    """
+    middlegame, endgame, phase = material(position)
+    pawns = pawn_structure(position.bitboards[PAWN | WHITE << 3], position.bitboards[PAWN | BLACK << 3])
+    active = activity(position)
+    score = taper(middlegame + pawns[0] + active[0], endgame + pawns[1] + active[1], phase)
+    return -score if position.side == BLACK else score
+
+class Evaluator(object):
+    """
+    Evaluates the positions of a search incrementally.
+
+    Moves are played through the Evaluator, which updates the material and
+    piece-square sums and the phase from the move alone and takes the
+    updates back with the move. Pawn structures are cached by the placement
+    of the pawns, which changes rarely in a search.
+    """
+    PAWN_CACHE_SIZE = 1 << 16
+
+    def __init__(self, position):
+        """
+        Initializes an Evaluator.
+
+        Args:
+            position (Position): The position to evaluate; the Evaluator plays its moves on it.
+        """
+        self.position = position
+        self.middlegame, self.endgame, self.phase = material(position)
+        self._stack = []
+        self._pawn_cache = {}
+        self.pawn_hits = 0
+        self.pawn_misses = 0
+
+    def make_move(self, move):
+        """Plays a move on the position and updates the sums."""
+        position = self.position
+        board = position.board
+        from_square, to_square, flag = move & 63, move >> 6 & 63, move >> 12
+        code = board[from_square]
+        self._stack.append((self.middlegame, self.endgame, self.phase))
+        middlegame = MIDDLEGAME_SCORES[code][to_square] - MIDDLEGAME_SCORES[code][from_square]
+        endgame = ENDGAME_SCORES[code][to_square] - ENDGAME_SCORES[code][from_square]
+        captured_square = to_square
+        if flag == MOVE_EN_PASSANT:
+            captured_square = to_square - 8 if code >> 3 == WHITE else to_square + 8
+        captured = board[captured_square]
+        if captured:
+            middlegame -= MIDDLEGAME_SCORES[captured][captured_square]
+            endgame -= ENDGAME_SCORES[captured][captured_square]
+            self.phase -= PHASE_WEIGHTS[captured & 7]
+        if flag >= MOVE_PROMOTION:
+            promoted = flag - 2 | code & 8
+            middlegame += MIDDLEGAME_SCORES[promoted][to_square] - MIDDLEGAME_SCORES[code][to_square]
+            endgame += ENDGAME_SCORES[promoted][to_square] - ENDGAME_SCORES[code][to_square]
+            self.phase += PHASE_WEIGHTS[flag - 2]
+        elif flag == MOVE_CASTLING:
+            rook_from, rook_to = CASTLING_ROOK_MOVES[to_square]
+            rook = ROOK | code & 8
+            middlegame += MIDDLEGAME_SCORES[rook][rook_to] - MIDDLEGAME_SCORES[rook][rook_from]
+            endgame += ENDGAME_SCORES[rook][rook_to] - ENDGAME_SCORES[rook][rook_from]
+        self.middlegame += middlegame
+        self.endgame += endgame
+        position.make_move(move)
+
+    def unmake_move(self):
+        """Takes back the last move and its updates."""
+        self.position.unmake_move()
+        self.middlegame, self.endgame, self.phase = self._stack.pop()
+
+    def evaluate(self):
+        """
+        Evaluates the current position; the same score as evaluate(position).
+
+        Returns:
+            int: The score in centipawns from the point of view of the side to move.
+        """
+        position = self.position
+        key = (position.bitboards[PAWN], position.bitboards[PAWN | BLACK << 3])
+        pawns = self._pawn_cache.get(key)
+        if pawns is None:
+            self.pawn_misses += 1
+            if len(self._pawn_cache) >= self.PAWN_CACHE_SIZE:
+                self._pawn_cache.clear()
+            pawns = self._pawn_cache[key] = pawn_structure(*key)
+        else:
+            self.pawn_hits += 1
+        active = activity(position)
+        score = taper(self.middlegame + pawns[0] + active[0], self.endgame + pawns[1] + active[1], self.phase)
+        return -score if position.side == BLACK else score
+
+# The batch path. Planes are ordered white pawn, knight, bishop, rook, queen,
+# king, then the black pieces in the same order. The planes are packed into one
+# 64-bit bitboard per piece type and position, and the attack sets of all
+# positions are computed at once by shifting whole arrays of bitboards.
+
+def to_planes(positions):
+    """
+    Encodes positions as piece planes.
+
+    Args:
+        positions: An iterable of Position objects.
+
+    Returns:
+        tuple: (planes, sides) with planes a uint8 array of shape (N, 12, 64),
+               1 where a piece stands, and sides the N colours to move.
+    """
+    import numpy as np
+    positions = list(positions)
+    codes = [kind | color << 3 for color in (WHITE, BLACK) for kind in range(PAWN, KING + 1)]
+    bitboards = np.array([[position.bitboards[code] for code in codes] for position in positions],
+                         dtype="<u8").reshape(len(positions), 12)
+    planes = np.unpackbits(bitboards.view(np.uint8).reshape(len(positions), 12, 8), axis=2, bitorder="little")
+    sides = np.array([position.side for position in positions], dtype=np.int8)
+    return planes, sides
+
+def _file_mask(x):
+    """The squares a shift by x files can reach without wrapping around the board."""
+    files = range(x, 8) if x >= 0 else range(8 + x)
+    return sum(FILES[file] for file in files)
+
+class _Batch(object):
+    """Bitboard arithmetic on NumPy arrays of uint64, one bitboard per position."""
+
+    def __init__(self, np):
+        """Precomputes the masks and tables as NumPy values."""
+        self.np = np
+        self.rank_masks = [np.uint64(0xff << 8 * rank) for rank in range(8)]
+        self.file_masks = [np.uint64(mask) for mask in FILES]
+        self.adjacent_masks = [np.uint64(mask) for mask in ADJACENT_FILES]
+        self.king_zones = np.array(KING_ZONES + [0], dtype=np.uint64)
+        self.shields = [[np.array([shield[distance] for shield in SHIELDS[color]] + [0], dtype=np.uint64)
+                         for distance in (0, 1)] for color in (WHITE, BLACK)]
+        self.middlegame_table = np.array([MIDDLEGAME_SCORES[kind | color << 3] for color in (WHITE, BLACK)
+                                          for kind in range(PAWN, KING + 1)], dtype=np.float64).reshape(-1)
+        self.endgame_table = np.array([ENDGAME_SCORES[kind | color << 3] for color in (WHITE, BLACK)
+                                       for kind in range(PAWN, KING + 1)], dtype=np.float64).reshape(-1)
+        self.phase_table = np.array([PHASE_WEIGHTS[kind] for _ in (WHITE, BLACK)
+                                     for kind in range(PAWN, KING + 1)], dtype=np.int64)
+
+    def shift(self, boards, x, y):
+        """Moves every square x files and y ranks; squares leaving the board are dropped."""
+        np = self.np
+        amount = y * 8 + x
+        if amount >= 0:
+            shifted = np.left_shift(boards, np.uint64(amount))
+        else:
+            shifted = np.right_shift(boards, np.uint64(-amount))
+        return shifted & np.uint64(_file_mask(x)) if x else shifted
+
+    def count(self, boards):
+        """Counts the squares of every bitboard."""
+        np = self.np
+        if hasattr(np, "bitwise_count"):
+            return np.bitwise_count(boards).astype(np.int64)
+        counts = np.zeros(boards.shape, dtype=np.int64)
+        for byte in range(8):
+            part = (boards >> np.uint64(8 * byte)) & np.uint64(255)
+            counts += np.unpackbits(part.astype(np.uint8)[..., None], axis=-1).sum(axis=-1)
+        return counts
+
+    def slide(self, pieces, empty, directions):
+        """Returns the squares attacked along the directions, through empty squares only."""
+        attacks = self.np.zeros_like(pieces)
+        for x, y in directions:
+            ray = pieces
+            for _ in range(7):
+                ray = self.shift(ray, x, y)
+                attacks |= ray
+                ray = ray & empty
+                if not ray.any():
+                    break
+        return attacks
+
+    def square_of(self, boards):
+        """Returns the lowest square of every bitboard, 64 for an empty one."""
+        np = self.np
+        lowest = boards & (~boards + np.uint64(1))
+        squares = np.full(boards.shape, 64, dtype=np.int64)
+        found = lowest != 0
+        squares[found] = np.log2(lowest[found].astype(np.float64)).astype(np.int64)
+        return squares
+
+_batch = []
+
+def evaluate_planes(planes, sides=None):
+    """
+    Evaluates a batch of positions given as piece planes with NumPy.
+
+    Args:
+        planes: An array of shape (N, 12, 64), as made by to_planes().
+        sides: The colours to move (0 white, 1 black), by default white for all.
+
+    Returns:
+        numpy.ndarray: N scores in centipawns from the point of view of the
+                       side to move; equal to evaluate() on each position.
+    """
+    import numpy as np
+    from pyChess import KNIGHT_OFFSETS, ROOK_DIRECTIONS, BISHOP_DIRECTIONS
+    if not _batch:
+        _batch.append(_Batch(np))
+    batch = _batch[0]
+    planes = np.asarray(planes, dtype=np.uint8)
+    count = planes.shape[0]
+    flat = planes.reshape(count, 12 * 64).astype(np.float64)
+    middlegame = np.rint(flat @ batch.middlegame_table).astype(np.int64)
+    endgame = np.rint(flat @ batch.endgame_table).astype(np.int64)
+    phase = planes.sum(axis=2, dtype=np.int64) @ batch.phase_table
+
+    bitboards = np.packbits(planes, axis=2, bitorder="little").view("<u8").reshape(count, 12)
+    pieces = [[bitboards[:, color * 6 + kind - 1] for kind in range(KING + 1)] for color in (WHITE, BLACK)]
+    own = [np.bitwise_or.reduce(bitboards[:, 0:6], axis=1), np.bitwise_or.reduce(bitboards[:, 6:12], axis=1)]
+    empty = ~(own[WHITE] | own[BLACK])
+    attacked = []
+    for color, sign in ((WHITE, 1), (BLACK, -1)):
+        attacked_by_color = np.zeros(count, dtype=np.uint64)
+        for kind in (KNIGHT, BISHOP, ROOK, QUEEN):
+            if kind == KNIGHT:
+                union = np.zeros(count, dtype=np.uint64)
+                for x, y in KNIGHT_OFFSETS:
+                    union |= batch.shift(pieces[color][kind], x, y)
+            else:
+                directions = {BISHOP: BISHOP_DIRECTIONS, ROOK: ROOK_DIRECTIONS,
+                              QUEEN: ROOK_DIRECTIONS + BISHOP_DIRECTIONS}[kind]
+                union = batch.slide(pieces[color][kind], empty, directions)
+            attacked_by_color |= union
+            mobility = batch.count(union & ~own[color])
+            middlegame += sign * MOBILITY_WEIGHTS[kind][0] * mobility
+            endgame += sign * MOBILITY_WEIGHTS[kind][1] * mobility
+        attacked.append(attacked_by_color)
+
+    for color, sign in ((WHITE, 1), (BLACK, -1)):
+        pawns = pieces[color][PAWN]
+        for file in range(8):
+            on_file = batch.count(pawns & batch.file_masks[file])
+            isolated = np.where((pawns & batch.adjacent_masks[file]) == 0, on_file, 0)
+            middlegame += sign * (DOUBLED_PAWN[0] * np.maximum(on_file - 1, 0) + ISOLATED_PAWN[0] * isolated)
+            endgame += sign * (DOUBLED_PAWN[1] * np.maximum(on_file - 1, 0) + ISOLATED_PAWN[1] * isolated)
+        # The squares behind the enemy pawns, as seen from this side, and the files beside them.
+        span = batch.shift(pieces[color ^ 1][PAWN], 0, -1 if color == WHITE else 1)
+        for distance in (1, 2, 4):
+            span |= batch.shift(span, 0, -distance if color == WHITE else distance)
+        span |= batch.shift(span, 1, 0) | batch.shift(span, -1, 0)
+        passed = pawns & ~span
+        for rank in range(8):
+            passed_count = batch.count(passed & batch.rank_masks[rank if color == WHITE else 7 - rank])
+            middlegame += sign * PASSED_PAWN[rank][0] * passed_count
+            endgame += sign * PASSED_PAWN[rank][1] * passed_count
+        king = batch.square_of(pieces[color][KING])
+        shield = PAWN_SHIELD[0] * batch.count(pawns & batch.shields[color][0][king]) \
+               + PAWN_SHIELD[1] * batch.count(pawns & batch.shields[color][1][king])
+        zone_attacks = batch.count(batch.king_zones[king] & attacked[color ^ 1])
+        middlegame += sign * (shield + KING_ZONE_ATTACK * zone_attacks)
+
+    phase = np.minimum(phase, MAX_PHASE)
+    score = (middlegame * phase + endgame * (MAX_PHASE - phase)) // MAX_PHASE
+    if sides is not None:
+        score = np.where(np.asarray(sides) == BLACK, -score, score)
+    return score
+
+def grade_games(games, batch_size=4096):
+    """
+    Scores every position of a stream of games in batches.
+
+    Args:
+        games: An iterable of pgn.PgnGame, e.g. from pgn.read_games().
+        batch_size (int): The number of positions evaluated at once.
+
+    Yields:
+        tuple: (game number, ply, score) for the position after every ply,
+               the score in centipawns from white's point of view.
+    """
+    pending, labels = [], []
+
+    def flush():
+        planes, _ = to_planes(pending)
+        for label, score in zip(labels, evaluate_planes(planes)):
+            yield label + (int(score),)
+        del pending[:], labels[:]
+
+    for number, game in enumerate(games, start=1):
+        for ply, (position, move) in enumerate(game.replay(), start=1):
+            position.make_move(move)
+            pending.append(position.copy())
+            labels.append((number, ply))
+            position.unmake_move()
+            if len(pending) >= batch_size:
+                yield from flush()
+    if pending:
+        yield from flush()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scores every position of a PGN archive with the batch evaluation.")
+    parser.add_argument("file", help="the PGN file to read ('-' for standard input)")
+    parser.add_argument("--output", metavar="FILE", help="write 'game,ply,score' rows as CSV to FILE")
+    parser.add_argument("--batch-size", type=int, default=4096, help="positions evaluated at once (default: 4096)")
+    args = parser.parse_args(argv)
+    import pgn
+    source = sys.stdin if args.file == "-" else args.file
+    out = open(args.output, "w", newline="") if args.output else None
+    writer = csv.writer(out) if out else None
+    positions = games = 0
+    start = time.perf_counter()
+    try:
+        for game, ply, score in grade_games(pgn.read_games(source), args.batch_size):
+            positions += 1
+            games = game
+            if writer:
+                writer.writerow((game, ply, score))
+    finally:
+        if out:
+            out.close()
+    elapsed = time.perf_counter() - start
+    print("%d games, %d positions in %.2fs: %d positions/s"
+          % (games, positions, elapsed, positions / elapsed if elapsed else 0))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Headless matches between two players, for regression tests of the engine and the rules.
+
+play_game() plays one game on a Game whose output and board drawing are
+switched off, so the usual draw adjudication (threefold repetition, the
+50-move rule, insufficient material) decides it and nothing waits for
+input; promotions are part of the moves the players choose. run_match()
+plays many games over a pool of worker processes, alternating colors,
+and summarize() turns the results into win/draw/loss counts and an Elo
+difference with its 95% error bars.
+
+A player is given as a spec string (see PLAYER_TYPES):
+
+    random       plays a random legal move
+    engine:D     the engine searching to depth D (default 3)
+
+Run as a script: python -m match engine:3 random --games 200 --workers 8
+"""
+
+import argparse
+import math
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from pyChess import Game, Queen, START_FEN
+
+__author__ = "Michael Krisper"
+
+class RandomMover(object):
+    """Plays a uniformly random legal move."""
+
+    def __init__(self, argument=""):
+        if argument:
+            raise ValueError("Error: The random player takes no argument.")
+
+    def new_game(self):
+        """Prepares for a new game."""
+
+    def choose(self, game, rng):
+        """Returns the encoded move to play in the game's position."""
+        return rng.choice(game.legality_cache.legal_moves(game.position))
+
+class EngineMover(object):
+    """Plays the move the engine finds at a fixed depth."""
+
+    def __init__(self, argument=""):
+        """
+        Args:
+            argument (str): The search depth, by default 3.
+        """
+        from engine import Engine
+        try:
+            self.depth = int(argument) if argument else 3
+        except ValueError:
+            raise ValueError("Error: The engine's depth must be a number: %s" % argument)
+        self.engine = Engine()
+
+    def new_game(self):
+        """Forgets the previous game, so that every game is searched alike."""
+        self.engine.clear()
+
+    def choose(self, game, rng):
+        """Returns the encoded move to play in the game's position."""
+        return self.engine.search(game.position, max_depth=self.depth).move
+
+# spec name -> class taking the text after the colon
+PLAYER_TYPES = {
+    "random": RandomMover,
+    "engine": EngineMover,
+}
+
+def make_player(spec):
+    """
+    Creates a player from a spec such as 'random' or 'engine:4'.
+
+    Raises:
+        ValueError: If the spec names no known player type.
+    """
+    name, _, argument = spec.partition(":")
+    if name not in PLAYER_TYPES:
+        raise ValueError("Error: Unknown player '%s' (expected one of: %s)" % (spec, ", ".join(PLAYER_TYPES)))
+    return PLAYER_TYPES[name](argument)
+
+def play_game(white, black, rng, opening_plies=0, max_plies=400, fen=START_FEN, opening_rng=None):
+    """
+    Plays one game between two players.
+
+    Args:
+        white, black: Players with choose(game, rng) and new_game().
+        rng (random.Random): The random numbers of the game.
+        opening_plies (int): Plies played at random before the players take
+                             over, so that deterministic players do not
+                             repeat the same game.
+        max_plies (int): Games still running after this many plies are drawn.
+        fen (str): The start position.
+        opening_rng (random.Random): The random numbers of the opening, by default rng.
+
+    Returns:
+        tuple: (result, reason, moves) with result 1 if white won, 0.5 for a
+               draw and 0 if black won, reason the announcement of the result
+               and moves the encoded moves played.
+    """
+    game = Game(fen)
+    game.output = lambda text: None
+    game.renderer.set_mode("off")
+    game.choose_promotion = lambda player: Queen
+    players = (white, black)
+    for player in players:
+        player.new_game()
+    plies = 0
+    while True:
+        reason = game.get_result()
+        if reason:
+            break
+        if plies >= max_plies:
+            return 0.5, "Draw by move limit.", game.get_moves()
+        position = game.position
+        if plies < opening_plies:
+            code = (opening_rng or rng).choice(game.legality_cache.legal_moves(position))
+        else:
+            code = players[position.side].choose(game, rng)
+        game.make_move(game.get_move(code))
+        plies += 1
+    if game.position.checkers and not game.has_legal_moves(game.current_player()):
+        return (0.0 if game.position.side == 0 else 1.0), reason, game.get_moves()
+    return 0.5, reason, game.get_moves()
+
+# the players of a worker process, created once per spec
+_worker_players = {}
+
+def _worker_player(spec):
+    if spec not in _worker_players:
+        _worker_players[spec] = make_player(spec)
+    return _worker_players[spec]
+
+def _game_task(task):
+    """
+    Plays game number 'index' of a match in a worker process; player A is white in the even games.
+
+    Returns:
+        tuple: (score of A, reason, moves).
+    """
+    index, spec_a, spec_b, seed, opening_plies, max_plies = task
+    a, b = _worker_player(spec_a), _worker_player(spec_b)
+    rng = random.Random(seed * 1000003 + index)
+    a_white = index % 2 == 0
+    # both colors of a pair share the opening
+    opening_rng = random.Random(seed * 1000003 + index // 2)
+    result, reason, moves = play_game(a if a_white else b, b if a_white else a, rng, opening_plies, max_plies,
+                                      opening_rng=opening_rng)
+    return (result if a_white else 1.0 - result), reason, moves
+
+def run_match(spec_a, spec_b, games, workers=1, seed=1, opening_plies=4, max_plies=400):
+    """
+    Plays a match, player A taking white in the even and black in the odd games.
+
+    Each pair of games starts from the same random opening with the colors
+    reversed.
+
+    Yields:
+        tuple: (score of A, reason, encoded moves) per game, in game order.
+    """
+    tasks = [(index, spec_a, spec_b, seed, opening_plies, max_plies) for index in range(games)]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            yield from executor.map(_game_task, tasks)
+    else:
+        for task in tasks:
+            yield _game_task(task)
+
+def elo_difference(score):
+    """Returns the Elo difference implied by a score fraction, infinite for 0 or 1."""
+    if score <= 0.0:
+        return -math.inf
+    if score >= 1.0:
+        return math.inf
+    return -400.0 * math.log10(1.0 / score - 1.0)
+
+def summarize(results):
+    """
+    Sums up the results of player A.
+
+    Args:
+        results (list): Scores of player A, 1, 0.5 or 0 per game.
+
+    Returns:
+        dict: wins, draws, losses, score (fraction), elo and the 95% bounds elo_low and elo_high.
+    """
+    games = len(results)
+    wins, draws = results.count(1.0), results.count(0.5)
+    losses = games - wins - draws
+    score = sum(results) / games if games else 0.5
+    # standard error of the mean score per game
+    variance = sum((result - score) ** 2 for result in results) / games if games else 0.0
+    error = 1.96 * math.sqrt(variance / games) if games else 0.0
+    return {"games": games, "wins": wins, "draws": draws, "losses": losses, "score": score,
+            "elo": elo_difference(score), "elo_low": elo_difference(score - error),
+            "elo_high": elo_difference(score + error)}
+
+def _format_elo(value):
+    return "%+.1f" % value if math.isfinite(value) else ("+inf" if value > 0 else "-inf")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Plays a headless match between two players.")
+    parser.add_argument("player_a", help="player A, e.g. 'engine:3' or 'random'")
+    parser.add_argument("player_b", help="player B")
+    parser.add_argument("--games", type=int, default=100, help="number of games (default: 100)")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes (default: 1)")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the random openings and players (default: 1)")
+    parser.add_argument("--opening-plies", type=int, default=4,
+                        help="random plies at the start of every game pair (default: 4)")
+    parser.add_argument("--max-plies", type=int, default=400,
+                        help="games longer than this are drawn (default: 400)")
+    parser.add_argument("--archive", metavar="FILE", help="append every game to a binary game archive")
+    args = parser.parse_args(argv)
+    try:
+        make_player(args.player_a)
+        make_player(args.player_b)
+    except ValueError as err:
+        print(err)
+        return 2
+    writer = None
+    if args.archive:
+        import archive
+        writer = archive.ArchiveWriter(args.archive)
+    start = time.perf_counter()
+    results, reasons, total_plies = [], {}, 0
+    for index, (score, reason, moves) in enumerate(run_match(args.player_a, args.player_b, args.games,
+                                                             max(1, args.workers), args.seed, args.opening_plies,
+                                                             args.max_plies)):
+        results.append(score)
+        total_plies += len(moves)
+        if writer is not None:
+            a_white = index % 2 == 0
+            white_score = score if a_white else 1.0 - score
+            players = (args.player_a, args.player_b) if a_white else (args.player_b, args.player_a)
+            writer.append(moves, {"Event": "match", "Round": str(index + 1), "White": players[0],
+                                  "Black": players[1]}, result={1.0: "1-0", 0.0: "0-1"}.get(white_score, "1/2-1/2"))
+        # the winner's name is left out so that both colors count together
+        reason = "Checkmate." if reason.startswith("Checkmate") else reason
+        reasons[reason] = reasons.get(reason, 0) + 1
+    elapsed = time.perf_counter() - start
+    if writer is not None:
+        writer.close()
+        archive.build_key_index(args.archive)
+    summary = summarize(results)
+    print("%s vs %s: %d games" % (args.player_a, args.player_b, summary["games"]))
+    print("A wins %d, draws %d, B wins %d (score %.1f%%)"
+          % (summary["wins"], summary["draws"], summary["losses"], 100.0 * summary["score"]))
+    print("Elo difference %s (95%%: %s to %s)"
+          % (_format_elo(summary["elo"]), _format_elo(summary["elo_low"]), _format_elo(summary["elo_high"])))
+    for reason, count in sorted(reasons.items(), key=lambda item: -item[1]):
+        print("  %-40s %d" % (reason, count))
+    print("%.2fs, %.2f games/s, %.1f plies per game"
+          % (elapsed, len(results) / elapsed if elapsed else 0, total_plies / len(results) if results else 0))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Perft: counts the leaf nodes of the legal move tree to a fixed depth.
+
+The counts of a few well-known positions are published, and every
+difference points to a bug in the move generator; running this module
+(python -m perft) checks them and reports the generator's throughput in
+nodes per second. With --fen it counts a single position instead, and
+--divide splits the count by root move to find the move that goes wrong.
+--workers spreads the count over several processes.
+"""
+
+import argparse
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from pyChess import Position, START_FEN, move_to_text
+
+__author__ = "Michael Krisper"
+
+# (name, FEN, leaf counts for depth 1, 2, ...)
+TEST_POSITIONS = (
+    ("start", START_FEN,
+     (20, 400, 8902, 197281, 4865609)),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     (48, 2039, 97862, 4085603)),
+    ("position3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     (14, 191, 2812, 43238, 674624)),
+    ("position4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     (6, 264, 9467, 422333)),
+    ("position5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     (44, 1486, 62379, 2103487)),
+    ("position6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     (46, 2079, 89890, 3894594)),
+)
+
+def perft(position, depth):
+    """
+    Counts the leaf nodes of the legal move tree.
+
+    The moves of the last ply are counted, not played.
+
+    Args:
+        position (Position): The position to start from; it is restored afterwards.
+        depth (int): The number of plies to look ahead.
+
+    Returns:
+        int: The number of positions reached after exactly depth plies.
+    """
+    if depth == 0:
+        return 1
+    moves = list(position.generate_moves())
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        position.make_move(move)
+        nodes += perft(position, depth - 1)
+        position.unmake_move()
+    return nodes
+
+def divide(position, depth):
+    """
+    Counts the leaf nodes below every root move.
+
+    Returns:
+        list: (move, nodes) pairs, one per legal move.
+    """
+    counts = []
+    for move in list(position.generate_moves()):
+        position.make_move(move)
+        counts.append((move, perft(position, depth - 1)))
+        position.unmake_move()
+    return counts
+
+def _perft_task(task):
+    """Counts the leaf nodes below a packed position in a worker process."""
+    data, depth = task
+    return perft(Position.unpack(data), depth)
+
+def _split(position, depth, min_tasks):
+    """
+    Expands the move tree breadth-first until there are enough subtrees to share out.
+
+    The root is always expanded, so that every subtree belongs to a root move.
+
+    Returns:
+        list: (root move, packed position, remaining depth) triples in
+              generation order; the root move is None for the root itself.
+    """
+    frontier = [(None, position.pack(), depth)]
+    while frontier and (frontier[0][0] is None or (len(frontier) < min_tasks and frontier[0][2] > 1)):
+        expanded = []
+        for root_move, data, remaining in frontier:
+            node = Position.unpack(data)
+            for move in list(node.generate_moves()):
+                node.make_move(move)
+                expanded.append((move if root_move is None else root_move, node.pack(), remaining - 1))
+                node.unmake_move()
+        frontier = expanded
+    return frontier
+
+def parallel_divide(position, depth, workers):
+    """
+    Counts the leaf nodes below every root move with a pool of worker processes.
+
+    The tree is split into at least four subtrees per worker, which are
+    sent to the workers as packed positions. The counts are summed per root
+    move in generation order, so the result is the same as that of divide().
+
+    Returns:
+        list: (move, nodes) pairs, one per legal move.
+    """
+    counts = {}
+    for move in position.generate_moves():
+        counts[move] = 0
+    if depth < 1 or not counts:
+        return list(counts.items())
+    tasks = _split(position, depth, 4 * workers)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(_perft_task, [(data, remaining) for _, data, remaining in tasks],
+                               chunksize=max(1, len(tasks) // (16 * workers)))
+        for (root_move, _, _), nodes in zip(tasks, results):
+            counts[root_move] += nodes
+    return list(counts.items())
+
+def parallel_perft(position, depth, workers):
+    """Counts the leaf nodes of the legal move tree with a pool of worker processes."""
+    if depth < 1:
+        return 1
+    return sum(nodes for _, nodes in parallel_divide(position, depth, workers))
+
+def report(position, depth, show_divide=False, workers=1, output=print):
+    """
+    Prints the perft count of a position with the time taken and nodes per second.
+
+    Args:
+        output (callable): Writes a line of text, by default print.
+
+    Returns:
+        int: The number of leaf nodes.
+    """
+    start = time.perf_counter()
+    if workers > 1:
+        counts = parallel_divide(position, depth, workers)
+        if show_divide:
+            for move, count in sorted(counts, key=lambda item: move_to_text(item[0])):
+                output("%s: %d" % (move_to_text(move), count))
+        nodes = sum(count for _, count in counts) if depth > 0 else 1
+    elif show_divide and depth > 0:
+        counts = divide(position, depth)
+        for move, count in sorted(counts, key=lambda item: move_to_text(item[0])):
+            output("%s: %d" % (move_to_text(move), count))
+        nodes = sum(count for _, count in counts)
+    else:
+        nodes = perft(position, depth)
+    elapsed = time.perf_counter() - start
+    output("depth %d  nodes %d  time %.2fs  nps %d" % (depth, nodes, elapsed, nodes / elapsed if elapsed else 0))
+    return nodes
+
+def run_suite(max_depth=None, max_nodes=1000000, workers=1):
+    """
+    Checks the move generator against the published counts of TEST_POSITIONS.
+
+    Args:
+        max_depth (int): The deepest depth to check, or None for all.
+        max_nodes (int): Depths with more leaf nodes than this are skipped.
+        workers (int): The number of processes to count with.
+
+    Returns:
+        bool: True if every count matched.
+    """
+    passed = True
+    total_nodes, total_time = 0, 0.0
+    for name, fen, expected_counts in TEST_POSITIONS:
+        position = Position.from_fen(fen)
+        for depth, expected in enumerate(expected_counts, start=1):
+            if (max_depth is not None and depth > max_depth) or expected > max_nodes:
+                break
+            start = time.perf_counter()
+            nodes = parallel_perft(position, depth, workers) if workers > 1 else perft(position, depth)
+            elapsed = time.perf_counter() - start
+            total_nodes += nodes
+            total_time += elapsed
+            ok = nodes == expected
+            passed = passed and ok
+            print("%-10s depth %d  nodes %9d  expected %9d  %s  %6.2fs  nps %d"
+                  % (name, depth, nodes, expected, "ok  " if ok else "FAIL", elapsed,
+                     nodes / elapsed if elapsed else 0))
+    print("%s: %d nodes in %.2fs, %d nps"
+          % ("passed" if passed else "FAILED", total_nodes, total_time,
+             total_nodes / total_time if total_time else 0))
+    return passed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Counts the legal move tree (perft) to check and time the move generator.")
+    parser.add_argument("--fen", help="count this position instead of running the test suite")
+    parser.add_argument("--depth", type=int, help="depth to count (default: 4 with --fen, all published depths otherwise)")
+    parser.add_argument("--max-nodes", type=int, default=1000000,
+                        help="skip suite depths with more leaf nodes than this (default: 1000000)")
+    parser.add_argument("--divide", action="store_true", help="print the count below every root move")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes (default: 1)")
+    args = parser.parse_args(argv)
+    if args.fen:
+        report(Position.from_fen(args.fen), 4 if args.depth is None else args.depth, args.divide, args.workers)
+        return 0
+    return 0 if run_suite(args.depth, args.max_nodes, args.workers) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
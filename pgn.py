@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Streaming reader and writer for Portable Game Notation (PGN).
+
+read_games() parses one game at a time from a file, a memory-mapped
+buffer or any iterable of lines, so the memory used does not grow with
+the size of the archive. Every move in standard algebraic notation (SAN)
+is resolved against the legal moves of the position, which validates the
+game against the rules as it is read. write_game() produces PGN from
+encoded moves.
+
+Run as a script (python -m pgn FILE) it replays every game of an archive
+and reports the games per second.
+"""
+
+import argparse
+import io
+import mmap
+import re
+import sys
+import time
+
+from pyChess import (BLACK, PAWN, MOVE_CASTLING, MOVE_PROMOTION, PIECE_LETTERS, SQUARE_NAMES,
+                     START_FEN, Position)
+
+__author__ = "Michael Krisper"
+
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+SEVEN_TAG_ROSTER = ("Event", "Site", "Date", "Round", "White", "Black", "Result")
+
+_TAG = re.compile(r'^\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+_TOKEN = re.compile(r"\{[^}]*\}?|;[^\n]*|\(|\)|\$\d+|[^\s(){};]+")
+_MOVE_NUMBER = re.compile(r"^\d+\.*")
+_SAN = re.compile(r"^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQnbrq]))?[+#]?[!?]*$")
+
+class PgnGame(object):
+    """A game read from PGN: its tags, the encoded moves and the result."""
+    __slots__ = ("headers", "moves", "result", "error")
+
+    def __init__(self, headers, moves, result, error=None):
+        """
+        Initializes a PgnGame.
+
+        Args:
+            headers (dict): The tag pairs, e.g. {"White": "Kasparov"}.
+            moves (list): The moves as ints, encoded as by Position.generate_moves.
+            result (str): The game termination marker ("1-0", "0-1", "1/2-1/2" or "*").
+            error (str): Why the movetext could not be replayed to the end, or None;
+                         moves then holds the moves up to the error.
+        """
+        self.headers = headers
+        self.moves = moves
+        self.result = result
+        self.error = error
+
+    @property
+    def fen(self):
+        """The FEN of the starting position."""
+        return self.headers.get("FEN", START_FEN)
+
+    def replay(self):
+        """
+        Replays the game.
+
+        The same Position object is updated in place from move to move.
+
+        Yields:
+            tuple: (position, move) with the position before each move.
+        """
+        position = Position.from_fen(self.fen)
+        for move in self.moves:
+            yield position, move
+            position.make_move(move)
+
+    def final_position(self):
+        """Returns the position after the last move."""
+        position = Position.from_fen(self.fen)
+        for move in self.moves:
+            position.make_move(move)
+        return position
+
+def parse_san(position, san):
+    """
+    Finds the legal move written in standard algebraic notation.
+
+    Args:
+        position (Position): The position the move is played in.
+        san (str): The move, e.g. 'Nf3', 'exd5', 'e8=Q+' or 'O-O'.
+
+    Returns:
+        int: The encoded move.
+
+    Raises:
+        ValueError: If the move is malformed, illegal or ambiguous.
+    """
+    castling = san.rstrip("+#!?").replace("0", "O")
+    if castling in ("O-O", "O-O-O"):
+        for move in position.generate_moves():
+            if move >> 12 == MOVE_CASTLING and ((move >> 6 & 7) == 6) == (castling == "O-O"):
+                return move
+        raise ValueError("Illegal move: %s" % san)
+    match = _SAN.match(san)
+    if not match:
+        raise ValueError("Invalid move: %s" % san)
+    piece, from_file, from_rank, target, promotion = match.groups()
+    kind = PIECE_LETTERS.index(piece.lower()) if piece else PAWN
+    to_square = SQUARE_NAMES.index(target)
+    promotion_flag = PIECE_LETTERS.index(promotion.lower()) + 2 if promotion else 0
+    board = position.board
+    found = 0
+    for move in position.generate_moves():
+        from_square = move & 63
+        if move >> 6 & 63 != to_square or board[from_square] & 7 != kind \
+           or (from_file and SQUARE_NAMES[from_square][0] != from_file) \
+           or (from_rank and SQUARE_NAMES[from_square][1] != from_rank):
+            continue
+        flag = move >> 12
+        if flag >= MOVE_PROMOTION and flag != promotion_flag:
+            continue
+        if found:
+            raise ValueError("Ambiguous move: %s" % san)
+        found = move
+    if not found or (promotion_flag and found >> 12 != promotion_flag):
+        raise ValueError("Illegal move: %s" % san)
+    return found
+
+def move_to_san(position, move):
+    """
+    Writes a legal move in standard algebraic notation.
+
+    Args:
+        position (Position): The position the move is played in; it is restored afterwards.
+        move (int): The encoded move.
+
+    Returns:
+        str: The move in SAN, with '+' or '#' for check and mate.
+    """
+    board = position.board
+    from_square, to_square, flag = move & 63, move >> 6 & 63, move >> 12
+    kind = board[from_square] & 7
+    if flag == MOVE_CASTLING:
+        san = "O-O" if to_square & 7 == 6 else "O-O-O"
+    else:
+        capture = board[to_square] or (kind == PAWN and from_square & 7 != to_square & 7)
+        if kind == PAWN:
+            san = SQUARE_NAMES[from_square][0] + "x" if capture else ""
+        else:
+            san = PIECE_LETTERS[kind].upper()
+            rivals = [other & 63 for other in position.generate_moves()
+                      if other & 63 != from_square and other >> 6 & 63 == to_square
+                      and board[other & 63] & 7 == kind]
+            if rivals:
+                if all(other & 7 != from_square & 7 for other in rivals):
+                    san += SQUARE_NAMES[from_square][0]
+                elif all(other >> 3 != from_square >> 3 for other in rivals):
+                    san += SQUARE_NAMES[from_square][1]
+                else:
+                    san += SQUARE_NAMES[from_square]
+            if capture:
+                san += "x"
+        san += SQUARE_NAMES[to_square]
+        if flag >= MOVE_PROMOTION:
+            san += "=" + PIECE_LETTERS[flag - 2].upper()
+    position.make_move(move)
+    if position.is_in_check(position.side):
+        san += "#" if next(position.generate_moves(), None) is None else "+"
+    position.unmake_move()
+    return san
+
+def _lines(source):
+    """
+    Yields the lines of a PGN source as text.
+
+    A path is memory-mapped, so the operating system pages the file in and
+    out as it is read; file objects and buffers are read line by line.
+    """
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            try:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                return  # an empty file cannot be mapped
+            try:
+                for line in iter(buffer.readline, b""):
+                    yield line.decode("utf-8", "replace")
+            finally:
+                buffer.close()
+        return
+    if isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+        source = io.BytesIO(source) if not isinstance(source, mmap.mmap) else iter(source.readline, b"")
+    for line in source:
+        yield line.decode("utf-8", "replace") if isinstance(line, bytes) else line
+
+def _parse_movetext(headers, movetext):
+    """Resolves the movetext of one game and returns it as a PgnGame."""
+    result = headers.get("Result", "*")
+    moves = []
+    try:
+        position = Position.from_fen(headers.get("FEN", START_FEN))
+    except ValueError as e:
+        return PgnGame(headers, moves, result, str(e))
+    depth = 0
+    for token in _TOKEN.findall(movetext):
+        first = token[0]
+        if first == "(":
+            depth += 1
+        elif first == ")":
+            depth -= 1
+        elif depth or first in "{;$":
+            continue
+        elif token in RESULTS:
+            result = token
+            break
+        else:
+            san = _MOVE_NUMBER.sub("", token)
+            if not san.strip("!?"):
+                continue
+            try:
+                move = parse_san(position, san)
+            except ValueError as e:
+                return PgnGame(headers, moves, result, "%s after %d plies" % (e, len(moves)))
+            position.make_move(move)
+            moves.append(move)
+    return PgnGame(headers, moves, result)
+
+def read_games(source):
+    """
+    Reads the games of a PGN source one after another.
+
+    Games that break the rules are still yielded, with the legal part of
+    their moves and the reason in PgnGame.error, so one bad game does not
+    stop the processing of an archive.
+
+    Args:
+        source: A file path (memory-mapped), an open file in text or binary
+                mode, a bytes-like or mmap buffer, or an iterable of lines.
+
+    Yields:
+        PgnGame: Every game in the source, in order.
+    """
+    headers, movetext = {}, []
+    for line in _lines(source):
+        line = line.strip()
+        if line.startswith("%"):
+            continue
+        if line.startswith("["):
+            if movetext:
+                yield _parse_movetext(headers, "\n".join(movetext))
+                headers, movetext = {}, []
+            match = _TAG.match(line)
+            if match:
+                headers[match.group(1)] = match.group(2).replace('\\"', '"').replace("\\\\", "\\")
+        elif line:
+            movetext.append(line)
+    if headers or movetext:
+        yield _parse_movetext(headers, "\n".join(movetext))
+
+def write_game(out, moves, headers=None, fen=START_FEN, result="*"):
+    """
+    Writes one game as PGN.
+
+    The seven tag roster is always written, with '?' for missing tags; a
+    game not starting from the standard position gets SetUp and FEN tags.
+    Movetext lines are wrapped at 80 characters.
+
+    Args:
+        out: A file object opened for writing text.
+        moves (list): The moves as ints, encoded as by Position.generate_moves.
+        headers (dict): Tag pairs to write.
+        fen (str): The starting position.
+        result (str): The game termination marker.
+    """
+    headers = dict(headers or {})
+    headers["Result"] = result
+    if fen != START_FEN:
+        headers["SetUp"] = "1"
+        headers["FEN"] = fen
+    for name in SEVEN_TAG_ROSTER:
+        value = headers.get(name, "????.??.??" if name == "Date" else "?")
+        out.write('[%s "%s"]\n' % (name, value.replace("\\", "\\\\").replace('"', '\\"')))
+    for name, value in headers.items():
+        if name not in SEVEN_TAG_ROSTER:
+            out.write('[%s "%s"]\n' % (name, value.replace("\\", "\\\\").replace('"', '\\"')))
+    out.write("\n")
+    position = Position.from_fen(fen)
+    tokens = []
+    for i, move in enumerate(moves):
+        if position.side != BLACK:
+            tokens.append("%d." % position.fullmove)
+        elif i == 0:
+            tokens.append("%d..." % position.fullmove)
+        tokens.append(move_to_san(position, move))
+        position.make_move(move)
+    tokens.append(result)
+    line = ""
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > 80:
+            out.write(line + "\n")
+            line = token
+        else:
+            line = line + " " + token if line else token
+    out.write(line + "\n\n")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replays every game of a PGN file through the rules and reports the speed.")
+    parser.add_argument("file", help="the PGN file to read ('-' for standard input)")
+    parser.add_argument("--errors", action="store_true", help="print every game that breaks the rules")
+    args = parser.parse_args(argv)
+    source = sys.stdin if args.file == "-" else args.file
+    games = plies = errors = 0
+    start = time.perf_counter()
+    for game in read_games(source):
+        games += 1
+        plies += len(game.moves)
+        if game.error:
+            errors += 1
+            if args.errors:
+                print("game %d (%s - %s): %s" % (games, game.headers.get("White", "?"),
+                                                 game.headers.get("Black", "?"), game.error))
+    elapsed = time.perf_counter() - start
+    print("%d games, %d plies, %d with errors in %.2fs: %d games/s, %d plies/s"
+          % (games, plies, errors, elapsed, games / elapsed if elapsed else 0, plies / elapsed if elapsed else 0))
+    return 1 if errors else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
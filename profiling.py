@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Opt-in instrumentation of the rules core.
+
+A Profiler counts and times the calls of the methods listed in
+INSTRUMENTED: move validation per piece type, attack and legal-move tests,
+repetition hashing and rendering. install() replaces these methods on
+their classes by timing wrappers and uninstall() puts the originals back,
+so while no profiler is installed the game runs its plain methods and
+pays nothing for the instrumentation.
+
+Times include nested instrumented calls (Queen.is_move_allowed calls the
+rook and bishop checks, Game.is_square_attacked calls the Position's).
+
+The game enables it with --profile or the PYCHESS_PROFILE environment
+variable, prints a line per turn and a report at the end, and shows the
+counters with the 'stats' command. With an output file the whole session
+also runs under cProfile and the pstats data is written when it ends.
+"""
+
+import cProfile
+import time
+
+from pyChess import Position, Game, Pawn, Knight, Bishop, Rook, Queen, King
+
+__author__ = "Michael Krisper"
+
+# (class, method name) of every instrumented method
+INSTRUMENTED = (
+    (Pawn, "is_move_allowed"),
+    (Knight, "is_move_allowed"),
+    (Bishop, "is_move_allowed"),
+    (Rook, "is_move_allowed"),
+    (Queen, "is_move_allowed"),
+    (King, "is_move_allowed"),
+    (Game, "is_square_attacked"),
+    (Position, "is_square_attacked"),
+    (Game, "has_legal_moves"),
+    (Game, "_get_position_hash"),
+    (Game, "print_board"),
+)
+
+class Profiler(object):
+    """Counts and times the instrumented methods, per turn and in total."""
+
+    def __init__(self, output_path=None):
+        """
+        Initializes a Profiler; nothing is measured before install().
+
+        Args:
+            output_path (str): The file to write cProfile's pstats data to when
+                               the profiler is closed, or None for no cProfile.
+        """
+        self.output_path = output_path
+        # label -> [calls, seconds]
+        self.stats = {"%s.%s" % (cls.__name__, name): [0, 0.0] for cls, name in INSTRUMENTED}
+        self.turns = 0
+        self.last_turn = None
+        self._turn_start = self._snapshot()
+        self._originals = []
+        self._cprofile = None
+
+    def _wrap(self, function, stat):
+        """Returns a wrapper of function that adds its calls and time to stat."""
+        clock = time.perf_counter
+
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                stat[1] += clock() - start
+                stat[0] += 1
+
+        wrapper.__name__ = function.__name__
+        wrapper.__doc__ = function.__doc__
+        return wrapper
+
+    @property
+    def installed(self):
+        """True while the wrappers are in place."""
+        return bool(self._originals)
+
+    def install(self):
+        """Wraps the instrumented methods and starts cProfile if an output file is set."""
+        if self.installed:
+            return
+        for cls, name in INSTRUMENTED:
+            # Own methods only; an inherited one is wrapped on the class defining it.
+            function = cls.__dict__[name]
+            self._originals.append((cls, name, function))
+            setattr(cls, name, self._wrap(function, self.stats["%s.%s" % (cls.__name__, name)]))
+        if self.output_path and self._cprofile is None:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    def uninstall(self):
+        """Restores the original methods; the counters are kept."""
+        for cls, name, function in reversed(self._originals):
+            setattr(cls, name, function)
+        self._originals = []
+
+    def close(self):
+        """
+        Uninstalls the profiler and writes the cProfile data, if any.
+
+        Returns:
+            str: A line naming the written file, or None.
+        """
+        self.uninstall()
+        if self._cprofile is None:
+            return None
+        self._cprofile.disable()
+        self._cprofile.dump_stats(self.output_path)
+        self._cprofile = None
+        return "cProfile data written to %s (read it with: python -m pstats %s)" % (self.output_path,
+                                                                                   self.output_path)
+
+    def reset(self):
+        """Sets all counters back to zero."""
+        for stat in self.stats.values():
+            stat[0], stat[1] = 0, 0.0
+        self.turns = 0
+        self.last_turn = None
+        self._turn_start = self._snapshot()
+
+    def _snapshot(self):
+        return {label: tuple(stat) for label, stat in self.stats.items()}
+
+    def end_turn(self):
+        """
+        Closes a turn and summarizes the calls made during it.
+
+        Returns:
+            str: One line with the calls and milliseconds of every method called in the turn.
+        """
+        now = self._snapshot()
+        self.last_turn = {label: (calls - self._turn_start[label][0], seconds - self._turn_start[label][1])
+                          for label, (calls, seconds) in now.items()}
+        self._turn_start = now
+        self.turns += 1
+        parts = ["%s %d/%.2fms" % (label, calls, seconds * 1e3)
+                 for label, (calls, seconds) in self.last_turn.items() if calls]
+        return "turn %d: %s" % (self.turns, ", ".join(parts) if parts else "no instrumented calls")
+
+    def report(self):
+        """
+        Formats the cumulative counters, and those of the last turn, as a table.
+
+        Returns:
+            str: The report, one method per line.
+        """
+        lines = ["%-28s %10s %12s %10s %10s" % ("method", "calls", "total ms", "us/call", "last turn")]
+        for label, (calls, seconds) in self.stats.items():
+            last = self.last_turn[label][0] if self.last_turn else 0
+            lines.append("%-28s %10d %12.2f %10.2f %10d"
+                         % (label, calls, seconds * 1e3, seconds / calls * 1e6 if calls else 0, last))
+        lines.append("%d turns, profiling %s" % (self.turns, "on" if self.installed else "off"))
+        return "\n".join(lines)
@@ -1,6 +1,14 @@
 #!/usr/bin/env python
 # -*- coding: UTF-8 -*-
 
+import argparse
+import os
+import random
+import shutil
+import sys
+import time
+from collections import OrderedDict
+
 try:
     import readline
 except ImportError:
@@ -24,8 +32,852 @@ __author__ = "Michael Krisper"
 __date__ = "2012-05-15"
 __python__ = "3.x" # Updated to Python 3
 
+WHITE, BLACK = 0, 1
+EMPTY, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(7)
+
+CASTLE_WHITE_KINGSIDE = 1
+CASTLE_WHITE_QUEENSIDE = 2
+CASTLE_BLACK_KINGSIDE = 4
+CASTLE_BLACK_QUEENSIDE = 8
+
+# Moves are plain ints: from square | to square << 6 | flag << 12.
+# Flags from MOVE_PROMOTION upwards promote to the piece type flag - 2.
+MOVE_NORMAL = 0
+MOVE_DOUBLE_PUSH = 1
+MOVE_CASTLING = 2
+MOVE_EN_PASSANT = 3
+MOVE_PROMOTION = 4
+
+KNIGHT_OFFSETS = ((-1, -2), (1, -2), (2, -1), (2, 1), (1, 2), (-1, 2), (-2, 1), (-2, -1))
+KING_OFFSETS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+ROOK_DIRECTIONS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+BISHOP_DIRECTIONS = ((1, 1), (-1, 1), (1, -1), (-1, -1))
+
+ALL_SQUARES = (1 << 64) - 1
+NOT_FILE_A = 0xfefefefefefefefe
+NOT_FILE_H = 0x7f7f7f7f7f7f7f7f
+RANK_3 = 0xff << 16
+RANK_6 = 0xff << 40
+LAST_RANKS = 0xff | 0xff << 56
+
+def _bitboard(squares):
+    return sum(1 << square for square in squares)
+
+def _offset_table(offsets):
+    table = []
+    for square in range(64):
+        col, row = square & 7, square >> 3
+        table.append(_bitboard((row + y) * 8 + col + x for x, y in offsets
+                               if 0 <= col + x < 8 and 0 <= row + y < 8))
+    return table
+
+def _ray(square, x, y):
+    col, row = (square & 7) + x, (square >> 3) + y
+    while 0 <= col < 8 and 0 <= row < 8:
+        yield row * 8 + col
+        col, row = col + x, row + y
+
+def _line_table(directions):
+    """
+    Precomputes the attacks along one line (file, rank or diagonal) through every square.
+
+    Only the inner squares of a line can block anything behind them, so for
+    each square they form an occupancy mask. The table maps every subset of
+    that mask to the attacked squares; looking it up with occupied & mask
+    does what the magic multiplication does in magic bitboards, with the
+    dict's hashing in place of the magic number.
+
+    Returns:
+        tuple: (masks, tables) with one mask and one dict per square.
+    """
+    masks, tables = [], []
+    for square in range(64):
+        rays = [list(_ray(square, x, y)) for x, y in directions]
+        inner = [other for ray in rays for other in ray[:-1]]
+        table = {}
+        for subset in range(1 << len(inner)):
+            occupied = _bitboard(other for i, other in enumerate(inner) if subset >> i & 1)
+            attacks = 0
+            for ray in rays:
+                for other in ray:
+                    attacks |= 1 << other
+                    if occupied >> other & 1:
+                        break
+            table[occupied] = attacks
+        masks.append(_bitboard(inner))
+        tables.append(table)
+    return masks, tables
+
+def rook_attacks(square, occupied):
+    """Returns the squares a rook on square attacks, given the occupied squares."""
+    return (FILE_ATTACKS[square][occupied & FILE_MASKS[square]]
+            | RANK_ATTACKS[square][occupied & RANK_MASKS[square]])
+
+def bishop_attacks(square, occupied):
+    """Returns the squares a bishop on square attacks, given the occupied squares."""
+    return (DIAGONAL_ATTACKS[square][occupied & DIAGONAL_MASKS[square]]
+            | ANTI_DIAGONAL_ATTACKS[square][occupied & ANTI_DIAGONAL_MASKS[square]])
+
+def queen_attacks(square, occupied):
+    """Returns the squares a queen on square attacks, given the occupied squares."""
+    return rook_attacks(square, occupied) | bishop_attacks(square, occupied)
+
+KNIGHT_ATTACKS = _offset_table(KNIGHT_OFFSETS)
+KING_ATTACKS = _offset_table(KING_OFFSETS)
+PAWN_ATTACKS = (_offset_table(((-1, 1), (1, 1))), _offset_table(((-1, -1), (1, -1))))
+FILE_MASKS, FILE_ATTACKS = _line_table(((0, 1), (0, -1)))
+RANK_MASKS, RANK_ATTACKS = _line_table(((1, 0), (-1, 0)))
+DIAGONAL_MASKS, DIAGONAL_ATTACKS = _line_table(((1, 1), (-1, -1)))
+ANTI_DIAGONAL_MASKS, ANTI_DIAGONAL_ATTACKS = _line_table(((-1, 1), (1, -1)))
+ROOK_RAYS = [rook_attacks(s, 0) for s in range(64)]
+BISHOP_RAYS = [bishop_attacks(s, 0) for s in range(64)]
+
+# BETWEEN[a][b] holds the squares strictly between two squares on a common line.
+BETWEEN = [[0] * 64 for _ in range(64)]
+for _square in range(64):
+    for _x, _y in ROOK_DIRECTIONS + BISHOP_DIRECTIONS:
+        _mask = 0
+        for _other in _ray(_square, _x, _y):
+            BETWEEN[_square][_other] = _mask
+            _mask |= 1 << _other
+
+# Zobrist keys: a position's key is the XOR of the keys of its pieces, castling
+# rights, en passant file and side to move. The fixed seed keeps keys identical
+# across runs and processes.
+_zobrist_random = random.Random(0x5EED)
+ZOBRIST_PIECES = [[_zobrist_random.getrandbits(64) if code & 7 not in (EMPTY, 7) else 0 for _ in range(64)]
+                  for code in range(16)]
+_castling_keys = [_zobrist_random.getrandbits(64) for _ in range(4)]
+ZOBRIST_CASTLING = [0] * 16
+for _rights in range(16):
+    for _i, _castling_key in enumerate(_castling_keys):
+        if _rights >> _i & 1:
+            ZOBRIST_CASTLING[_rights] ^= _castling_key
+ZOBRIST_EN_PASSANT = [_zobrist_random.getrandbits(64) for _ in range(8)]
+ZOBRIST_SIDE = _zobrist_random.getrandbits(64)
+
+# Material signature: four bits per piece code count the pieces of that code.
+MATERIAL_UNITS = [1 << 4 * code if code & 7 not in (EMPTY, 7) else 0 for code in range(16)]
+# The counts of pawns, rooks and queens; any one of them is enough to mate.
+MATING_MATERIAL = sum(MATERIAL_UNITS[kind | color << 3] * 15 for color in (WHITE, BLACK) for kind in (PAWN, ROOK, QUEEN))
+
+# (right, king from, king to, rook from, rook to, squares to be empty, squares not attacked)
+CASTLING_MOVES = (
+    ((CASTLE_WHITE_KINGSIDE, 4, 6, 7, 5, (5, 6), (5, 6)),
+     (CASTLE_WHITE_QUEENSIDE, 4, 2, 0, 3, (1, 2, 3), (3, 2))),
+    ((CASTLE_BLACK_KINGSIDE, 60, 62, 63, 61, (61, 62), (61, 62)),
+     (CASTLE_BLACK_QUEENSIDE, 60, 58, 56, 59, (57, 58, 59), (59, 58))),
+)
+
+# The rook move belonging to a castling king move, indexed by the king's target square.
+CASTLING_ROOK_MOVES = [None] * 64
+for _moves in CASTLING_MOVES:
+    for _, _, _king_to, _rook_from, _rook_to, _, _ in _moves:
+        CASTLING_ROOK_MOVES[_king_to] = (_rook_from, _rook_to)
+
+# Castling rights that survive a move touching a square.
+CASTLING_MASK = [15] * 64
+for _moves in CASTLING_MOVES:
+    for _right, _king_from, _, _rook_from, _, _, _ in _moves:
+        CASTLING_MASK[_king_from] &= ~_right
+        CASTLING_MASK[_rook_from] &= ~_right
+
+PIECE_LETTERS = " pnbrqk"
+SQUARE_NAMES = [chr(ord("a") + (square & 7)) + str((square >> 3) + 1) for square in range(64)]
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+def parse_square(name):
+    """
+    Parses a square name such as 'e4'.
+
+    Raises:
+        ValueError: If the name is not a square.
+    """
+    try:
+        return SQUARE_NAMES.index(name.lower())
+    except ValueError:
+        raise ValueError("Invalid square: %s" % name)
+
+def parse_positive_number(text):
+    """Parses a number greater than zero, e.g. a time in seconds; returns None if text is not one."""
+    try:
+        number = float(text)
+    except ValueError:
+        return None
+    return number if 0 < number < float("inf") else None
+
+def move_to_text(move):
+    """Returns an encoded move in long algebraic notation, e.g. 'e2e4' or 'e7e8q'."""
+    text = SQUARE_NAMES[move & 63] + SQUARE_NAMES[move >> 6 & 63]
+    if move >> 12 >= MOVE_PROMOTION:
+        text += PIECE_LETTERS[(move >> 12) - 2]
+    return text
+
+class Position(object):
+    """
+    A compact chess position.
+
+    The board is a flat bytearray of 64 piece codes (type | color << 3,
+    square = row * 8 + col) next to the side to move, castling rights,
+    en passant square and the move clocks. Alongside the board, one bitboard
+    per piece code and per color is kept up to date for the attack tables.
+    Tiles and pieces of a Game are only views onto this object.
+
+    The Zobrist key is maintained incrementally by put(), switch_side(),
+    set_castling() and set_en_passant(); side, castling and ep must only
+    be changed through these.
+
+    make_move() and unmake_move() play and take back moves. Each played
+    move pushes one packed int onto undo_stack (move | captured piece << 16
+    | castling rights << 20 | en passant square << 24 | halfmove clock << 31)
+    and the previous Zobrist key onto key_stack.
+
+    checkers holds the pieces giving check to the side to move. make_move()
+    derives it from the squares the move changed and pushes the previous
+    value onto check_stack, so asking whether the side to move is in check
+    costs nothing. The pins of the side to move are found on first use and
+    kept until the next move (see pins()). Code that changes the board with
+    put() directly must call update_checkers() when it is done.
+
+    The bitboards double as piece lists: pieces() and piece_squares() visit
+    only the pieces that exist. material counts the pieces of every code,
+    four bits per code (see MATERIAL_UNITS), and is kept up to date by put()
+    through captures, promotions, castling and en passant alike.
+    """
+    __slots__ = ("board", "bitboards", "occupied", "side", "castling", "ep", "halfmove", "fullmove", "key",
+                 "material", "undo_stack", "key_stack", "checkers", "check_stack", "_pins")
+
+    def __init__(self):
+        """Initializes an empty position with white to move."""
+        self.board = bytearray(64)
+        self.bitboards = [0] * 16
+        self.occupied = [0, 0]
+        self.side = WHITE
+        self.castling = 0
+        self.ep = None
+        self.halfmove = 0
+        self.fullmove = 1
+        self.key = 0
+        self.material = 0
+        self.undo_stack = []
+        self.key_stack = []
+        self.checkers = 0
+        self.check_stack = []
+        self._pins = None
+
+    def copy(self):
+        """Returns an independent copy of the position."""
+        other = Position.__new__(Position)
+        other.board = bytearray(self.board)
+        other.bitboards = self.bitboards[:]
+        other.occupied = self.occupied[:]
+        other.side = self.side
+        other.castling = self.castling
+        other.ep = self.ep
+        other.halfmove = self.halfmove
+        other.fullmove = self.fullmove
+        other.key = self.key
+        other.material = self.material
+        other.undo_stack = self.undo_stack[:]
+        other.key_stack = self.key_stack[:]
+        other.checkers = self.checkers
+        other.check_stack = self.check_stack[:]
+        other._pins = self._pins
+        return other
+
+    def pack(self):
+        """
+        Encodes the position into 37 bytes.
+
+        Two squares share a byte, followed by side and castling rights,
+        the en passant square (255 for none) and both move clocks.
+        """
+        board = self.board
+        data = bytearray(board[i] | board[i + 1] << 4 for i in range(0, 64, 2))
+        data.append(self.side | self.castling << 1)
+        data.append(255 if self.ep is None else self.ep)
+        data.append(min(self.halfmove, 255))
+        data += self.fullmove.to_bytes(2, "little")
+        return bytes(data)
+
+    @staticmethod
+    def unpack(data):
+        """Decodes a position produced by Position.pack."""
+        position = Position()
+        for i in range(32):
+            position.put(2 * i, data[i] & 15)
+            position.put(2 * i + 1, data[i] >> 4)
+        if data[32] & 1:
+            position.switch_side()
+        position.set_castling(data[32] >> 1)
+        position.set_en_passant(None if data[33] == 255 else data[33])
+        position.halfmove = data[34]
+        position.fullmove = int.from_bytes(data[35:37], "little")
+        position.update_checkers()
+        return position
+
+    @staticmethod
+    def from_fen(fen):
+        """
+        Parses a position in Forsyth-Edwards Notation.
+
+        The move clocks may be omitted. Castling rights are only kept if the
+        king and rook still stand on their home squares. Both sides need a
+        king, and the side not to move must not be in check.
+
+        Raises:
+            ValueError: If the FEN is malformed.
+        """
+        fields = fen.split()
+        rows = fields[0].split("/") if fields else []
+        if len(fields) < 4 or len(rows) != 8 or fields[1] not in ("w", "b"):
+            raise ValueError("Invalid FEN: %s" % fen)
+        position = Position()
+        for i, text in enumerate(rows):
+            row, col = 7 - i, 0
+            for char in text:
+                if char.isdigit():
+                    col += int(char)
+                    continue
+                kind = PIECE_LETTERS.find(char.lower())
+                if kind < PAWN or col > 7:
+                    raise ValueError("Invalid FEN: %s" % fen)
+                position.put(row * 8 + col, kind | (BLACK if char.islower() else WHITE) << 3)
+                col += 1
+            if col != 8:
+                raise ValueError("Invalid FEN: %s" % fen)
+        if fields[1] == "b":
+            position.switch_side()
+        rights = 0
+        if fields[2] != "-":
+            for char in fields[2]:
+                if char not in "KQkq":
+                    raise ValueError("Invalid FEN: %s" % fen)
+                rights |= 1 << "KQkq".index(char)
+        position.set_castling(rights & position.find_castling_rights())
+        if fields[3] != "-":
+            position.set_en_passant(parse_square(fields[3]))
+        try:
+            position.halfmove = int(fields[4]) if len(fields) > 4 else 0
+            position.fullmove = int(fields[5]) if len(fields) > 5 else 1
+        except ValueError:
+            raise ValueError("Invalid FEN: %s" % fen)
+        for color in (WHITE, BLACK):
+            kings = position.bitboards[KING | color << 3]
+            if not kings or kings & (kings - 1):
+                raise ValueError("Invalid FEN (each side needs one king): %s" % fen)
+        if position.is_in_check(position.side ^ 1):
+            raise ValueError("Invalid FEN (the side not to move is in check): %s" % fen)
+        position.update_checkers()
+        return position
+
+    def to_fen(self):
+        """Returns the position in Forsyth-Edwards Notation."""
+        rows = []
+        for row in range(7, -1, -1):
+            text, empty = "", 0
+            for code in self.board[row * 8:row * 8 + 8]:
+                if not code:
+                    empty += 1
+                    continue
+                if empty:
+                    text += str(empty)
+                    empty = 0
+                letter = PIECE_LETTERS[code & 7]
+                text += letter if code >> 3 == BLACK else letter.upper()
+            rows.append(text + str(empty) if empty else text)
+        castling = "".join(char for i, char in enumerate("KQkq") if self.castling >> i & 1) or "-"
+        ep = "-" if self.ep is None else SQUARE_NAMES[self.ep]
+        return "%s %s %s %s %d %d" % ("/".join(rows), "wb"[self.side], castling, ep, self.halfmove, self.fullmove)
+
+    def put(self, square, code):
+        """Places a piece code on a square (EMPTY clears it)."""
+        bit = 1 << square
+        old = self.board[square]
+        if old:
+            self.bitboards[old] ^= bit
+            self.occupied[old >> 3] ^= bit
+        if code:
+            self.bitboards[code] ^= bit
+            self.occupied[code >> 3] ^= bit
+        self.board[square] = code
+        self.key ^= ZOBRIST_PIECES[old][square] ^ ZOBRIST_PIECES[code][square]
+        self.material += MATERIAL_UNITS[code] - MATERIAL_UNITS[old]
+
+    def switch_side(self):
+        """Passes the move to the other side and advances the move number."""
+        self.side ^= 1
+        self.key ^= ZOBRIST_SIDE
+        if self.side == WHITE:
+            self.fullmove += 1
+
+    def set_castling(self, rights):
+        """Replaces the castling rights."""
+        self.key ^= ZOBRIST_CASTLING[self.castling] ^ ZOBRIST_CASTLING[rights]
+        self.castling = rights
+
+    def update_castling(self, from_square, to_square):
+        """Drops the castling rights of kings and rooks leaving or captured on their home squares."""
+        self.set_castling(self.castling & CASTLING_MASK[from_square] & CASTLING_MASK[to_square])
+
+    def set_en_passant(self, square):
+        """
+        Sets the square behind a pawn that just advanced two squares.
+
+        The square is only kept if an enemy pawn can actually capture there,
+        so that positions which merely differ by an unusable en passant
+        square are treated as repetitions.
+        """
+        if self.ep is not None:
+            self.key ^= ZOBRIST_EN_PASSANT[self.ep & 7]
+        capturer = BLACK if square is not None and square >> 3 == 2 else WHITE
+        if square is not None and not PAWN_ATTACKS[capturer ^ 1][square] & self.bitboards[PAWN | capturer << 3]:
+            square = None
+        self.ep = square
+        if square is not None:
+            self.key ^= ZOBRIST_EN_PASSANT[square & 7]
+
+    def make_move(self, move):
+        """
+        Plays a legal move, as produced by generate_moves.
+
+        Args:
+            move (int): The encoded move.
+        """
+        board = self.board
+        put = self.put
+        from_square, to_square, flag = move & 63, move >> 6 & 63, move >> 12
+        code = board[from_square]
+        captured = board[to_square]
+        self.undo_stack.append(move | captured << 16 | self.castling << 20
+                               | (64 if self.ep is None else self.ep) << 24 | self.halfmove << 31)
+        self.key_stack.append(self.key)
+        self.check_stack.append(self.checkers)
+        self._pins = None
+        changed = 1 << from_square | 1 << to_square
+        put(from_square, EMPTY)
+        if flag >= MOVE_PROMOTION:
+            put(to_square, (flag - 2) | (code & 8))
+        else:
+            put(to_square, code)
+            if flag == MOVE_EN_PASSANT:
+                square = (from_square & ~7) | (to_square & 7)
+                changed |= 1 << square
+                put(square, EMPTY)
+            elif flag == MOVE_CASTLING:
+                rook_from, rook_to = CASTLING_ROOK_MOVES[to_square]
+                changed |= 1 << rook_to
+                put(rook_to, board[rook_from])
+                put(rook_from, EMPTY)
+        self.checkers = self._find_new_checkers(to_square, changed)
+        if self.castling:
+            self.update_castling(from_square, to_square)
+        self.set_en_passant((from_square + to_square) >> 1 if flag == MOVE_DOUBLE_PUSH else None)
+        self.halfmove = 0 if captured or code & 7 == PAWN else self.halfmove + 1
+        self.switch_side()
+
+    def unmake_move(self):
+        """
+        Takes back the last move played with make_move.
+
+        Returns:
+            int: The encoded move that was taken back.
+        """
+        undo = self.undo_stack.pop()
+        board = self.board
+        put = self.put
+        move = undo & 0xffff
+        from_square, to_square, flag = move & 63, move >> 6 & 63, move >> 12
+        self.side ^= 1
+        if self.side == BLACK:
+            self.fullmove -= 1
+        code = board[to_square]
+        if flag >= MOVE_PROMOTION:
+            code = PAWN | self.side << 3
+        put(to_square, undo >> 16 & 15)
+        put(from_square, code)
+        if flag == MOVE_EN_PASSANT:
+            put((from_square & ~7) | (to_square & 7), PAWN | (self.side ^ 1) << 3)
+        elif flag == MOVE_CASTLING:
+            rook_from, rook_to = CASTLING_ROOK_MOVES[to_square]
+            put(rook_from, board[rook_to])
+            put(rook_to, EMPTY)
+        self.castling = undo >> 20 & 15
+        ep = undo >> 24 & 127
+        self.ep = None if ep == 64 else ep
+        self.halfmove = undo >> 31
+        self.key = self.key_stack.pop()
+        self.checkers = self.check_stack.pop()
+        self._pins = None
+        return move
+
+    def _find_new_checkers(self, to_square, changed):
+        """
+        Finds the pieces checking the opponent after the side to move has moved.
+
+        Before the move the opponent was not in check, so every checker is
+        either the piece that arrived on to_square or a slider whose line to
+        the king runs through one of the changed squares; other lines are not
+        looked at.
+
+        Args:
+            to_square (int): The square the moving piece arrived on.
+            changed (int): A bitboard of the squares whose contents changed.
+
+        Returns:
+            int: A bitboard of the checking pieces.
+        """
+        bitboards = self.bitboards
+        own = self.side << 3
+        king = bitboards[KING | own ^ 8]
+        if not king:
+            return 0
+        king_square = king.bit_length() - 1
+        kind = self.board[to_square] & 7
+        checkers = 0
+        if kind == PAWN:
+            checkers = PAWN_ATTACKS[self.side ^ 1][king_square] & 1 << to_square
+        elif kind == KNIGHT:
+            checkers = KNIGHT_ATTACKS[king_square] & 1 << to_square
+        if changed & (ROOK_RAYS[king_square] | BISHOP_RAYS[king_square]):
+            occupied = self.occupied[WHITE] | self.occupied[BLACK]
+            queens = bitboards[QUEEN | own]
+            checkers |= (rook_attacks(king_square, occupied) & (bitboards[ROOK | own] | queens)
+                         | bishop_attacks(king_square, occupied) & (bitboards[BISHOP | own] | queens))
+        return checkers
+
+    def update_checkers(self):
+        """Recomputes checkers from scratch, after the board was set up with put()."""
+        square = self.king_square(self.side)
+        self.checkers = 0 if square is None else self.attackers(square, self.side ^ 1)
+        self._pins = None
+
+    def pins(self):
+        """
+        Returns the pins of the side to move, computing them on the first call after a move.
+
+        Returns:
+            tuple: (pinned, pins) as described at _get_pins.
+        """
+        if self._pins is None:
+            square = self.king_square(self.side)
+            self._pins = (0, {}) if square is None else \
+                self._get_pins(square, self.side, self.occupied[WHITE] | self.occupied[BLACK])
+        return self._pins
+
+    def compute_key(self):
+        """Computes the Zobrist key from scratch; it always equals the incrementally kept key."""
+        key = ZOBRIST_CASTLING[self.castling]
+        for square, code in enumerate(self.board):
+            key ^= ZOBRIST_PIECES[code][square]
+        if self.ep is not None:
+            key ^= ZOBRIST_EN_PASSANT[self.ep & 7]
+        if self.side == BLACK:
+            key ^= ZOBRIST_SIDE
+        return key
+
+    def find_castling_rights(self):
+        """Returns the castling rights implied by kings and rooks standing on their home squares."""
+        rights = 0
+        for color in (WHITE, BLACK):
+            for right, king_from, _, rook_from, _, _, _ in CASTLING_MOVES[color]:
+                if self.board[king_from] == KING | color << 3 and self.board[rook_from] == ROOK | color << 3:
+                    rights |= right
+        return rights
+
+    def count(self, code):
+        """Returns the number of pieces of a piece code."""
+        return self.material >> 4 * code & 15
+
+    def piece_squares(self, code):
+        """Yields the squares of the pieces of a piece code, from a1 to h8."""
+        pieces = self.bitboards[code]
+        while pieces:
+            bit = pieces & -pieces
+            pieces ^= bit
+            yield bit.bit_length() - 1
+
+    def pieces(self, color):
+        """Yields (square, piece code) for every piece of a color, from the king down to the pawns."""
+        for kind in (KING, QUEEN, ROOK, BISHOP, KNIGHT, PAWN):
+            code = kind | color << 3
+            for square in self.piece_squares(code):
+                yield square, code
+
+    def material_signature(self):
+        """
+        Returns the pieces on the board as a name such as 'KRPKR': white's
+        pieces, then black's, each from the king down to the pawns.
+        """
+        return "".join(PIECE_LETTERS[kind].upper() * self.count(kind | color << 3)
+                       for color in (WHITE, BLACK) for kind in (KING, QUEEN, ROOK, BISHOP, KNIGHT, PAWN))
+
+    def has_mating_material(self):
+        """
+        Checks whether either side still has material to mate with: a pawn,
+        rook or queen, or at least two minor pieces on the board.
+        """
+        if self.material & MATING_MATERIAL:
+            return True
+        return sum(self.count(kind | color << 3) for color in (WHITE, BLACK) for kind in (KNIGHT, BISHOP)) > 1
+
+    def king_square(self, color):
+        """Returns the square of the king of a color, or None."""
+        king = self.bitboards[KING | color << 3]
+        return king.bit_length() - 1 if king else None
+
+    def is_in_check(self, color):
+        """Checks whether the king of a color is attacked; for the side to move this is a lookup of checkers."""
+        if color == self.side:
+            return self.checkers != 0
+        square = self.king_square(color)
+        return square is not None and self.is_square_attacked(square, color ^ 1)
+
+    def attackers(self, square, by_color, occupied=None):
+        """
+        Returns the bitboard of all pieces of a color attacking a square.
+
+        Args:
+            square (int): The square to examine.
+            by_color (int): The attacking color.
+            occupied (int): The occupancy to slide through, by default the
+                            current one (e.g. without a king moving away).
+
+        Returns:
+            int: A bitboard of the attacking pieces.
+        """
+        bitboards = self.bitboards
+        enemy = by_color << 3
+        if occupied is None:
+            occupied = self.occupied[WHITE] | self.occupied[BLACK]
+        queens = bitboards[QUEEN | enemy]
+        return (KNIGHT_ATTACKS[square] & bitboards[KNIGHT | enemy]
+                | KING_ATTACKS[square] & bitboards[KING | enemy]
+                | PAWN_ATTACKS[by_color ^ 1][square] & bitboards[PAWN | enemy]
+                | rook_attacks(square, occupied) & (bitboards[ROOK | enemy] | queens)
+                | bishop_attacks(square, occupied) & (bitboards[BISHOP | enemy] | queens))
+
+    def is_square_attacked(self, square, by_color, occupied=None):
+        """
+        Checks whether a square is attacked by a color.
+
+        Leaper and pawn attacks are single table lookups; sliding attacks are
+        only computed when a slider stands on one of the square's lines.
+        """
+        bitboards = self.bitboards
+        enemy = by_color << 3
+        if KNIGHT_ATTACKS[square] & bitboards[KNIGHT | enemy] \
+           or PAWN_ATTACKS[by_color ^ 1][square] & bitboards[PAWN | enemy] \
+           or KING_ATTACKS[square] & bitboards[KING | enemy]:
+            return True
+        if occupied is None:
+            occupied = self.occupied[WHITE] | self.occupied[BLACK]
+        queens = bitboards[QUEEN | enemy]
+        rooks = bitboards[ROOK | enemy] | queens
+        if rooks & ROOK_RAYS[square] and rook_attacks(square, occupied) & rooks:
+            return True
+        bishops = bitboards[BISHOP | enemy] | queens
+        return bool(bishops & BISHOP_RAYS[square] and bishop_attacks(square, occupied) & bishops)
+
+    def attacked_squares(self, color):
+        """Returns the bitboard of all squares a color attacks, pawns set-wise and the pieces from the tables."""
+        bitboards = self.bitboards
+        own = color << 3
+        occupied = self.occupied[WHITE] | self.occupied[BLACK]
+        pawns = bitboards[PAWN | own]
+        if color == WHITE:
+            attacked = ((pawns & NOT_FILE_A) << 7 | (pawns & NOT_FILE_H) << 9) & ALL_SQUARES
+        else:
+            attacked = (pawns & NOT_FILE_A) >> 9 | (pawns & NOT_FILE_H) >> 7
+        for square in self.piece_squares(KNIGHT | own):
+            attacked |= KNIGHT_ATTACKS[square]
+        for square in self.piece_squares(KING | own):
+            attacked |= KING_ATTACKS[square]
+        for kind, attacks in ((BISHOP, bishop_attacks), (ROOK, rook_attacks), (QUEEN, queen_attacks)):
+            for square in self.piece_squares(kind | own):
+                attacked |= attacks(square, occupied)
+        return attacked
+
+    def generate_moves(self, color=None):
+        """
+        Generates the legal moves of a color.
+
+        Targets come from the attack tables, pawns are pushed set-wise.
+        Legality is decided up front with bit masks: a check mask holds the
+        squares that resolve a single check, and every pinned piece is
+        restricted to the line between its king and the pinner. No move is
+        played to test it.
+
+        Args:
+            color (int): The color to move, by default the side to move.
+
+        Yields:
+            int: Every legal move, encoded as described at MOVE_NORMAL.
+        """
+        if color is None:
+            color = self.side
+        bitboards = self.bitboards
+        enemy = color ^ 1
+        own = color << 3
+        own_pieces = self.occupied[color]
+        enemy_pieces = self.occupied[enemy]
+        occupied = own_pieces | enemy_pieces
+        king_square = self.king_square(color)
+        check_mask = ALL_SQUARES
+        pinned, pins = 0, {}
+        if king_square is not None:
+            targets = KING_ATTACKS[king_square] & ~own_pieces
+            without_king = occupied ^ 1 << king_square
+            while targets:
+                bit = targets & -targets
+                targets ^= bit
+                to = bit.bit_length() - 1
+                if not self.is_square_attacked(to, enemy, without_king):
+                    yield king_square | to << 6
+            if color == self.side:
+                checkers = self.checkers
+            else:
+                checkers = self.attackers(king_square, enemy, occupied)
+            if checkers & (checkers - 1):
+                return
+            if checkers:
+                check_mask = checkers | BETWEEN[king_square][checkers.bit_length() - 1]
+            else:
+                yield from self._generate_castling(color)
+            if color == self.side:
+                pinned, pins = self.pins()
+            else:
+                pinned, pins = self._get_pins(king_square, color, occupied)
+
+        pawns = bitboards[PAWN | own]
+        groups = [(pawns & ~pinned, check_mask)]
+        groups.extend((1 << square, check_mask & line) for square, line in pins.items() if pawns >> square & 1)
+        empty = ~occupied
+        for group, allowed in groups:
+            if color == WHITE:
+                single = group << 8 & empty
+                double = (single & RANK_3) << 8 & empty
+                west = (group & NOT_FILE_A) << 7 & enemy_pieces
+                east = (group & NOT_FILE_H) << 9 & enemy_pieces
+                shifts = ((single, 8), (west, 7), (east, 9))
+                double_shift = 16
+            else:
+                single = group >> 8 & empty
+                double = (single & RANK_6) >> 8 & empty
+                west = (group & NOT_FILE_A) >> 9 & enemy_pieces
+                east = (group & NOT_FILE_H) >> 7 & enemy_pieces
+                shifts = ((single, -8), (west, -9), (east, -7))
+                double_shift = -16
+            for targets, shift in shifts:
+                targets &= allowed
+                while targets:
+                    bit = targets & -targets
+                    targets ^= bit
+                    to = bit.bit_length() - 1
+                    move = to - shift | to << 6
+                    if bit & LAST_RANKS:
+                        for kind in (QUEEN, ROOK, BISHOP, KNIGHT):
+                            yield move | (kind + 2) << 12
+                    else:
+                        yield move
+            double &= allowed
+            while double:
+                bit = double & -double
+                double ^= bit
+                to = bit.bit_length() - 1
+                yield to - double_shift | to << 6 | MOVE_DOUBLE_PUSH << 12
+        if self.ep is not None and color == self.side:
+            capturers = PAWN_ATTACKS[enemy][self.ep] & pawns
+            while capturers:
+                bit = capturers & -capturers
+                capturers ^= bit
+                square = bit.bit_length() - 1
+                if self._is_en_passant_legal(square, self.ep, color, king_square, occupied):
+                    yield square | self.ep << 6 | MOVE_EN_PASSANT << 12
+
+        not_own = ~own_pieces & check_mask
+        knights = bitboards[KNIGHT | own] & ~pinned
+        while knights:
+            bit = knights & -knights
+            knights ^= bit
+            square = bit.bit_length() - 1
+            targets = KNIGHT_ATTACKS[square] & not_own
+            while targets:
+                bit = targets & -targets
+                targets ^= bit
+                yield square | (bit.bit_length() - 1) << 6
+        for kind, attacks in ((BISHOP, bishop_attacks), (ROOK, rook_attacks), (QUEEN, queen_attacks)):
+            pieces = bitboards[kind | own]
+            while pieces:
+                bit = pieces & -pieces
+                pieces ^= bit
+                square = bit.bit_length() - 1
+                targets = attacks(square, occupied) & not_own
+                if bit & pinned:
+                    targets &= pins[square]
+                while targets:
+                    bit = targets & -targets
+                    targets ^= bit
+                    yield square | (bit.bit_length() - 1) << 6
+
+    def _get_pins(self, king_square, color, occupied):
+        """
+        Finds the pieces pinned to a king.
+
+        Returns:
+            tuple: (pinned, pins) with the bitboard of pinned pieces and a dict
+                   mapping each pinned square to the bit mask of squares it may
+                   still move to (the line up to and including the pinner).
+        """
+        bitboards = self.bitboards
+        enemy = (color ^ 1) << 3
+        queens = bitboards[QUEEN | enemy]
+        snipers = (ROOK_RAYS[king_square] & (bitboards[ROOK | enemy] | queens)
+                   | BISHOP_RAYS[king_square] & (bitboards[BISHOP | enemy] | queens))
+        pinned, pins = 0, {}
+        while snipers:
+            bit = snipers & -snipers
+            snipers ^= bit
+            between = BETWEEN[king_square][bit.bit_length() - 1]
+            blockers = between & occupied
+            if blockers and not blockers & (blockers - 1) and blockers & self.occupied[color]:
+                pinned |= blockers
+                pins[blockers.bit_length() - 1] = between | bit
+        return pinned, pins
+
+    def _is_en_passant_legal(self, square, to, color, king_square, occupied):
+        """
+        Checks whether an en passant capture leaves the own king safe.
+
+        Two pawns leave the same rank at once, which neither the check mask
+        nor the pins describe, so the king's attackers are recomputed on the
+        occupancy after the capture.
+        """
+        if king_square is None:
+            return True
+        captured = 1 << ((square & ~7) | (to & 7))
+        occupied = (occupied ^ 1 << square ^ captured) | 1 << to
+        return not self.attackers(king_square, color ^ 1, occupied) & ~captured
+
+    def _generate_castling(self, color):
+        """Yields the castling moves of a color; its king must not be in check."""
+        board = self.board
+        king, rook = KING | color << 3, ROOK | color << 3
+        for right, king_from, king_to, rook_from, _, empty, safe in CASTLING_MOVES[color]:
+            if self.castling & right and board[king_from] == king and board[rook_from] == rook \
+               and not any(board[square] for square in empty) \
+               and not any(self.is_square_attacked(square, color ^ 1) for square in safe):
+                yield king_from | king_to << 6 | MOVE_CASTLING << 12
+
 class Piece(object):
-    """Base class for all chess pieces."""
+    """
+    Base class for all chess pieces.
+
+    A Game keeps one instance per piece type and player; tiles hand these out
+    as views of the piece codes stored in the Position.
+    """
+    kind = EMPTY
+
     def __init__(self, name, player):
         """
         Initializes a Piece.
@@ -40,6 +892,11 @@ class Piece(object):
     def __str__(self):
         """Returns the string representation of the piece, with color."""
         return Color.colorize(self.name, self.player.get_color())
+
+    @property
+    def code(self):
+        """The piece code of this piece in a Position."""
+        return self.kind | self.player.side << 3
     
     def is_move_allowed(self, fromTile, toTile, simulate=False):
         """
@@ -57,72 +914,76 @@ class Piece(object):
             bool: True if the move is allowed, False otherwise.
         """
         raise NotImplementedError("Method not implemented: Piece.is_move_allowed")
-    
-    def move(self, fromTile, toTile, game):
+
+    def move(self, fromTile, toTile, game, promotion=None):
         """
         Executes a move from one tile to another.
 
-        This method checks if the move is allowed, performs the move,
-        and ensures the king is not left in check.
+        The move is looked up among the legal moves of the player and, if
+        found, played on the game's position. A pawn reaching the last rank
+        promotes to the given piece, or else asks the player which piece to
+        promote to.
 
         Args:
             fromTile (Tile): The starting tile.
             toTile (Tile): The destination tile.
             game (Game): The current game instance.
+            promotion (type): The Piece class to promote to, or None to ask.
 
         Returns:
             bool: True if the move was successful, False otherwise.
         """
-        if self.is_move_allowed(fromTile, toTile):
-            original_piece = toTile.piece
-            toTile.piece = self
-            fromTile.piece = None
-            if game.is_king_in_check(self.player):
-                fromTile.piece = self
-                toTile.piece = original_piece
-                print("Error: This move is not allowed as it would put your king in check.")
-                return False
-            self.post_move_action(fromTile, toTile)
-            return True
-        else:
-            print("Error: This move not allowed due to chess rules")
+        moves = [move for move in game.generate_legal_moves(self.player)
+                 if move.from_tile is fromTile and move.to_tile is toTile]
+        if not moves:
+            if self.is_move_allowed(fromTile, toTile):
+                game.output("Error: This move is not allowed as it would put your king in check.")
+            else:
+                game.output("Error: This move not allowed due to chess rules")
             return False
-
-    def post_move_action(self, fromTile, toTile):
-        """
-        Performs any actions required after a move is completed.
-
-        This can be overridden by subclasses for special moves like castling
-        or pawn promotion.
-        """
-        pass
+        if promotion is not None and moves[0].promotion is None:
+            game.output("Error: Only a pawn reaching the last rank can promote.")
+            return False
+        if len(moves) > 1:
+            if promotion is None:
+                promotion = game.choose_promotion(self.player)
+            moves = [move for move in moves if move.promotion is promotion]
+        game.make_move(moves[0])
+        return True
 
 class Knight(Piece):
     """Represents a Knight piece."""
+    kind = KNIGHT
+    letter = "N"
+    offsets = KNIGHT_OFFSETS
+
     def __init__(self, player, use_symbols=True):
         """Initializes a Knight."""
         super().__init__("♞" if use_symbols else "N", player)
     
     def is_move_allowed(self, fromTile, toTile, simulate=False):
         """Checks if the Knight's L-shaped move is valid."""
-        if (toTile in (fromTile.get_tile(x, y) for x, y in ((-1, -2), (1, -2), (2, -1), (2, 1), (1, 2), (-1, 2), (-2, 1), (-2, -1)))
+        if (toTile in (fromTile.get_tile(x, y) for x, y in self.offsets)
             and (toTile.piece == None or toTile.piece.player != fromTile.piece.player)):
             return True
         return False
 
 class Pawn(Piece):
     """Represents a Pawn piece."""
+    kind = PAWN
+    letter = "P"
+
     def __init__(self, player, use_symbols=True):
         """Initializes a Pawn."""
         super().__init__("♟" if use_symbols else "P", player)
-        self._firstmove = True
 
     def is_move_allowed(self, fromTile, toTile, simulate=False):
         """Checks if the Pawn's move is valid, including initial double move, captures, and en passant."""
         d = self.player.direction
         if toTile.piece == None and fromTile.get_tile(0, d) == toTile:
             return True
-        if self._firstmove and toTile.piece == None and fromTile.get_tile(0, 2 * d) == toTile:
+        if self._is_on_start_row(fromTile) and toTile.piece == None and fromTile.get_tile(0, 2 * d) == toTile \
+           and fromTile.get_tile(0, d).piece == None:
             return True
         if (toTile.piece != None and toTile.piece.player != fromTile.piece.player
             and toTile in (fromTile.get_tile(-1, d), fromTile.get_tile(1, d))):
@@ -132,24 +993,23 @@ class Pawn(Piece):
             return True
         return False
 
-    def post_move_action(self, fromTile, toTile):
-        """Handles post-move logic for a Pawn, including setting first move flag and en passant captures."""
-        self._firstmove = False
-        game = fromTile.game
-        if toTile == game._en_passant_target_tile:
-            captured_pawn_tile = game.board[toTile.row - self.player.direction][toTile.col]
-            captured_pawn_tile.piece = None
+    def _is_on_start_row(self, tile):
+        """Pawns that have not moved yet still stand on their second rank."""
+        return tile.row == (1 if self.player.direction == 1 else len(tile.board) - 2)
 
 class Rook(Piece):
     """Represents a Rook piece."""
+    kind = ROOK
+    letter = "R"
+    directions = ROOK_DIRECTIONS
+
     def __init__(self, player, use_symbols=True):
         """Initializes a Rook."""
         super().__init__("♜" if use_symbols else "R", player)
-        self._has_moved = False
         
     def is_move_allowed(self, fromTile, toTile, simulate=False):
         """Checks if the Rook's straight-line move is valid."""
-        for x, y in [(1, 0), (-1, 0), (0, 1), (0, -1)]:
+        for x, y in Rook.directions:
             for i in range(1, 8):
                 if fromTile.get_tile(i * x, i * y) == toTile and (toTile.piece == None or fromTile.piece.player != toTile.piece.player):
                     return True
@@ -159,19 +1019,19 @@ class Rook(Piece):
                         break
         return False
 
-    def post_move_action(self, fromTile, toTile):
-        """Sets the _has_moved flag to True after the Rook moves."""
-        self._has_moved = True
-
 class Bishop(Piece):
     """Represents a Bishop piece."""
+    kind = BISHOP
+    letter = "B"
+    directions = BISHOP_DIRECTIONS
+
     def __init__(self, player, use_symbols=True):
         """Initializes a Bishop."""
         super().__init__("♝" if use_symbols else "B", player)
     
     def is_move_allowed(self, fromTile, toTile, simulate=False):
         """Checks if the Bishop's diagonal move is valid."""
-        for x, y in [(1, 1), (-1, 1), (1, -1), (-1, -1)]:
+        for x, y in Bishop.directions:
             for i in range(1, 8):
                 if fromTile.get_tile(i * x, i * y) == toTile and (toTile.piece == None or fromTile.piece.player != toTile.piece.player):
                     return True
@@ -183,6 +1043,10 @@ class Bishop(Piece):
 
 class Queen(Rook, Bishop):
     """Represents a Queen piece."""
+    kind = QUEEN
+    letter = "Q"
+    directions = Rook.directions + Bishop.directions
+
     def __init__(self, player, use_symbols=True):
         """Initializes a Queen."""
         Piece.__init__(self, "♛" if use_symbols else "Q", player)
@@ -193,25 +1057,28 @@ class Queen(Rook, Bishop):
 
 class King(Piece):
     """Represents a King piece."""
+    kind = KING
+    letter = "K"
+    offsets = KING_OFFSETS
+
     def __init__(self, player, useSymbols=True):
         """Initializes a King."""
         super().__init__("♚" if useSymbols else "K", player)
-        self._has_moved = False
 
     def is_move_allowed(self, fromTile, toTile, simulate=False):
         # Basic king move
-        is_basic_move = (toTile in (fromTile.get_tile(-1, -1), fromTile.get_tile(-1, 0), fromTile.get_tile(-1, 1),
-                           fromTile.get_tile(0, -1), fromTile.get_tile(0, 1),
-                           fromTile.get_tile(1, -1), fromTile.get_tile(1, 0), fromTile.get_tile(1, 1))
+        is_basic_move = (toTile in (fromTile.get_tile(x, y) for x, y in self.offsets)
                 and ((toTile.piece == None) or (toTile.piece.player != self.player)))
 
         # Castling
         is_castling = False
-        if not simulate and not self._has_moved and fromTile.row == toTile.row and abs(fromTile.col - toTile.col) == 2:
+        if not simulate and fromTile.row == toTile.row and abs(fromTile.col - toTile.col) == 2:
             game = fromTile.game
-            if not game.is_king_in_check(self.player):
+            kingside = toTile.col > fromTile.col
+            right = (CASTLE_WHITE_KINGSIDE if kingside else CASTLE_WHITE_QUEENSIDE) << 2 * self.player.side
+            if game.position.castling & right and not game.is_king_in_check(self.player):
                 # Kingside
-                if toTile.col > fromTile.col:
+                if kingside:
                     rook_tile = fromTile.get_tile(3, 0)
                     path_clear = fromTile.get_tile(1, 0).piece is None and fromTile.get_tile(2, 0).piece is None
                     square_to_pass = fromTile.get_tile(1, 0)
@@ -221,7 +1088,7 @@ class King(Piece):
                     path_clear = fromTile.get_tile(-1, 0).piece is None and fromTile.get_tile(-2, 0).piece is None and fromTile.get_tile(-3, 0).piece is None
                     square_to_pass = fromTile.get_tile(-1, 0)
 
-                if path_clear and rook_tile and isinstance(rook_tile.piece, Rook) and not rook_tile.piece._has_moved:
+                if path_clear and rook_tile and isinstance(rook_tile.piece, Rook):
                     if not game.is_square_attacked(square_to_pass, game.get_opponent(self.player)) and \
                        not game.is_square_attacked(toTile, game.get_opponent(self.player)):
                         is_castling = True
@@ -235,25 +1102,52 @@ class King(Piece):
         opponent_king_tile = game.get_king_tile(opponent)
 
         if opponent_king_tile:
-            if abs(toTile.col - opponent_king_tile.row) <= 1 and abs(toTile.row - opponent_king_tile.row) <= 1:
-                print("Error: Kings cannot be adjacent.")
+            if abs(toTile.col - opponent_king_tile.col) <= 1 and abs(toTile.row - opponent_king_tile.row) <= 1:
+                fromTile.game.output("Error: Kings cannot be adjacent.")
                 return False
 
         return True
 
+PIECE_CLASSES = (None, Pawn, Knight, Bishop, Rook, Queen, King)
+PROMOTION_CHOICES = {'Q': Queen, 'R': Rook, 'B': Bishop, 'N': Knight}
 
-    def post_move_action(self, fromTile, toTile):
-        self._has_moved = True
-        if abs(fromTile.col - toTile.col) == 2:
-            if toTile.col > fromTile.col:
-                rook_from = toTile.get_tile(1, 0)
-                rook_to = toTile.get_tile(-1, 0)
-            else:
-                rook_from = toTile.get_tile(-2, 0)
-                rook_to = toTile.get_tile(1, 0)
-            rook_to.piece = rook_from.piece
-            rook_from.piece = None
-            rook_to.piece._has_moved = True
+class Move(object):
+    """A legal move, as produced by Game.generate_legal_moves."""
+    __slots__ = ("code", "from_tile", "to_tile")
+
+    def __init__(self, code, from_tile, to_tile):
+        """
+        Initializes a Move.
+
+        Args:
+            code (int): The move as encoded by Position.generate_moves.
+            from_tile (Tile): The starting tile of the move.
+            to_tile (Tile): The destination tile of the move.
+        """
+        self.code = code
+        self.from_tile = from_tile
+        self.to_tile = to_tile
+
+    @property
+    def promotion(self):
+        """The Piece class a pawn promotes to, or None."""
+        flag = self.code >> 12
+        return PIECE_CLASSES[flag - 2] if flag >= MOVE_PROMOTION else None
+
+    @property
+    def is_castling(self):
+        return self.code >> 12 == MOVE_CASTLING
+
+    @property
+    def is_en_passant(self):
+        return self.code >> 12 == MOVE_EN_PASSANT
+
+    def __str__(self):
+        """Returns the move in coordinate notation (e.g. 'e2 e4')."""
+        text = "%s %s" % (self.from_tile.get_name(), self.to_tile.get_name())
+        if self.promotion:
+            text += " " + self.promotion.letter
+        return text
 
 class Command(object):
     """Base class for all game commands."""
@@ -288,12 +1182,13 @@ class CommandMove(Command):
         """
         Executes the move command.
 
-        Parses the 'from' and 'to' positions, validates the move,
-        and updates the game state.
+        Parses the 'from' and 'to' positions and the optional promotion
+        piece (q, r, b or n), validates the move, and updates the game state.
         """
-        if len(params) != 2:
-            print("Error: Wrong Usage (expected: move FROM TO)")
+        if len(params) not in (2, 3) or (len(params) == 3 and params[2].upper() not in PROMOTION_CHOICES):
+            self._game.output("Error: Wrong Usage (expected: move FROM TO [q|r|b|n])")
             return
+        promotion = PROMOTION_CHOICES[params[2].upper()] if len(params) == 3 else None
         
         fromPosition = params[0]
         toPosition = params[1]
@@ -301,35 +1196,194 @@ class CommandMove(Command):
         fromTile = self._game.board[int(fromPosition[1]) - 1][ord(fromPosition[0].lower()) - ord("a")]
         toTile = self._game.board[int(toPosition[1]) - 1][ord(toPosition[0].lower()) - ord("a")]
         
-        self._game._en_passant_target_tile = None
-
         if fromTile.piece == None:
-            print("Error: No piece found to move.")
+            self._game.output("Error: No piece found to move.")
             return
         
         if fromTile.piece.player != self._game.current_player():
-            print("Error: Only own pieces can be moved.")
+            self._game.output("Error: Only own pieces can be moved.")
             return
 
-        is_pawn_move = isinstance(fromTile.piece, Pawn)
-        is_capture = toTile.piece is not None
+        if fromTile.piece.move(fromTile, toTile, self._game, promotion):
+            if self._game.is_king_in_check(self._game.current_player()):
+                self._game.output("Check!")
 
-        if fromTile.move_piece_to(toTile, self._game):
-            if is_pawn_move or is_capture:
-                self._game._halfmove_clock = 0
-            else:
-                self._game._halfmove_clock += 1
-            piece = toTile.piece
-            if isinstance(piece, Pawn):
-                if abs(fromTile.row - toTile.row) == 2:
-                    self._game._en_passant_target_tile = fromTile.get_tile(0, piece.player.direction)
-                if (piece.player.direction == 1 and toTile.row == 7) or \
-                   (piece.player.direction == -1 and toTile.row == 0):
-                    self._game.promote_pawn(toTile)
-            opponent = self._game.get_opponent(piece.player)
-            if self._game.is_king_in_check(opponent):
-                print("Check!")
-            self._game.switch_player()
+class CommandBoard(Command):
+    """Command to show the board."""
+    names = ["board"]
+
+    def execute(self, params):
+        """Prints the board."""
+        self._game.print_board()
+
+class CommandRender(Command):
+    """Command to choose how the board is drawn."""
+    names = ["render"]
+
+    def execute(self, params):
+        """Switches to the given render mode, or prints the current one and what has been drawn."""
+        if len(params) > 1:
+            self._game.output("Error: Wrong Usage (expected: render [%s])" % "|".join(BoardRenderer.MODES))
+            return
+        renderer = self._game.renderer
+        if params:
+            renderer.set_mode(params[0])
+            return
+        self._game.output("Render mode %s: %d boards drawn, %d characters written"
+                          % (renderer.mode, renderer.draws, renderer.bytes_written))
+
+class CommandUndo(Command):
+    """Command to take back the last move."""
+    names = ["undo", "takeback"]
+
+    def execute(self, params):
+        """Takes back the last move played."""
+        if not self._game.position.undo_stack:
+            self._game.output("Error: No move to take back.")
+            return
+        self._game.unmake_move()
+
+class CommandThink(Command):
+    """Command to let the engine search and play a move for the current player."""
+    names = ["think", "go"]
+
+    def execute(self, params):
+        """Searches the position for the given number of seconds and plays the best move."""
+        max_time = parse_positive_number(params[0]) if params else EnginePlayer.DEFAULT_TIME
+        if len(params) > 1 or max_time is None:
+            self._game.output("Error: Wrong Usage (expected: think [SECONDS])")
+            return
+        self._game.play_engine_move(self._game.current_player(), max_time)
+
+class CommandComputer(Command):
+    """Command to let the engine play the opponent's pieces."""
+    names = ["computer", "cpu"]
+
+    def execute(self, params):
+        """Turns the opponent into an engine player, or both players back into humans with 'off'."""
+        max_time = parse_positive_number(params[0]) if params and params[0] != "off" else EnginePlayer.DEFAULT_TIME
+        if len(params) > 1 or max_time is None:
+            self._game.output("Error: Wrong Usage (expected: computer [SECONDS|off])")
+            return
+        if params and params[0] == "off":
+            for index, player in enumerate(self._game.players):
+                if isinstance(player, EnginePlayer):
+                    self._game.set_player(index, Player(player._name, player.get_color(), player.direction))
+            return
+        opponent = self._game.get_opponent(self._game.current_player())
+        self._game.set_player(self._game.players.index(opponent),
+                              EnginePlayer(opponent._name, opponent.get_color(), opponent.direction, max_time))
+
+class CommandHash(Command):
+    """Command to show the engine's transposition table counters or to resize the table."""
+    names = ["hash"]
+
+    def execute(self, params):
+        """Resizes the table to the given number of megabytes, or prints its counters."""
+        size_mb = parse_positive_number(params[0]) if params else None
+        if len(params) > 1 or (params and size_mb is None):
+            self._game.output("Error: Wrong Usage (expected: hash [MB])")
+            return
+        tt = self._game.get_engine().tt
+        if params:
+            tt.resize(size_mb)
+        self._game.output("Hash table: %g MB, %d entries, %d stores, %d hits, %d misses, %d collisions, %d permille full"
+                          % (tt.size_mb, len(tt.keys), tt.stores, tt.hits, tt.misses, tt.collisions, tt.hashfull()))
+
+class CommandBook(Command):
+    """Command to open an opening book for the engine or to show the book moves of the position."""
+    names = ["book"]
+
+    def execute(self, params):
+        """Opens the given book file, closes it with 'off', or lists the book moves and probe statistics."""
+        if len(params) > 1:
+            self._game.output("Error: Wrong Usage (expected: book [FILE|off])")
+            return
+        import book
+        game = self._game
+        if params:
+            if game.book is not None:
+                game.book.close()
+                game.book = None
+            if params[0] != "off":
+                game.book = book.Book(params[0])
+            return
+        if game.book is None:
+            game.output("Error: No book open (expected: book FILE)")
+            return
+        moves = game.book.probe(game.position)
+        game.output("Book moves: %s" % (", ".join("%s (%d)" % (game.get_move(move), weight) for move, weight in moves)
+                                         if moves else "none"))
+        game.output(game.book.stats())
+
+class CommandTablebase(Command):
+    """Command to open the endgame tablebases or to look up the current position in them."""
+    names = ["tablebase", "tb"]
+
+    def execute(self, params):
+        """Opens the tablebases of a directory, closes them with 'off', or prints the result of the position."""
+        if len(params) > 1:
+            self._game.output("Error: Wrong Usage (expected: tablebase [DIRECTORY|off])")
+            return
+        import tablebase
+        game = self._game
+        if params:
+            if game.tablebases is not None:
+                game.tablebases.close()
+                game.tablebases = None
+            if params[0] != "off":
+                game.tablebases = tablebase.Tablebases(params[0])
+            return
+        found = game.tablebases.probe(game.position) if game.tablebases is not None else None
+        if found is None:
+            game.output("Error: The position is not in the tablebases.")
+            return
+        game.output("Tablebase: %s" % game.describe_tablebase_result(*found))
+
+class CommandStats(Command):
+    """Command to show the legality cache and profiling counters of the rules core, or to switch profiling on and off."""
+    names = ["stats"]
+
+    def execute(self, params):
+        """Prints the counters, switches profiling 'on' or 'off', or sets the counters back to zero with 'reset'."""
+        if len(params) > 1 or (params and params[0] not in ("on", "off", "reset")):
+            self._game.output("Error: Wrong Usage (expected: stats [on|off|reset])")
+            return
+        game = self._game
+        if not params:
+            game.output(game.legality_cache.stats())
+            if game.profiler is not None:
+                game.output(game.profiler.report())
+            return
+        if params[0] == "reset":
+            game.legality_cache.reset_counters()
+        if params[0] == "on":
+            if game.profiler is None:
+                import profiling
+                game.profiler = profiling.Profiler()
+            game.profiler.install()
+            return
+        if game.profiler is None:
+            if params[0] == "off":
+                game.output("Error: Profiling is off (expected: stats on)")
+            return
+        if params[0] == "off":
+            game.profiler.uninstall()
+        else:
+            game.profiler.reset()
+
+class CommandPerft(Command):
+    """Command to count the legal move tree of the current position."""
+    names = ["perft"]
+
+    def execute(self, params):
+        """Counts the leaf nodes to a depth, optionally per root move ('divide')."""
+        if len(params) not in (1, 2) or (len(params) == 2 and params[1] != "divide"):
+            self._game.output("Error: Wrong Usage (expected: perft DEPTH [divide])")
+            return
+        import perft
+        perft.report(self._game.position.copy(), int(params[0]), len(params) == 2, self._game.workers,
+                     self._game.output)
 
 class CommandSetName(Command):
     """Command to set the current player's name."""
@@ -338,49 +1392,160 @@ class CommandSetName(Command):
     def execute(self, params):
         """Sets the name for the current player."""
         if len(params) != 1:
-            print("Error: Wrong Usage (expected: setname NAME)")
+            self._game.output("Error: Wrong Usage (expected: setname NAME)")
         
         self._game.current_player().set_name(params[0])
     
-import pickle
+class CommandFen(Command):
+    """Command to print the current position in Forsyth-Edwards Notation."""
+    names = ["fen"]
+
+    def execute(self, params):
+        """Prints the FEN of the current position."""
+        self._game.output(self._game.to_fen())
+
+class CommandSetFen(Command):
+    """Command to set up a position given in Forsyth-Edwards Notation."""
+    names = ["setfen"]
+
+    def execute(self, params):
+        """Replaces the current position by the one described by the FEN."""
+        if len(params) < 4:
+            self._game.output("Error: Wrong Usage (expected: setfen FEN)")
+            return
+        try:
+            self._game.set_fen(" ".join(params))
+        except ValueError as e:
+            self._game.output("Error: %s" % e)
+
+class CommandSavePgn(Command):
+    """Command to export the game to a PGN file."""
+    names = ["savepgn"]
+
+    def execute(self, params):
+        """Writes the moves played so far and the result, '*' while the game goes on, as PGN."""
+        if len(params) != 1:
+            self._game.output("Error: Wrong Usage (expected: savepgn FILENAME)")
+            return
+        import pgn
+        from archive import game_result
+        game = self._game
+        headers = {"White": game.players[WHITE]._name, "Black": game.players[BLACK]._name}
+        try:
+            with open(params[0], 'w') as f:
+                pgn.write_game(f, game.get_moves(), headers, game.start_fen, game_result(game))
+            self._game.output("Game saved to %s" % params[0])
+        except Exception as e:
+            self._game.output("Error saving game: %s" % e)
+
+class CommandLoadPgn(Command):
+    """Command to replay a game from a PGN file."""
+    names = ["loadpgn"]
+
+    def execute(self, params):
+        """Replays the NUMBERth game (by default the first) of a PGN file; its moves can be taken back."""
+        if len(params) not in (1, 2) or (len(params) == 2 and (not params[1].isdigit() or int(params[1]) < 1)):
+            self._game.output("Error: Wrong Usage (expected: loadpgn FILENAME [NUMBER])")
+            return
+        import pgn
+        number = int(params[1]) if len(params) == 2 else 1
+        try:
+            for i, pgn_game in enumerate(pgn.read_games(params[0]), start=1):
+                if i == number:
+                    break
+            else:
+                self._game.output("Error: %s has no game %d." % (params[0], number))
+                return
+        except Exception as e:
+            self._game.output("Error loading game: %s" % e)
+            return
+        if pgn_game.error:
+            self._game.output("Error: %s" % pgn_game.error)
+        self._game.set_fen(pgn_game.fen)
+        for move in pgn_game.moves:
+            self._game.make_move(self._game.get_move(move))
+        self._game.output("Game loaded from %s (%s - %s, %d plies)" % (params[0], pgn_game.headers.get("White", "?"),
+                                                                     pgn_game.headers.get("Black", "?"),
+                                                                     len(pgn_game.moves)))
+
+class CommandArchive(Command):
+    """Command to append the game to a binary game archive."""
+    names = ["archive"]
+
+    def execute(self, params):
+        """Appends the moves played so far, the players' names and the result to an archive."""
+        if len(params) != 1:
+            self._game.output("Error: Wrong Usage (expected: archive FILENAME)")
+            return
+        import archive
+        try:
+            with archive.ArchiveWriter(params[0]) as writer:
+                number = writer.append_game(self._game) + 1
+        except OSError as e:
+            self._game.output("Error saving game: %s" % e)
+            return
+        except ValueError as e:
+            self._game.output(str(e))
+            return
+        self._game.output("Game %d archived in %s" % (number, params[0]))
+
+class CommandLoadArchive(Command):
+    """Command to restore a game from a binary game archive."""
+    names = ["loadarchive"]
+
+    def execute(self, params):
+        """Restores the NUMBERth game of an archive after PLY moves (by default all); its moves can be taken back."""
+        if len(params) not in (2, 3) or not all(param.isdigit() for param in params[1:]) or int(params[1]) < 1:
+            self._game.output("Error: Wrong Usage (expected: loadarchive FILENAME NUMBER [PLY])")
+            return
+        import archive
+        try:
+            with archive.Archive(params[0]) as games:
+                games.game(int(params[1]) - 1, int(params[2]) if len(params) == 3 else None, self._game)
+        except OSError as e:
+            self._game.output("Error loading game: %s" % e)
+            return
+        except (ValueError, IndexError) as e:
+            # The archive's own errors already read 'Error: ...'.
+            self._game.output(str(e))
+            return
+        self._game.output("Game loaded from %s (%s - %s, %d plies)" % (params[0], self._game.players[0]._name,
+                                                                     self._game.players[1]._name,
+                                                                     len(self._game.get_moves())))
 
 class CommandSave(Command):
     """Command to save the game to a file."""
     names = ["save"]
 
     def execute(self, params):
-        """Saves the current game state to a file using pickle."""
+        """Saves the current position to a file as a line of FEN."""
         if len(params) != 1:
-            print("Error: Wrong Usage (expected: save FILENAME)")
+            self._game.output("Error: Wrong Usage (expected: save FILENAME)")
             return
         filename = params[0]
         try:
-            with open(filename, 'wb') as f:
-                pickle.dump(self._game, f)
-            print("Game saved to %s" % filename)
+            with open(filename, 'w') as f:
+                f.write(self._game.to_fen() + "\n")
+            self._game.output("Game saved to %s" % filename)
         except Exception as e:
-            print("Error saving game: %s" % e)
+            self._game.output("Error saving game: %s" % e)
 
 class CommandLoad(Command):
     """Command to load a game from a file."""
     names = ["load"]
 
     def execute(self, params):
-        """Loads a game state from a file using pickle."""
+        """Loads a position saved as a line of FEN."""
         if len(params) != 1:
-            print("Error: Wrong Usage (expected: load FILENAME)")
+            self._game.output("Error: Wrong Usage (expected: load FILENAME)")
             return
         filename = params[0]
         try:
-            with open(filename, 'rb') as f:
-                loaded_game = pickle.load(f)
-            self._game.board = loaded_game.board
-            self._game.players = loaded_game.players
-            self._game._currentPlayer = loaded_game._currentPlayer
-            self._game._en_passant_target_tile = loaded_game._en_passant_target_tile
-            print("Game loaded from %s" % filename)
+            with open(filename) as f:
+                self._game.set_fen(f.readline())
+            self._game.output("Game loaded from %s" % filename)
         except Exception as e:
-            print("Error loading game: %s" % e)
+            self._game.output("Error loading game: %s" % e)
 
 class CommandHelp(Command):
     """Command to display help information."""
@@ -388,12 +1553,28 @@ class CommandHelp(Command):
     
     def execute(self, params):
         """Prints a list of available commands and their usage."""
-        print("Following commands are available:"
-              "  move, mv FROM TO   Moves a Piece (example: mv b2 b3)"
-              "  setname, sn NAME   Set the current player name (example: setname Kasparov)"
-              "  save FILENAME      Save the current game to a file (example: save mygame.sav)"
-              "  load FILENAME      Load a game from a file (example: load mygame.sav)"
-              "  help, h            Display this help (example: h)"
+        self._game.output("Following commands are available:\n"
+              "  move, mv FROM TO [q|r|b|n]  Moves a Piece, optionally promoting (example: mv b7 b8 q)\n"
+              "  setname, sn NAME   Set the current player name (example: setname Kasparov)\n"
+              "  save FILENAME      Save the current game to a file (example: save mygame.sav)\n"
+              "  load FILENAME      Load a game from a file (example: load mygame.sav)\n"
+              "  savepgn FILENAME   Exports the game as PGN (example: savepgn mygame.pgn)\n"
+              "  loadpgn FILENAME [N]  Replays the Nth game of a PGN file (example: loadpgn games.pgn 3)\n"
+              "  archive FILENAME   Appends the game to a binary archive (example: archive games.pga)\n"
+              "  loadarchive FILENAME N [PLY]  Restores game N of an archive (example: loadarchive games.pga 3 20)\n"
+              "  fen                Prints the position in FEN (example: fen)\n"
+              "  setfen FEN         Sets up a position given in FEN (example: setfen 8/8/8/8/8/8/8/K1k5 w - - 0 1)\n"
+              "  board              Shows the board (example: board)\n"
+              "  render [color|plain|diff|off]  Chooses how the board is drawn (example: render diff)\n"
+              "  undo, takeback     Takes back the last move (example: undo)\n"
+              "  think, go [SECS]   Lets the engine play a move for you (example: go 5)\n"
+              "  computer, cpu [SECS|off]  Lets the engine play your opponent (example: cpu 2)\n"
+              "  perft DEPTH [divide]  Counts the positions DEPTH moves ahead (example: perft 3)\n"
+              "  hash [MB]          Shows or resizes the engine's hash table (example: hash 64)\n"
+              "  book [FILE|off]    Opens an opening book or lists its moves (example: book openings.bin)\n"
+              "  tablebase, tb [DIR|off]  Opens endgame tablebases or probes the position (example: tb tablebases)\n"
+              "  stats [on|off|reset]  Shows cache and profiling counters (example: stats on)\n"
+              "  help, h            Display this help (example: h)\n"
               "  quit, q            Quits the Game (example: q)\n")
 
 class CommandFactory:
@@ -424,26 +1605,38 @@ class StartPositionBuilder(object):
             self._game.board[line][0].piece = Rook(player)
             self._game.board[line][1].piece = Knight(player)
             self._game.board[line][2].piece = Bishop(player)
-            self._game.board[line][3].piece = King(player)
-            self._game.board[line][4].piece = Queen(player)
+            self._game.board[line][3].piece = Queen(player)
+            self._game.board[line][4].piece = King(player)
             self._game.board[line][5].piece = Bishop(player)
             self._game.board[line][6].piece = Knight(player)
             self._game.board[line][7].piece = Rook(player)
             player = player2
+        self._game.position.set_castling(self._game.position.find_castling_rights())
 
 class Tile(object):
+    __slots__ = ("isBlack", "board", "col", "row", "game", "square")
+
     def __init__(self, isBlack, board, col, row, game):
         self.isBlack = isBlack
         self.board = board
         self.col = col
         self.row = row
-        self.piece = None
         self.game = game
-        
+        self.square = row * 8 + col
+
+    @property
+    def piece(self):
+        return self.game.get_piece(self.game.position.board[self.square])
+
+    @piece.setter
+    def piece(self, piece):
+        self.game.position.put(self.square, piece.code if piece else EMPTY)
+        self.game.position.update_checkers()
+
     def __str__(self):
         piece_str = " %s " % self.piece if self.piece else "   "
         if self.isBlack:
-            return Color.BG_WHITE + piece_str + Color.END
+            return Color.colorize(piece_str, Color.BG_WHITE)
         else:
             return piece_str
         
@@ -456,11 +1649,235 @@ class Tile(object):
         else:
             return None
 
+    def get_name(self):
+        return chr(ord("a") + self.col) + str(self.row + 1)
+
+class LegalityCache(object):
+    """
+    Remembers the legal moves and attacked squares of recently seen positions.
+
+    Within one turn the game asks the same questions about an unchanged
+    position several times (is there a legal move, which moves are legal,
+    is a square attacked). The answers are kept per Zobrist key, which
+    covers the side to move, castling rights and a usable en passant
+    square, so a move, a promotion or a loaded position simply leads to
+    other entries. Only the most recently used positions are kept.
+    """
+
+    def __init__(self, capacity=256):
+        """
+        Initializes an empty LegalityCache.
+
+        Args:
+            capacity (int): The number of positions kept.
+        """
+        self.capacity = capacity
+        # key -> [legal moves of the side to move, white's attacked squares, black's attacked squares]
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        """Forgets every position; the counters are kept."""
+        self._entries.clear()
+
+    def reset_counters(self):
+        """Sets the hit and miss counters back to zero."""
+        self.hits = 0
+        self.misses = 0
+
+    def _entry(self, position):
+        entry = self._entries.get(position.key)
+        if entry is None:
+            entry = self._entries[position.key] = [None, None, None]
+            if len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+        else:
+            self._entries.move_to_end(position.key)
+        return entry
+
+    def legal_moves(self, position):
+        """Returns the legal moves of the side to move as a tuple of encoded moves."""
+        entry = self._entry(position)
+        if entry[0] is None:
+            self.misses += 1
+            entry[0] = tuple(position.generate_moves())
+        else:
+            self.hits += 1
+        return entry[0]
+
+    def attacked_squares(self, position, color):
+        """Returns the bitboard of the squares a color attacks."""
+        entry = self._entry(position)
+        if entry[1 + color] is None:
+            self.misses += 1
+            entry[1 + color] = position.attacked_squares(color)
+        else:
+            self.hits += 1
+        return entry[1 + color]
+
+    def stats(self):
+        """Returns the counters as a line of text."""
+        lookups = self.hits + self.misses
+        return "Legality cache: %d of %d positions, %d hits, %d misses, %.1f%% hit rate" \
+               % (len(self._entries), self.capacity, self.hits, self.misses,
+                  100.0 * self.hits / lookups if lookups else 0)
+
+class BoardRenderer(object):
+    """
+    Draws the board of a Game.
+
+    The text of every cell is composed once per (piece code, square color)
+    and cached, so a board is a join of cached strings. The modes are:
+
+    * color: the board with ANSI colors and piece symbols (the default).
+    * plain: no escape codes; white pieces as upper case, black pieces as
+      lower case letters, for logs, pipes and terminals without colors.
+    * diff: like color, but the board stays at the top of the terminal and
+      later draws rewrite only the squares that changed, moving the cursor
+      there with escape codes; the text below scrolls on its own.
+    * off: nothing is drawn, for headless runs.
+
+    draw() skips the board if it has not changed since it was last drawn,
+    unless forced.
+    """
+    MODES = ("color", "plain", "diff", "off")
+    HEADER = "     A  B  C  D  E  F  G  H "
+    TOP = "   ┌────────────────────────┐"
+    BOTTOM = "   └────────────────────────┘"
+    # screen line of rank 1 and column of file a in diff mode (1-based)
+    FIRST_LINE, FIRST_COLUMN = 3, 5
+
+    def __init__(self, game, mode=None, write=None):
+        """
+        Initializes a BoardRenderer.
+
+        Args:
+            game (Game): The game whose board is drawn.
+            mode (str): One of MODES, by default color, or plain if colors are disabled.
+            write (callable): Writes raw text in diff mode, by default to standard output.
+        """
+        self.game = game
+        self.mode = mode or ("color" if Color.ENABLED else "plain")
+        self.write = write or self._write_stdout
+        self.draws = 0
+        self.bytes_written = 0
+        self._cells = None
+        self._shown = None
+        self._scroll_region = False
+
+    @staticmethod
+    def _write_stdout(text):
+        sys.stdout.write(text)
+        sys.stdout.flush()
+
+    def set_mode(self, mode):
+        """
+        Switches the mode; the next draw shows the whole board.
+
+        Raises:
+            ValueError: If the mode is not one of MODES.
+        """
+        if mode not in self.MODES:
+            raise ValueError("Error: Unknown render mode (expected one of: %s)" % ", ".join(self.MODES))
+        self.close()
+        self.mode = mode
+        self.invalidate()
+
+    def invalidate(self):
+        """Drops the cached cells and the board last shown, e.g. after the players changed."""
+        self._cells = None
+        self._shown = None
+
+    def _build_cells(self):
+        """Composes the text of every piece code on a light and on a dark square."""
+        cells = []
+        for code in range(16):
+            piece = self.game.get_piece(code)
+            if self.mode == "plain":
+                text = " %s " % (piece.letter.lower() if code >> 3 else piece.letter) if piece else " . "
+                cells.append((text, text))
+            else:
+                text = " %s " % piece if piece else "   "
+                cells.append((text, Color.colorize(text, Color.BG_WHITE)))
+        return cells
+
+    def _cell(self, square, code):
+        # a1 is dark; the dark squares are those where row + col is even
+        return self._cells[code][((square >> 3) + square) & 1 ^ 1]
+
+    def render(self):
+        """Returns the whole board as text."""
+        if self._cells is None:
+            self._cells = self._build_cells()
+        board = self.game.position.board
+        rows = [self.HEADER, self.TOP]
+        for row in range(8):
+            rows.append(" %d │%s│" % (row + 1, "".join(self._cell(square, board[square])
+                                                        for square in range(row * 8, row * 8 + 8))))
+        rows.append(self.BOTTOM)
+        return "\n".join(rows) + "\n"
+
+    def draw(self, force=False):
+        """
+        Draws the board if it changed since it was last drawn.
+
+        Args:
+            force (bool): Draw the whole board even if it did not change.
+        """
+        if self.mode == "off":
+            return
+        board = bytes(self.game.position.board)
+        if board == self._shown and not force:
+            return
+        self.draws += 1
+        if self.mode != "diff":
+            text = self.render()
+            self.bytes_written += len(text)
+            self.game.output(text)
+        elif self._shown is None or force or not self._scroll_region:
+            self._draw_screen()
+        else:
+            self._draw_changes(board)
+        self._shown = board
+
+    def _draw_screen(self):
+        """Clears the terminal, draws the board at the top and lets the lines below it scroll."""
+        lines = shutil.get_terminal_size().lines
+        board_lines = self.FIRST_LINE + 9
+        text = "\x1b[2J\x1b[H" + self.render()
+        if lines > board_lines + 2:
+            text += "\x1b[%d;%dr\x1b[%d;1H" % (board_lines, lines, lines)
+            self._scroll_region = True
+        self.bytes_written += len(text)
+        self.write(text)
+
+    def _draw_changes(self, board):
+        """Rewrites the squares whose piece changed, leaving the cursor where it was."""
+        if self._cells is None:
+            self._cells = self._build_cells()
+        parts = ["\x1b7"]
+        for square, (old, new) in enumerate(zip(self._shown, board)):
+            if old != new:
+                parts.append("\x1b[%d;%dH%s" % (self.FIRST_LINE + (square >> 3), self.FIRST_COLUMN + 3 * (square & 7),
+                                                 self._cell(square, new)))
+        parts.append("\x1b8")
+        text = "".join(parts)
+        self.bytes_written += len(text)
+        self.write(text)
+
+    def close(self):
+        """Gives the terminal its whole height back after diff mode."""
+        if self._scroll_region:
+            self.write("\x1b[r\x1b[%d;1H" % shutil.get_terminal_size().lines)
+            self._scroll_region = False
+
 class Player(object):
     def __init__(self, name, color, direction):
         self._name = name
         self._color = color
         self.direction = direction
+        self.side = WHITE if direction > 0 else BLACK
 
     def set_name(self, name):
         self._name = name
@@ -471,157 +1888,482 @@ class Player(object):
     def get_color(self):
         return self._color
 
+class EnginePlayer(Player):
+    """A player whose moves are chosen by the search engine."""
+    DEFAULT_TIME = 3.0
+
+    def __init__(self, name, color, direction, max_time=DEFAULT_TIME):
+        """
+        Initializes an EnginePlayer.
+
+        Args:
+            max_time (float): The time the engine may think about a move, in seconds.
+        """
+        super().__init__(name, color, direction)
+        self.max_time = max_time
+
 class Game(object):
-    def __init__(self):
+    def __init__(self, fen=None):
+        """
+        Initializes a Game.
+
+        Args:
+            fen (str): The position to start from in FEN, by default the standard start position.
+        """
+        self.position = Position() if fen is None else Position.from_fen(fen)
+        self.start_fen = START_FEN if fen is None else self.position.to_fen()
         self.board = []
         self._init_board()
-        self._currentPlayer = 0
         self.players = [Player("Player 1", Color.RED, 1), Player("Player 2", Color.BLUE, -1)]
+        self.renderer = BoardRenderer(self)
+        self._init_pieces()
         self._run = False
         self._factory = CommandFactory(self)
-        self._en_passant_target_tile = None
-        self._halfmove_clock = 0
         self._position_history = {}
-        StartPositionBuilder(self).set_default_position()
+        self._engine = None
+        self.workers = 1
+        self.book = None
+        self.tablebases = None
+        self.profiler = None
+        self.legality_cache = LegalityCache()
+        if fen is None:
+            StartPositionBuilder(self).set_default_position()
+        self._record_position()
+
+    def output(self, text):
+        """Writes a message to the player; replaced to capture the output, e.g. by the game server."""
+        print(text)
+
+    @classmethod
+    def from_fen(cls, fen):
+        """
+        Creates a game starting from a position given in Forsyth-Edwards Notation.
+
+        Raises:
+            ValueError: If the FEN is malformed.
+        """
+        return cls(fen)
+
+    def to_fen(self):
+        """Returns the current position in Forsyth-Edwards Notation."""
+        return self.position.to_fen()
+
+    def set_fen(self, fen):
+        """
+        Replaces the current position by one given in Forsyth-Edwards Notation.
+
+        The moves played so far can no longer be taken back.
+
+        Raises:
+            ValueError: If the FEN is malformed.
+        """
+        self.position = Position.from_fen(fen)
+        self.start_fen = self.position.to_fen()
+        self.legality_cache.clear()
+        self._rebuild_position_history()
+
+    def get_moves(self):
+        """Returns the encoded moves played since start_fen."""
+        return [undo & 0xffff for undo in self.position.undo_stack]
 
     def _init_board(self):
         self.board.extend(([Tile(((row + col) % 2 == 0), self.board, col, row, self) for col in range(8)] for row in range(8)))
+
+    def _init_pieces(self):
+        self._pieces = [None] * 16
+        for player in self.players:
+            for cls in PIECE_CLASSES[1:]:
+                piece = cls(player)
+                self._pieces[piece.code] = piece
+        self.renderer.invalidate()
+
+    def get_piece(self, code):
+        """Returns the shared Piece instance viewing a piece code, or None for an empty square."""
+        return self._pieces[code]
+
+    def get_tile(self, square):
+        return self.board[square >> 3][square & 7]
+
+    def get_move(self, code):
+        """Returns the Move viewing an encoded move."""
+        return Move(code, self.get_tile(code & 63), self.get_tile(code >> 6 & 63))
+
+    def set_player(self, index, player):
+        """Replaces one of the players, e.g. by an EnginePlayer."""
+        self.players[index] = player
+        self._init_pieces()
+
+    @property
+    def _currentPlayer(self):
+        return self.position.side
+
+    @property
+    def _en_passant_target_tile(self):
+        return None if self.position.ep is None else self.get_tile(self.position.ep)
+
+    @property
+    def _halfmove_clock(self):
+        return self.position.halfmove
     
-    def print_board(self):
-        rows = []
-        
-        rows.append("     A  B  C  D  E  F  G  H ")
-        rows.append("   ┌────────────────────────┐")
-        for i, row in enumerate(self.board, start=1):
-            rows.append(" " + str(i) + " │" + "".join(map(str, row)) + "│")
-        rows.append("   └────────────────────────┘")
-        
-        
-        print("\n".join(rows) + "\n")
-        
+    def print_board(self, changed_only=False):
+        """
+        Shows the board through the game's renderer.
+
+        Args:
+            changed_only (bool): Skip the board if it has not changed since it was last shown.
+        """
+        self.renderer.draw(force=not changed_only)
+
     def _get_position_hash(self):
-        board_tuple = tuple(
-            (tile.piece.name, tile.piece.player) if tile.piece else None
-            for row in self.board for tile in row
-        )
-        en_passant_pos = (self._en_passant_target_tile.row, self._en_passant_target_tile.col) if self._en_passant_target_tile else None
-        return (board_tuple, self._currentPlayer, en_passant_pos)
+        return self.position.key
+
+    def _record_position(self):
+        """
+        Counts the current position for threefold repetition.
+
+        No position before the last pawn move or capture can come back, so
+        the history only covers the positions since then.
+        """
+        if self._halfmove_clock == 0:
+            self._position_history.clear()
+        key = self._get_position_hash()
+        self._position_history[key] = self._position_history.get(key, 0) + 1
+
+    def _rebuild_position_history(self):
+        """Recounts the positions since the last pawn move or capture from the position's key stack."""
+        self._position_history = {}
+        keys = self.position.key_stack
+        for key in keys[max(0, len(keys) - self._halfmove_clock):] + [self._get_position_hash()]:
+            self._position_history[key] = self._position_history.get(key, 0) + 1
+
+    def make_move(self, move):
+        """
+        Plays a legal move and counts the resulting position.
+
+        Args:
+            move (Move): A move from generate_legal_moves.
+        """
+        self.position.make_move(move.code)
+        self._record_position()
+
+    def unmake_move(self):
+        """Takes back the last move."""
+        self.position.unmake_move()
+        self._rebuild_position_history()
 
     def _has_sufficient_material(self):
-        pieces = [tile.piece for row in self.board for tile in row if tile.piece]
-        for p in pieces:
-            if isinstance(p, (Pawn, Rook, Queen)):
-                return True
-        knights = [p for p in pieces if isinstance(p, Knight)]
-        bishops = [p for p in pieces if isinstance(p, Bishop)]
-        if len(knights) + len(bishops) > 1:
-            return True
-        return False
+        return self.position.has_mating_material()
+
+    def get_result(self):
+        """
+        Checks whether the game is over.
+
+        Returns:
+            str: The announcement of the result, or None while the game goes on.
+        """
+        if self._position_history.get(self._get_position_hash(), 0) >= 3:
+            return "Draw by threefold repetition."
+        if self._halfmove_clock >= 100:
+            return "Draw by 50-move rule."
+        if not self._has_sufficient_material():
+            return "Draw by insufficient mating material."
+        if self.tablebases is not None and self.tablebases.adjudicate(self.position) == "1/2-1/2":
+            return "Draw by tablebase adjudication."
+        if not self.has_legal_moves(self.current_player()):
+            if self.is_king_in_check(self.current_player()):
+                return "Checkmate! %s wins." % self.get_opponent(self.current_player())
+            return "Stalemate! The game is a draw."
+        return None
+
+    def execute(self, line, commands=None):
+        """
+        Executes one command line, e.g. 'mv e2 e4'.
+
+        Args:
+            line (str): The command and its parameters.
+            commands (tuple): The Command classes allowed, by default all.
+
+        Returns:
+            bool: False if the command was not recognized or raised an exception.
+        """
+        splitText = line.split()
+        if len(splitText) > 0:
+            cmd = self._factory.get_command(splitText[0])
+            if cmd and (commands is None or type(cmd) in commands):
+                try:
+                    cmd.execute(splitText[1:])
+                except Exception as err:
+                    self.output(str(err))
+                    return False
+            else:
+                self.output("Error: Command not recognized.")
+                return False
+        return True
 
     def run(self):
         self._run = True
         while self._run:
-            self.print_board()
-            current_hash = self._get_position_hash()
-            self._position_history[current_hash] = self._position_history.get(current_hash, 0) + 1
-            if self._position_history[current_hash] >= 3:
-                print("Draw by threefold repetition.")
-                self.stop()
-                continue
-            if self._halfmove_clock >= 100:
-                print("Draw by 50-move rule.")
-                self.stop()
-                continue
-            if not self._has_sufficient_material():
-                print("Draw by insufficient mating material.")
-                self.stop()
-                continue
-            if not self.has_legal_moves(self.current_player()):
-                if self.is_king_in_check(self.current_player()):
-                    print("Checkmate! %s wins." % self.get_opponent(self.current_player()))
-                else:
-                    print("Stalemate! The game is a draw.")
+            self.print_board(changed_only=True)
+            result = self.get_result()
+            if result:
+                self.output(result)
                 self.stop()
                 continue
-            splitText = input("chess (%s)> " % self.current_player()).split()
-            if len(splitText) > 0:
-                cmd = self._factory.get_command(splitText[0])
-                if (cmd):
-                    try:
-                        cmd.execute(splitText[1:])
-                    except Exception as err:
-                        print(str(err))
-                else:
-                    print("Error: Command not recognized.")
+            if isinstance(self.current_player(), EnginePlayer):
+                self.play_engine_move(self.current_player(), self.current_player().max_time)
+            else:
+                self.execute(input("chess (%s)> " % self.current_player()))
+            if self.profiler is not None and self.profiler.installed:
+                self.output(self.profiler.end_turn())
+        self.renderer.close()
             
-    def switch_player(self):
-        self._currentPlayer = (self._currentPlayer + 1) % 2
+    def run_script(self, lines):
+        """
+        Executes commands without prompting, e.g. from a file or a pipe.
+
+        Every command is followed by a line with the time it took. Lines that
+        are empty or start with '#' are skipped. A pawn reaching the last rank
+        without a promotion piece ('mv e7 e8 q') becomes a queen. The result
+        is announced when the game ends; 'quit' stops the script.
+
+        Args:
+            lines: An iterable of command lines.
+
+        Returns:
+            int: The number of commands that failed.
+        """
+        output = self.output
+        replaced = {name: self.__dict__[name] for name in ("output", "choose_promotion") if name in self.__dict__}
+        failed = [False]
+
+        def output_counting_errors(text):
+            if str(text).startswith("Error"):
+                failed[0] = True
+            output(text)
+
+        self.output = output_counting_errors
+        self.choose_promotion = lambda player: Queen
+        self._run = True
+        commands, failures, total, announced = 0, 0, 0.0, False
+        try:
+            for line in lines:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                failed[0] = False
+                start = time.perf_counter()
+                if not self.execute(line):
+                    failed[0] = True
+                elapsed = time.perf_counter() - start
+                commands += 1
+                failures += failed[0]
+                total += elapsed
+                output("%.3f ms  %s" % (elapsed * 1e3, line))
+                if self.profiler is not None and self.profiler.installed:
+                    output(self.profiler.end_turn())
+                result = self.get_result()
+                if result and not announced:
+                    output(result)
+                announced = bool(result)
+                if not self._run:
+                    break
+        finally:
+            for name in ("output", "choose_promotion"):
+                if name in replaced:
+                    setattr(self, name, replaced[name])
+                else:
+                    delattr(self, name)
+        output("%d commands in %.3f ms, %d failed" % (commands, total * 1e3, failures))
+        return failures
 
     def current_player(self):
         return self.players[self._currentPlayer]
 
-    def promote_pawn(self, tile):
-        player = tile.piece.player
+    def choose_promotion(self, player):
+        """Asks a player which piece a pawn promotes to and returns its Piece class."""
         self.print_board()
-        print("Player %s can promote a pawn!" % player)
+        self.output("Player %s can promote a pawn!" % player)
         choice = ""
-        while choice.upper() not in ['Q', 'R', 'B', 'N']:
+        while choice.upper() not in PROMOTION_CHOICES:
             choice = input("Choose piece for promotion (Q=Queen, R=Rook, B=Bishop, N=Knight): ")
-        use_symbols = True
-        if choice.upper() == 'Q':
-            new_piece = Queen(player, use_symbols)
-        elif choice.upper() == 'R':
-            new_piece = Rook(player, use_symbols)
-        elif choice.upper() == 'B':
-            new_piece = Bishop(player, use_symbols)
+        return PROMOTION_CHOICES[choice.upper()]
+
+    def get_engine(self):
+        """Returns the game's search engine, which is created on first use."""
+        if self._engine is None:
+            from engine import Engine
+            self._engine = Engine()
+        return self._engine
+
+    def play_engine_move(self, player, max_time=None, max_nodes=None):
+        """
+        Lets the engine search a move for a player and plays it.
+
+        In a position covered by the game's tablebases the move keeping the
+        best result is played, and in a position of its opening book a book
+        move, both without searching. Every completed iteration of the search is reported with its depth,
+        score, node count, nodes per second and principal variation. With
+        more than one worker the root moves are searched in parallel.
+
+        Args:
+            player (Player): The player to move.
+            max_time (float): The time budget in seconds, or None.
+            max_nodes (int): The node budget, or None.
+
+        Returns:
+            Move: The move played, or None if the player has no legal moves.
+        """
+        from engine import format_score, parallel_search
+
+        if self.tablebases is not None:
+            found = self.tablebases.best_move(self.position)
+            if found is not None:
+                move = self.get_move(found[0])
+                self.output("%s plays %s (tablebase: %s)" % (player, move, self.describe_tablebase_result(*found[1:])))
+                self.make_move(move)
+                return move
+        if self.book is not None:
+            code = self.book.choose(self.position)
+            if code:
+                move = self.get_move(code)
+                self.output("%s plays %s (book, probe %.1f us)" % (player, move, self.book.last_probe_time * 1e6))
+                self.make_move(move)
+                return move
+
+        def info(result):
+            self.output("depth %2d  score %s  nodes %d  nps %d  pv %s"
+                  % (result.depth, format_score(result), result.nodes, result.nps,
+                     " ".join(str(self.get_move(code)) for code in result.pv)))
+
+        self.get_engine().tablebases = self.tablebases
+        if self.workers > 1:
+            result = parallel_search(self.position, self.workers, max_time, max_nodes, info=info)
         else:
-            new_piece = Knight(player, use_symbols)
-        tile.piece = new_piece
+            result = self.get_engine().search(self.position, max_time, max_nodes, info=info)
+        if not result.move:
+            return None
+        move = self.get_move(result.move)
+        self.output("%s plays %s (%d nodes in %.2fs, %d nps)" % (player, move, result.nodes, result.time, result.nps))
+        self.make_move(move)
+        return move
+
+    def describe_tablebase_result(self, wdl, plies):
+        """Returns a tablebase result for the player to move as text, e.g. 'mate in 7'."""
+        if wdl > 0:
+            return "mate in %d" % ((plies + 1) // 2)
+        if wdl < 0:
+            return "mated in %d" % (plies // 2)
+        return "draw"
 
     def has_legal_moves(self, player):
-        for row in self.board:
-            for fromTile in row:
-                if fromTile.piece and fromTile.piece.player == player:
-                    for r in self.board:
-                        for toTile in r:
-                            if fromTile.piece.is_move_allowed(fromTile, toTile, simulate=True):
-                                original_piece = toTile.piece
-                                toTile.piece = fromTile.piece
-                                fromTile.piece = None
-                                is_legal = not self.is_king_in_check(player)
-                                fromTile.piece = toTile.piece
-                                toTile.piece = original_piece
-                                if is_legal:
-                                    return True
-        return False
+        if player.side == self.position.side:
+            return bool(self.legality_cache.legal_moves(self.position))
+        return next(self.position.generate_moves(player.side), None) is not None
+
+    def generate_legal_moves(self, player):
+        """
+        Generates the legal moves of a player.
+
+        Args:
+            player (Player): The player whose moves are generated.
+
+        Yields:
+            Move: Every legal move of the player, lazily.
+        """
+        if player.side == self.position.side:
+            codes = self.legality_cache.legal_moves(self.position)
+        else:
+            codes = self.position.generate_moves(player.side)
+        for code in codes:
+            yield self.get_move(code)
 
     def stop(self):
         self._run = False
 
+    def get_pieces(self, player):
+        """
+        Returns the pieces of a player, from the king down to the pawns.
+
+        Returns:
+            list: (Tile, Piece) pairs; only the player's pieces are visited, not the board.
+        """
+        return [(self.get_tile(square), self._pieces[code]) for square, code in self.position.pieces(player.side)]
+
     def get_king_tile(self, player):
-        for row in self.board:
-            for tile in row:
-                if isinstance(tile.piece, King) and tile.piece.player == player:
-                    return tile
-        return None
+        square = self.position.king_square(player.side)
+        return None if square is None else self.get_tile(square)
 
     def get_opponent(self, player):
         return self.players[(self.players.index(player) + 1) % 2]
 
     def is_king_in_check(self, player):
-        king_tile = self.get_king_tile(player)
-        if not king_tile:
-            return False
-        return self.is_square_attacked(king_tile, self.get_opponent(player))
+        return self.position.is_in_check(player.side)
 
     def is_square_attacked(self, square, by_player):
-        for row in self.board:
-            for tile in row:
-                if tile.piece and tile.piece.player == by_player:
-                    if tile.piece.is_move_allowed(tile, square, simulate=True):
-                        return True
-        return False
+        return self.legality_cache.attacked_squares(self.position, by_player.side) >> square.square & 1 == 1
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Plays chess on the terminal.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes for the engine, perft and --batch (default: 1)")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="analyze the positions in FILE (one FEN per line, '-' for standard input) and exit")
+    parser.add_argument("--format", choices=("json", "csv"), default="json",
+                        help="output format of --batch (default: json lines)")
+    parser.add_argument("--depth", type=int, default=0,
+                        help="search depth for the best move of every --batch position (default: 0, no search)")
+    parser.add_argument("--output", metavar="FILE", default="-",
+                        help="file to write the --batch results to (default: standard output)")
+    parser.add_argument("--book", metavar="FILE", help="opening book (Polyglot .bin) for the engine")
+    parser.add_argument("--tablebases", metavar="DIR", help="directory of endgame tablebases for the engine")
+    parser.add_argument("--render", choices=BoardRenderer.MODES,
+                        help="how the board is drawn: color, plain (no escape codes), diff (only changed squares "
+                             "are redrawn) or off (default: color)")
+    parser.add_argument("--script", metavar="FILE",
+                        help="execute the commands in FILE ('-' for standard input) without prompting, timing "
+                             "each one, and exit; the board is not drawn unless --render is given")
+    parser.add_argument("--profile", nargs="?", const="", metavar="FILE", default=os.environ.get("PYCHESS_PROFILE"),
+                        help="count and time the rules core, reporting every turn; with FILE also write cProfile "
+                             "data there (default: the PYCHESS_PROFILE environment variable)")
+    parser.add_argument("--uci", action="store_true",
+                        help="speak the Universal Chess Interface on standard input/output instead of playing")
+    args = parser.parse_args(argv)
+    if args.uci:
+        import uci
+        uci.main(args.book, args.tablebases)
+        return 0
+    if args.batch:
+        import batch
+        return batch.run(args.batch, args.output, args.format, args.depth, max(1, args.workers))
+    game = Game()
+    game.workers = max(1, args.workers)
+    if args.render or args.script:
+        game.renderer.set_mode(args.render or "off")
+    if args.book:
+        import book
+        game.book = book.Book(args.book)
+    if args.tablebases:
+        import tablebase
+        game.tablebases = tablebase.Tablebases(args.tablebases)
+    if args.profile is not None:
+        import profiling
+        game.profiler = profiling.Profiler(args.profile if args.profile not in ("", "1") else None)
+        game.profiler.install()
+    try:
+        if args.script:
+            if args.script == "-":
+                return 1 if game.run_script(sys.stdin) else 0
+            with open(args.script) as script:
+                return 1 if game.run_script(script) else 0
+        game.run()
+    finally:
+        if game.profiler is not None:
+            game.output(game.profiler.report())
+            written = game.profiler.close()
+            if written:
+                game.output(written)
 
 if __name__ == '__main__':
-    game = Game()
-    game.run()
+    # The engine and other modules import pyChess; let them share this module.
+    sys.modules['pyChess'] = sys.modules[__name__]
+    sys.exit(main())
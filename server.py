@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+An asyncio server hosting many games in one process.
+
+Clients connect over TCP or a Unix socket and send one command per line:
+
+    new                  creates a game and answers '<id> created'
+    <id> <command ...>   runs a game command, e.g. '7 mv e2 e4'
+    close <id>           ends a game
+    stats                reports the number of games and their memory
+
+The game commands are the Command subclasses of the interactive game
+(see GAME_COMMANDS). Their output is collected instead of printed and
+answered as lines prefixed with the game id, closed by '<id> ok'. Any
+connection may address any game, so two players can share one.
+
+A game that is not executing a command is only a Session: the start
+position (if not the standard one) and the moves as an array of 16-bit
+ints, a few hundred bytes. For a command, the session is replayed onto a
+workspace Game, which costs one make_move per move played. Commands run on a pool of worker threads, each with
+its own workspace Game and engine, so a search in one game does not hold
+up the commands of the others while the event loop keeps serving the
+connections. The commands of one game run one at a time.
+"""
+
+import argparse
+import asyncio
+import itertools
+import sys
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+from pyChess import (START_FEN, Color, Game, Player, EnginePlayer, Queen,
+                     CommandMove, CommandUndo, CommandBoard, CommandThink, CommandComputer, CommandSetName,
+                     CommandFen, CommandSetFen, CommandHelp)
+
+__author__ = "Michael Krisper"
+
+GAME_COMMANDS = (CommandMove, CommandUndo, CommandBoard, CommandThink, CommandComputer, CommandSetName,
+                 CommandFen, CommandSetFen, CommandHelp)
+
+DEFAULT_PLAYERS = (("Player 1", None), ("Player 2", None))
+
+# The number of commands, e.g. engine searches, that can run at the same time.
+DEFAULT_WORKERS = 4
+
+# Games are serialized by one of these locks, chosen by game id, so that an
+# idle game does not need a lock of its own.
+LOCK_STRIPES = 64
+
+class Session(object):
+    """The state of an idle game, kept as small as possible."""
+    __slots__ = ("start_fen", "moves", "players")
+
+    def __init__(self):
+        """Initializes a Session for a game from the standard start position."""
+        self.start_fen = None
+        self.moves = array("H")
+        self.players = None
+
+    def restore(self, game):
+        """Replays the session onto a Game."""
+        game.set_fen(self.start_fen or START_FEN)
+        for move in self.moves:
+            game.position.make_move(move)
+        game._rebuild_position_history()
+        players = []
+        for (name, max_time), color, direction in zip(self.players or DEFAULT_PLAYERS,
+                                                      (Color.RED, Color.BLUE), (1, -1)):
+            if max_time is None:
+                players.append(Player(name, color, direction))
+            else:
+                players.append(EnginePlayer(name, color, direction, max_time))
+        game.players = players
+        game._init_pieces()
+
+    def store(self, game):
+        """Takes the state of a Game into the session."""
+        self.start_fen = None if game.start_fen == START_FEN else game.start_fen
+        self.moves = array("H", game.get_moves())
+        players = tuple((player._name, player.max_time if isinstance(player, EnginePlayer) else None)
+                        for player in game.players)
+        self.players = None if players == DEFAULT_PLAYERS else players
+
+    def size(self):
+        """Returns the memory taken by the session in bytes."""
+        size = sys.getsizeof(self) + sys.getsizeof(self.moves)
+        if self.start_fen is not None:
+            size += sys.getsizeof(self.start_fen)
+        if self.players is not None:
+            size += sys.getsizeof(self.players) + sum(sys.getsizeof(player) + sys.getsizeof(player[0])
+                                                      for player in self.players)
+        return size
+
+class GameServer(object):
+    """Holds the sessions and executes their commands."""
+
+    def __init__(self, workers=DEFAULT_WORKERS):
+        """
+        Initializes a GameServer without any games.
+
+        Args:
+            workers (int): The number of commands that can run at the same time.
+        """
+        self.sessions = {}
+        self._ids = itertools.count(1)
+        self._locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        # Every worker thread owns a workspace game, created on its first command.
+        self._workspace = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    def _get_workspace(self):
+        """Returns the workspace Game of the current thread and the list its output goes to."""
+        workspace = self._workspace
+        if not hasattr(workspace, "game"):
+            workspace.output = []
+            workspace.game = Game()
+            workspace.game.output = workspace.output.append
+            workspace.game.choose_promotion = lambda player: Queen
+        return workspace.game, workspace.output
+
+    def process(self, line):
+        """
+        Executes one line of the protocol.
+
+        Returns:
+            list: The response lines.
+        """
+        words = line.split()
+        if not words:
+            return []
+        if words[0] == "new":
+            game_id = next(self._ids)
+            self.sessions[game_id] = Session()
+            return ["%d created" % game_id]
+        if words[0] == "close" and len(words) == 2:
+            game_id = int(words[1]) if words[1].isdigit() else None
+            session = self.sessions.pop(game_id, None)
+            return ["%s %s" % (words[1], "closed" if session else "Error: No such game.")]
+        if words[0] == "stats":
+            total = sum(session.size() for session in self.sessions.values())
+            return ["%d games, %d bytes, %d bytes per game"
+                    % (len(self.sessions), total, total // len(self.sessions) if self.sessions else 0)]
+        game_id = int(words[0]) if words[0].isdigit() else None
+        session = self.sessions.get(game_id)
+        if session is None:
+            return ["%s Error: No such game." % words[0]]
+        with self._locks[game_id % LOCK_STRIPES]:
+            lines = self._execute(session, " ".join(words[1:]))
+        return ["%s %s" % (words[0], text) for text in lines]
+
+    def _execute(self, session, line):
+        """Restores a session, runs one command on it, lets an engine player answer and stores it again."""
+        game, output = self._get_workspace()
+        del output[:]
+        session.restore(game)
+        try:
+            game.execute(line, GAME_COMMANDS)
+            result = game.get_result()
+            while result is None and isinstance(game.current_player(), EnginePlayer):
+                game.play_engine_move(game.current_player(), game.current_player().max_time)
+                result = game.get_result()
+            if result:
+                game.output(result)
+        finally:
+            session.store(game)
+        lines = [text for message in output for text in message.splitlines()]
+        return lines + ["ok"]
+
+    async def serve_connection(self, reader, writer):
+        """Answers the lines of one connection until it closes."""
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = await loop.run_in_executor(self._executor, self.process,
+                                                      line.decode("utf-8", "replace"))
+                if response:
+                    writer.write("".join(text + "\n" for text in response).encode("utf-8"))
+                    await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8765, path=None):
+        """Accepts connections on a TCP port, or on a Unix socket if a path is given, until cancelled."""
+        if path:
+            server = await asyncio.start_unix_server(self.serve_connection, path)
+        else:
+            server = await asyncio.start_server(self.serve_connection, host, port)
+        async with server:
+            await server.serve_forever()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Hosts many chess games over a line protocol.")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8765, help="TCP port to listen on (default: 8765)")
+    parser.add_argument("--unix", metavar="PATH", help="listen on a Unix socket instead of TCP")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="number of commands, e.g. engine searches, run at the same time (default: %d)"
+                             % DEFAULT_WORKERS)
+    args = parser.parse_args(argv)
+    Color.ENABLED = False
+    try:
+        asyncio.run(GameServer(max(1, args.workers)).serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
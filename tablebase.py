@@ -0,0 +1,555 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Endgame tablebases for positions with few pieces.
+
+A tablebase holds the exact result of every position of one material
+balance, e.g. KQK (king and queen against king) or KRKP, together with the
+distance to mate in plies. generate() computes it by retrograde analysis:
+starting from the checkmates it walks the move graph backwards, one ply
+at a time, so every position is resolved at its exact distance. Captures
+and promotions leave the table; their results come from the smaller
+tables, which are generated first.
+
+Positions are indexed by the squares of the pieces in a fixed order (the
+white king, the other white pieces, the black king, the other black
+pieces) and the side to move. Each result is stored in as few bits as the
+longest mate of the table needs, and Tablebases reads the files through
+mmap, so a probe is an index computation and a read of three bytes.
+
+Castling and en passant are not part of a tablebase position: positions
+with castling rights or an en passant square are not probed, and the
+generator does not consider en passant captures. The 50-move rule is not
+taken into account.
+
+Run as a script (python -m tablebase KQK KRK KPK --workers 4) it generates
+the tables of the given endings.
+"""
+
+import argparse
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from pyChess import (WHITE, BLACK, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, PIECE_LETTERS,
+                     KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, bishop_attacks, rook_attacks, queen_attacks)
+
+__author__ = "Michael Krisper"
+
+EXTENSION = ".pytb"
+MAGIC = b"PYTB"
+# magic, version, number of pieces, bits per position, longest mate in plies, table name
+HEADER = struct.Struct("<4sBBBxH8s")
+HEADER_SIZE = 32
+MAX_PIECES = 4
+
+# Stored results: a draw, an impossible position, or 2 + the plies to mate.
+# An odd number of plies is a win for the side to move, an even one a loss.
+DRAW = 0
+INVALID = 1
+NO_LOSS = 0xffff
+
+PIECE_ORDER = "KQRBNP"
+PIECE_VALUES = {"K": 0, "Q": 9, "R": 5, "B": 3, "N": 3, "P": 1}
+
+def _sort_pieces(letters):
+    """Orders piece letters from the king down to the pawns."""
+    return "".join(sorted(letters, key=PIECE_ORDER.index))
+
+def _split_name(name):
+    """Splits a table name such as 'KQKR' into the white and the black pieces."""
+    name = name.upper()
+    second_king = name.find("K", 1)
+    if not name.startswith("K") or second_king < 0 or "K" in name[second_king + 1:] \
+       or any(letter not in PIECE_ORDER for letter in name):
+        raise ValueError("Invalid tablebase name: %s" % name)
+    return name[:second_king], name[second_king:]
+
+def normalize(name):
+    """
+    Returns the name of the table holding an ending.
+
+    The pieces of each side are ordered king, queen, rook, bishop, knight,
+    pawn, and the stronger side is white; the other colour is probed with
+    the board flipped.
+
+    Raises:
+        ValueError: If the name does not describe an ending with two kings.
+    """
+    white, black = (_sort_pieces(side) for side in _split_name(name))
+    if len(white) + len(black) > MAX_PIECES:
+        raise ValueError("Tablebases have at most %d pieces: %s" % (MAX_PIECES, name))
+
+    def strength(side):
+        return sum(PIECE_VALUES[letter] for letter in side), len(side), side
+
+    return white + black if strength(white) >= strength(black) else black + white
+
+def _table_pieces(name):
+    """Returns the (color, kind) of every piece of a table in index order."""
+    white, black = _split_name(name)
+    return [(WHITE, PIECE_LETTERS.index(letter.lower())) for letter in white] \
+         + [(BLACK, PIECE_LETTERS.index(letter.lower())) for letter in black]
+
+def _is_dead(name):
+    """Checks for endings in which no mate is possible at all: KK and a single minor piece."""
+    others = name.replace("K", "")
+    return others in ("", "B", "N")
+
+def subtables(name):
+    """
+    Returns the tables reached by a capture or a promotion from a table.
+
+    Endings without any possible mate are left out.
+    """
+    names = set()
+    for i, letter in enumerate(name):
+        if letter == "K":
+            continue
+        names.add(normalize(name[:i] + name[i + 1:]))
+        if letter == "P":
+            for piece in "QRBN":
+                names.add(normalize(name[:i] + piece + name[i + 1:]))
+    return sorted(other for other in names if not _is_dead(other))
+
+def _attacks(kind, color, square, occupied):
+    """Returns the squares a piece attacks."""
+    if kind == KNIGHT:
+        return KNIGHT_ATTACKS[square]
+    if kind == KING:
+        return KING_ATTACKS[square]
+    if kind == ROOK:
+        return rook_attacks(square, occupied)
+    if kind == BISHOP:
+        return bishop_attacks(square, occupied)
+    if kind == QUEEN:
+        return queen_attacks(square, occupied)
+    return PAWN_ATTACKS[color][square]
+
+def _is_attacked(pieces, squares, target, by_color, occupied, captured=-1):
+    """Checks whether a square is attacked by the pieces of a colour, leaving out a captured one."""
+    for slot, (color, kind) in enumerate(pieces):
+        if color == by_color and slot != captured and _attacks(kind, color, squares[slot], occupied) >> target & 1:
+            return True
+    return False
+
+def _decode(index, count):
+    """Returns the squares of the pieces of a table index."""
+    return [index >> (1 + 6 * slot) & 63 for slot in range(count)]
+
+class Table(object):
+    """One memory-mapped tablebase file."""
+
+    def __init__(self, path):
+        """
+        Opens a tablebase file.
+
+        Raises:
+            OSError: If the file cannot be opened.
+            ValueError: If it is not a tablebase.
+        """
+        self.path = path
+        self._file = open(path, "rb")
+        self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, width, max_plies, name = HEADER.unpack_from(self._buffer)
+        if magic != MAGIC or version != 1:
+            self.close()
+            raise ValueError("Not a tablebase: %s" % path)
+        self.name = name.rstrip(b"\0").decode("ascii")
+        self.pieces = _table_pieces(self.name)
+        self.width = width
+        self.max_plies = max_plies
+        self._mask = (1 << width) - 1
+
+    def code(self, index):
+        """Returns the stored result of a position index."""
+        bit = index * self.width
+        offset = HEADER_SIZE + (bit >> 3)
+        return int.from_bytes(self._buffer[offset:offset + 3], "little") >> (bit & 7) & self._mask
+
+    def close(self):
+        """Unmaps and closes the file."""
+        self._buffer.close()
+        self._file.close()
+
+class Tablebases(object):
+    """The tablebases of a directory, opened on first use."""
+
+    def __init__(self, directory):
+        """
+        Initializes Tablebases.
+
+        Args:
+            directory (str): The directory holding the .pytb files.
+        """
+        self.directory = directory
+        self._tables = {}
+        names = [name[:-len(EXTENSION)] for name in os.listdir(directory) if name.endswith(EXTENSION)] \
+                if os.path.isdir(directory) else []
+        self.max_pieces = max([len(name) for name in names] + [0])
+        self.probes = 0
+        self.hits = 0
+
+    def close(self):
+        """Closes every opened table."""
+        for table in self._tables.values():
+            if table is not None:
+                table.close()
+        self._tables = {}
+
+    def table(self, name):
+        """Returns the opened table of a normalized name, or None if there is no file for it."""
+        if name not in self._tables:
+            path = os.path.join(self.directory, name + EXTENSION)
+            self._tables[name] = Table(path) if os.path.exists(path) else None
+        return self._tables[name]
+
+    def code(self, pieces, side):
+        """
+        Looks up the stored result of a placement of pieces.
+
+        Args:
+            pieces (list): (color, kind, square) for every piece, both kings included.
+            side (int): The side to move.
+
+        Returns:
+            int: DRAW, INVALID or 2 + plies to mate; None if there is no table.
+        """
+        letters = ["", ""]
+        for color, kind, _ in pieces:
+            letters[color] += PIECE_LETTERS[kind].upper()
+        white, black = _sort_pieces(letters[WHITE]), _sort_pieces(letters[BLACK])
+        name = normalize(white + black)
+        if _is_dead(name):
+            return DRAW
+        table = self.table(name)
+        if table is None:
+            return None
+        if name != white + black:
+            pieces = [(color ^ 1, kind, square ^ 56) for color, kind, square in pieces]
+            side ^= 1
+        squares = {}
+        for color, kind, square in pieces:
+            squares.setdefault((color, kind), []).append(square)
+        index = side
+        for slot, piece in enumerate(table.pieces):
+            index |= squares[piece].pop() << (1 + 6 * slot)
+        return table.code(index)
+
+    def probe(self, position):
+        """
+        Looks up the exact result of a position.
+
+        Returns:
+            tuple: (wdl, plies) with wdl 1 if the side to move wins, 0 for a
+                   draw and -1 if it loses, and plies the distance to mate;
+                   None if the position is not covered by the tablebases.
+        """
+        occupied = position.occupied[0] | position.occupied[1]
+        if bin(occupied).count("1") > self.max_pieces or position.castling or position.ep is not None:
+            return None
+        self.probes += 1
+        pieces = []
+        board = position.board
+        while occupied:
+            low = occupied & -occupied
+            square = low.bit_length() - 1
+            pieces.append((board[square] >> 3, board[square] & 7, square))
+            occupied ^= low
+        code = self.code(pieces, position.side)
+        if code is None or code == INVALID:
+            return None
+        self.hits += 1
+        if code == DRAW:
+            return 0, 0
+        plies = code - 2
+        return (1 if plies & 1 else -1), plies
+
+    def best_move(self, position):
+        """
+        Finds a move that keeps the result of a position with the best distance to mate.
+
+        Wins are converted by the shortest mate, losses delayed by the
+        longest defence.
+
+        Returns:
+            tuple: (move, wdl, plies) for the position before the move, or
+                   None if it is not covered by the tablebases or has no moves.
+        """
+        found = self.probe(position)
+        if found is None:
+            return None
+        best = None
+        for move in list(position.generate_moves()):
+            position.make_move(move)
+            child = self.probe(position)
+            position.unmake_move()
+            if child is None:
+                return None
+            wdl, plies = child
+            # the child's result for the opponent, ranked for the side to move
+            rank = (1, -plies) if wdl < 0 else (0, 0) if wdl == 0 else (-1, plies)
+            if best is None or rank > best[0]:
+                best = (rank, move)
+        if best is None:
+            return None
+        return (best[1],) + found
+
+    def adjudicate(self, position):
+        """
+        Returns the result of a position with perfect play as a PGN result ('1-0', '0-1', '1/2-1/2'), or None.
+        """
+        found = self.probe(position)
+        if found is None:
+            return None
+        wdl, _ = found
+        if wdl == 0:
+            return "1/2-1/2"
+        return "1-0" if (wdl > 0) == (position.side == WHITE) else "0-1"
+
+def _init_task(task):
+    """
+    Resolves the positions of an index range that need no other position of the table.
+
+    Returns:
+        tuple: (counts, values, exit_losses, seeds) for the range: the moves
+               staying in the table, the stored results so far (INVALID or
+               0 for unknown), the longest loss by leaving the table (NO_LOSS
+               if a move leaving the table does not lose) and the (plies,
+               index) pairs of positions already resolved at that distance.
+    """
+    name, directory, start, stop = task
+    pieces = _table_pieces(name)
+    count = len(pieces)
+    kings = (0, [color for color, _ in pieces].index(BLACK))
+    tablebases = Tablebases(directory)
+    counts = bytearray(stop - start)
+    values = array("H", bytes(2 * (stop - start)))
+    exit_losses = array("H", bytes(2 * (stop - start)))
+    seeds = []
+    for index in range(start, stop):
+        side = index & 1
+        squares = _decode(index, count)
+        occupied = 0
+        for square in squares:
+            occupied |= 1 << square
+        if bin(occupied).count("1") != count \
+           or any(kind == PAWN and squares[slot] >> 3 in (0, 7) for slot, (_, kind) in enumerate(pieces)) \
+           or _is_attacked(pieces, squares, squares[kings[side ^ 1]], side, occupied):
+            values[index - start] = INVALID
+            continue
+        own = enemy = 0
+        for slot, (color, _) in enumerate(pieces):
+            if color == side:
+                own |= 1 << squares[slot]
+            else:
+                enemy |= 1 << squares[slot]
+        moves = exits = 0
+        best_win = worst_loss = 0
+        for slot, (color, kind) in enumerate(pieces):
+            if color != side:
+                continue
+            from_square = squares[slot]
+            if kind == PAWN:
+                forward = 8 if side == WHITE else -8
+                targets = PAWN_ATTACKS[side][from_square] & enemy
+                if not occupied >> (from_square + forward) & 1:
+                    targets |= 1 << (from_square + forward)
+                    if from_square >> 3 == (1 if side == WHITE else 6) \
+                       and not occupied >> (from_square + 2 * forward) & 1:
+                        targets |= 1 << (from_square + 2 * forward)
+            else:
+                targets = _attacks(kind, color, from_square, occupied) & ~own
+            while targets:
+                low = targets & -targets
+                to_square = low.bit_length() - 1
+                targets ^= low
+                captured = squares.index(to_square) if enemy & low else -1
+                moved = squares[:]
+                moved[slot] = to_square
+                king_square = moved[kings[side]]
+                if _is_attacked(pieces, moved, king_square, side ^ 1, occupied & ~(1 << from_square) | low, captured):
+                    continue
+                if captured < 0 and not (kind == PAWN and to_square >> 3 in (0, 7)):
+                    moves += 1
+                    continue
+                for promotion in ((QUEEN, ROOK, BISHOP, KNIGHT) if kind == PAWN and to_square >> 3 in (0, 7)
+                                  else (kind,)):
+                    exits += 1
+                    code = tablebases.code([(pieces[other][0], promotion if other == slot else pieces[other][1],
+                                             moved[other]) for other in range(count) if other != captured],
+                                           side ^ 1)
+                    if code == DRAW:
+                        worst_loss = NO_LOSS
+                    elif (code - 2) & 1:
+                        if worst_loss != NO_LOSS:
+                            worst_loss = max(worst_loss, code - 1)
+                    elif not best_win or code - 1 < best_win:
+                        best_win = code - 1
+        counts[index - start] = moves
+        if best_win:
+            worst_loss = NO_LOSS
+            seeds.append((best_win, index))
+        exit_losses[index - start] = worst_loss
+        if not moves and not exits:
+            if _is_attacked(pieces, squares, squares[kings[side]], side ^ 1, occupied):
+                seeds.append((0, index))
+        elif not moves and worst_loss != NO_LOSS:
+            seeds.append((worst_loss, index))
+    tablebases.close()
+    return counts, values, exit_losses, seeds
+
+def _predecessors_task(task):
+    """
+    Finds the positions of the table from which a move leads to the given ones.
+
+    Returns:
+        array: The predecessor indices, with repetitions.
+    """
+    name, indices = task
+    pieces = _table_pieces(name)
+    count = len(pieces)
+    found = array("I")
+    for index in array("I", indices):
+        mover = index & 1 ^ 1
+        squares = _decode(index, count)
+        occupied = 0
+        for square in squares:
+            occupied |= 1 << square
+        base = index ^ 1
+        for slot, (color, kind) in enumerate(pieces):
+            if color != mover:
+                continue
+            to_square = squares[slot]
+            shift = 1 + 6 * slot
+            cleared = base & ~(63 << shift)
+            if kind == PAWN:
+                backward = -8 if mover == WHITE else 8
+                from_square = to_square + backward
+                if from_square >> 3 in (0, 7) or occupied >> from_square & 1:
+                    continue
+                found.append(cleared | from_square << shift)
+                if to_square >> 3 == (3 if mover == WHITE else 4) \
+                   and not occupied >> (from_square + backward) & 1:
+                    found.append(cleared | (from_square + backward) << shift)
+                continue
+            sources = _attacks(kind, color, to_square, occupied) & ~occupied
+            while sources:
+                low = sources & -sources
+                found.append(cleared | (low.bit_length() - 1) << shift)
+                sources ^= low
+    return found.tobytes()
+
+def _write(path, name, values, max_plies):
+    """Writes the results bit-packed, with as many bits per position as the largest code needs."""
+    width = max(2, (max_plies + 2).bit_length())
+    data = bytearray(HEADER.pack(MAGIC, 1, len(name), width, max_plies, name.encode("ascii")))
+    data += bytes(HEADER_SIZE - len(data))
+    for start in range(0, len(values), 8):
+        packed = 0
+        for code in reversed(values[start:start + 8]):
+            packed = packed << width | code
+        data += packed.to_bytes(width, "little")
+    data += bytes(3)
+    with open(path + ".tmp", "wb") as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)
+
+def generate(name, directory, workers=1, output=print):
+    """
+    Generates the tablebase of an ending and, first, those of its subtables that are missing.
+
+    The work is split into index ranges (for the initial pass) and into
+    slices of each ply's newly resolved positions (for the backward
+    passes), which are spread over a pool of worker processes.
+
+    Args:
+        name (str): The ending, e.g. 'KQK' or 'KRKP'.
+        directory (str): The directory to write the .pytb files to.
+        workers (int): The number of worker processes; 1 generates in this process.
+        output (callable): Writes a line of progress, by default print.
+
+    Returns:
+        str: The path of the generated file.
+    """
+    name = normalize(name)
+    path = os.path.join(directory, name + EXTENSION)
+    os.makedirs(directory, exist_ok=True)
+    for subtable in subtables(name):
+        if not os.path.exists(os.path.join(directory, subtable + EXTENSION)):
+            generate(subtable, directory, workers, output)
+    start_time = time.perf_counter()
+    size = 2 << 6 * len(name)
+    chunk_size = max(1 << 12, min(1 << 16, size // (8 * workers)))
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    run = executor.map if executor else map
+    try:
+        counts = bytearray()
+        values = array("H")
+        exit_losses = array("H")
+        buckets = {}
+        max_plies = 0
+        tasks = [(name, directory, start, min(start + chunk_size, size)) for start in range(0, size, chunk_size)]
+        for chunk_counts, chunk_values, chunk_exit_losses, seeds in run(_init_task, tasks):
+            counts += chunk_counts
+            values += chunk_values
+            exit_losses += chunk_exit_losses
+            for plies, index in seeds:
+                buckets.setdefault(plies, []).append(index)
+        plies = 0
+        while buckets:
+            frontier = array("I")
+            for index in buckets.pop(plies, ()):
+                if not values[index]:
+                    values[index] = plies + 2
+                    frontier.append(index)
+            slice_size = max(1024, len(frontier) // (4 * workers) + 1)
+            slices = [(name, frontier[start:start + slice_size].tobytes())
+                      for start in range(0, len(frontier), slice_size)]
+            for data in run(_predecessors_task, slices):
+                predecessors = array("I", data)
+                if plies & 1 == 0:
+                    # the predecessors can move into a lost position: they win one ply later
+                    wins = buckets.setdefault(plies + 1, [])
+                    wins.extend(index for index in predecessors if not values[index])
+                    continue
+                # a move into a won position: lost once every move is
+                for index in predecessors:
+                    if not values[index]:
+                        counts[index] -= 1
+                        if not counts[index] and exit_losses[index] != NO_LOSS:
+                            buckets.setdefault(max(plies + 1, exit_losses[index]), []).append(index)
+            if frontier:
+                max_plies = plies
+            plies += 1
+    finally:
+        if executor:
+            executor.shutdown()
+    wins = sum(1 for code in values if code > INVALID and code & 1)
+    losses = sum(1 for code in values if code > INVALID and not code & 1)
+    draws = values.count(DRAW)
+    _write(path, name, values, max_plies)
+    output("%s: %d wins, %d losses, %d draws, longest mate %d plies, %.1fs"
+           % (name, wins, losses, draws, max_plies, time.perf_counter() - start_time))
+    return path
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generates endgame tablebases by retrograde analysis.")
+    parser.add_argument("endings", nargs="+", help="the endings to generate, e.g. KQK KRK KPK KBNK")
+    parser.add_argument("--directory", default="tablebases", help="where to write the files (default: tablebases)")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes (default: 1)")
+    args = parser.parse_args(argv)
+    try:
+        for ending in args.endings:
+            generate(ending, args.directory, max(1, args.workers))
+    except ValueError as e:
+        print("Error: %s" % e)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,92 @@
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import archive
+import pgn
+from pyChess import START_FEN, Position, parse_square
+
+
+def encode(fen, *texts):
+    """Encodes moves given as 'e2e4' from a position."""
+    position = Position.from_fen(fen)
+    moves = []
+    for text in texts:
+        from_square, to_square = parse_square(text[:2]), parse_square(text[2:4])
+        move = next(move for move in position.generate_moves()
+                    if move & 63 == from_square and move >> 6 & 63 == to_square)
+        position.make_move(move)
+        moves.append(move)
+    return moves
+
+
+class ArchiveTest(unittest.TestCase):
+    ENDGAME = "6k1/5ppp/8/8/8/8/5PPP/R5K1 w - - 0 1"
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "games.pca")
+        self.italian = encode(START_FEN, "e2e4", "e7e5", "g1f3", "b8c6", "f1c4")
+        self.mate = encode(self.ENDGAME, "a1a8")
+        with archive.ArchiveWriter(self.path) as writer:
+            self.assertEqual(writer.append(self.italian, {"White": "Anna", "Black": "Ben"}), 0)
+            self.assertEqual(writer.append(self.mate, {"Event": "Endgame"}, self.ENDGAME, "1-0"), 1)
+        archive.build_key_index(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_encode_record_is_two_bytes_per_move(self):
+        record = archive.encode_record(self.italian)
+        self.assertEqual(len(record), archive.RECORD.size + 2 * len(self.italian))
+
+    def test_record_round_trip(self):
+        with archive.Archive(self.path) as games:
+            self.assertEqual(len(games), 2)
+            record = games.record(0)
+            self.assertEqual(list(record.moves), self.italian)
+            self.assertEqual(record.headers, {"White": "Anna", "Black": "Ben"})
+            self.assertEqual((record.fen, record.result), (START_FEN, "*"))
+            record = games.record(1)
+            self.assertEqual(list(record.moves), self.mate)
+            self.assertEqual((record.fen, record.result), (self.ENDGAME, "1-0"))
+            self.assertEqual(record.headers, {"Event": "Endgame"})
+            del record
+            self.assertRaises(IndexError, games.record, 2)
+
+    def test_game_at_ply(self):
+        with archive.Archive(self.path) as games:
+            game = games.game(0, 3)
+            self.assertEqual(game.to_fen(), "rnbqkbnr/pppp1ppp/8/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R b KQkq - 1 2")
+            self.assertEqual(game.players[0]._name, "Anna")
+            game.unmake_move()
+            self.assertEqual(len(game.get_moves()), 2)
+            self.assertEqual(archive.game_result(games.game(1)), "1-0")
+
+    def test_find(self):
+        position = Position.from_fen(START_FEN)
+        for move in self.italian[:2]:
+            position.make_move(move)
+        with archive.Archive(self.path) as games:
+            self.assertEqual(games.find(position.key), [(0, 2)])
+            self.assertEqual(games.find(Position.from_fen(self.ENDGAME).key), [(1, 0)])
+            self.assertEqual(games.find(0), [])
+
+    def test_pgn_export(self):
+        out = io.StringIO()
+        with archive.Archive(self.path) as games:
+            self.assertEqual(games.write_pgn(out), 2)
+        exported = list(pgn.read_games(io.StringIO(out.getvalue())))
+        self.assertEqual([game.moves for game in exported], [self.italian, self.mate])
+        self.assertEqual([game.result for game in exported], ["*", "1-0"])
+        self.assertEqual(exported[0].headers["White"], "Anna")
+        self.assertEqual(exported[1].fen, self.ENDGAME)
+
+
+if __name__ == "__main__":
+    unittest.main()
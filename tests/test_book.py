@@ -0,0 +1,43 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from book import polyglot_key
+from pyChess import START_FEN, Position, parse_square
+
+
+def play(position, *moves):
+    """Plays moves given as 'e2e4' on a position."""
+    for text in moves:
+        from_square, to_square = parse_square(text[:2]), parse_square(text[2:4])
+        position.make_move(next(move for move in position.generate_moves()
+                                if move & 63 == from_square and move >> 6 & 63 == to_square))
+    return position
+
+
+class PolyglotKeyTest(unittest.TestCase):
+    # The keys published with the Polyglot book format.
+
+    def test_start_position(self):
+        self.assertEqual(polyglot_key(Position.from_fen(START_FEN)), 0x463b96181691fc9c)
+
+    def test_moves(self):
+        position = Position.from_fen(START_FEN)
+        self.assertEqual(polyglot_key(play(position, "e2e4")), 0x823c9b50fd114196)
+        self.assertEqual(polyglot_key(play(position, "d7d5")), 0x0756b94461c50fb0)
+        self.assertEqual(polyglot_key(play(position, "e4e5")), 0x662fafb965db29d4)
+        self.assertEqual(polyglot_key(play(position, "f7f5")), 0x22a48b5a8e47ff78)
+        self.assertEqual(polyglot_key(play(position, "e1e2")), 0x652a607ca3f242c1)
+        self.assertEqual(polyglot_key(play(position, "e8f7")), 0x00fdd303c946bdd9)
+
+    def test_en_passant_file_and_castling(self):
+        position = Position.from_fen(START_FEN)
+        play(position, "a2a4", "b7b5", "h2h4", "b5b4", "c2c4")
+        self.assertEqual(polyglot_key(position), 0x3c8123ea7b067637)
+        self.assertEqual(polyglot_key(play(position, "b4c3", "a1a3")), 0x5c3f9b829b279560)
+
+
+if __name__ == "__main__":
+    unittest.main()
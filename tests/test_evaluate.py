@@ -0,0 +1,52 @@
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from evaluate import Evaluator, evaluate, evaluate_planes, to_planes
+from pyChess import START_FEN, Position
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+FENS = [
+    START_FEN,
+    "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+    "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+    "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+    "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+    "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+    "6k1/5ppp/8/8/8/8/5PPP/R5K1 b - - 0 1",
+]
+
+
+class EvaluateTest(unittest.TestCase):
+
+    def test_incremental_matches_full(self):
+        rng = random.Random(7)
+        for fen in FENS:
+            evaluator = Evaluator(Position.from_fen(fen))
+            for _ in range(40):
+                moves = list(evaluator.position.generate_moves())
+                if not moves:
+                    break
+                evaluator.make_move(rng.choice(moves))
+                self.assertEqual(evaluator.evaluate(), evaluate(evaluator.position), evaluator.position.to_fen())
+            while evaluator._stack:
+                evaluator.unmake_move()
+            self.assertEqual(evaluator.evaluate(), evaluate(Position.from_fen(fen)))
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_batch_matches_scalar(self):
+        positions = [Position.from_fen(fen) for fen in FENS]
+        planes, sides = to_planes(positions)
+        self.assertEqual(planes.shape, (len(FENS), 12, 64))
+        self.assertEqual(list(evaluate_planes(planes, sides)), [evaluate(position) for position in positions])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pyChess
+from pyChess import BLACK, WHITE, LegalityCache, Position
+
+
+class RepetitionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.game = pyChess.Game()
+        self.game.renderer.set_mode("off")
+        self.game.output = lambda text: None
+
+    def play(self, *moves):
+        for move in moves:
+            self.assertTrue(self.game.execute("mv %s %s" % (move[:2], move[2:])), move)
+
+    def test_undo_keeps_repetitions_after_fen_with_halfmove_clock(self):
+        self.game.execute("setfen rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 1 1")
+        self.play("g1f3", "g8f6", "f3g1", "f6g8", "g1f3")
+        self.game.execute("undo")
+        self.assertEqual(self.game._position_history[self.game.position.key], 2)
+        self.assertEqual(sorted(self.game._position_history.values()), [1, 1, 1, 2])
+
+
+class LegalityCacheTest(unittest.TestCase):
+
+    def test_answers_match_the_position(self):
+        cache = LegalityCache()
+        position = Position.from_fen("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1")
+        for move in list(position.generate_moves())[:10]:
+            position.make_move(move)
+            for _ in range(2):
+                self.assertEqual(cache.legal_moves(position), tuple(position.generate_moves()))
+                for color in (WHITE, BLACK):
+                    self.assertEqual(cache.attacked_squares(position, color), position.attacked_squares(color))
+            position.unmake_move()
+        self.assertEqual((cache.misses, cache.hits), (30, 30))
+
+    def test_least_recently_used_positions_are_dropped(self):
+        cache = LegalityCache(capacity=2)
+        position = Position.from_fen(pyChess.START_FEN)
+        first = position.copy()
+        cache.legal_moves(first)
+        for move in list(position.generate_moves())[:2]:
+            position.make_move(move)
+            cache.legal_moves(position)
+            position.unmake_move()
+        cache.legal_moves(first)
+        self.assertEqual((cache.misses, cache.hits), (4, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_script(text):
+    """Runs pyChess.py --script on text and returns the completed process."""
+    return subprocess.run([sys.executable, os.path.join(ROOT, "pyChess.py"), "--script", "-"],
+                          input=text, capture_output=True, text=True, cwd=ROOT)
+
+
+class ScriptTest(unittest.TestCase):
+
+    def test_legal_moves_exit_zero(self):
+        process = run_script("mv e2 e4\nmv e7 e5\n")
+        self.assertEqual(process.returncode, 0, process.stdout)
+        self.assertIn("2 commands", process.stdout)
+        self.assertIn("0 failed", process.stdout)
+
+    def test_failing_move_exits_non_zero(self):
+        process = run_script("mv z9 e4\nmv e2 e4\n")
+        self.assertEqual(process.returncode, 1, process.stdout)
+        self.assertIn("1 failed", process.stdout)
+
+    def test_refused_move_exits_non_zero(self):
+        process = run_script("mv e2 e5\n")
+        self.assertEqual(process.returncode, 1, process.stdout)
+
+    def test_bad_search_times_are_usage_errors(self):
+        process = run_script("think abc\ncomputer -1\n")
+        self.assertIn("Error: Wrong Usage (expected: think [SECONDS])", process.stdout)
+        self.assertIn("Error: Wrong Usage (expected: computer [SECONDS|off])", process.stdout)
+        self.assertIn("2 failed", process.stdout)
+
+    def test_bad_hash_sizes_are_usage_errors(self):
+        process = run_script("hash abc\nhash 0\nhash 1\n")
+        self.assertEqual(process.stdout.count("Error: Wrong Usage (expected: hash [MB])"), 2)
+        self.assertIn("Hash table: 1 MB", process.stdout)
+
+    def test_savepgn_writes_the_result(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "mate.pgn")
+            process = run_script("setfen 6k1/5ppp/8/8/8/8/5PPP/R5K1 w - - 0 1\nmv a1 a8\nsavepgn %s\n" % path)
+            self.assertEqual(process.returncode, 0, process.stdout)
+            with open(path) as f:
+                text = f.read()
+            self.assertIn('[Result "1-0"]', text)
+            self.assertIn("Ra8# 1-0", text)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_bad_pgn_game_number_is_a_usage_error(self):
+        process = run_script("loadpgn games.pgn x\n")
+        self.assertIn("Error: Wrong Usage (expected: loadpgn FILENAME [NUMBER])", process.stdout)
+        self.assertEqual(process.returncode, 1)
+
+    def test_bad_archive_arguments_are_usage_errors(self):
+        process = run_script("loadarchive games.pca x\nloadarchive no-such-archive.pca 1\n")
+        self.assertEqual(process.returncode, 1, process.stdout)
+        self.assertIn("Error: Wrong Usage (expected: loadarchive FILENAME NUMBER [PLY])", process.stdout)
+        self.assertIn("Error loading game:", process.stdout)
+        self.assertIn("2 failed", process.stdout)
+
+
+if __name__ == "__main__":
+    unittest.main()
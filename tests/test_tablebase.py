@@ -0,0 +1,66 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tablebase
+from pyChess import Position
+
+
+class KrkTest(unittest.TestCase):
+    # Generating KRK takes a few seconds, so it is done once for all tests.
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        tablebase.generate("KRK", cls.directory, output=lambda text: None)
+        cls.tablebases = tablebase.Tablebases(cls.directory)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tablebases.close()
+        shutil.rmtree(cls.directory)
+
+    def probe(self, fen):
+        return self.tablebases.probe(Position.from_fen(fen))
+
+    def test_longest_mate(self):
+        self.assertEqual(self.tablebases.table("KRK").max_plies, 32)
+
+    def test_mate_in_one(self):
+        position = Position.from_fen("6k1/8/6K1/8/8/8/8/R7 w - - 0 1")
+        self.assertEqual(self.tablebases.probe(position), (1, 1))
+        move, wdl, plies = self.tablebases.best_move(position)
+        self.assertEqual((move & 63, move >> 6 & 63), (0, 56))
+        self.assertEqual(self.tablebases.adjudicate(position), "1-0")
+
+    def test_mated(self):
+        self.assertEqual(self.probe("R5k1/8/6K1/8/8/8/8/8 b - - 0 1"), (-1, 0))
+
+    def test_rook_captured_is_a_draw(self):
+        self.assertEqual(self.probe("6k1/6R1/8/8/8/8/8/K7 b - - 0 1"), (0, 0))
+
+    def test_colors_reversed(self):
+        self.assertEqual(self.probe("r7/8/8/8/8/6k1/8/6K1 b - - 0 1"), (1, 1))
+
+    def test_best_moves_mate_in_the_stored_distance(self):
+        position = Position.from_fen("8/8/8/3k4/8/8/8/R3K3 w - - 0 1")
+        wdl, plies = self.tablebases.probe(position)
+        self.assertEqual((wdl, plies), (1, 27))
+        while plies:
+            move = self.tablebases.best_move(position)[0]
+            position.make_move(move)
+            plies -= 1
+            self.assertEqual(self.tablebases.probe(position), (1 if plies & 1 else -1, plies))
+        self.assertTrue(position.checkers)
+        self.assertIsNone(next(position.generate_moves(), None))
+
+    def test_castling_rights_are_not_probed(self):
+        self.assertIsNone(self.probe("4k3/8/8/8/8/8/8/R3K3 w Q - 0 1"))
+
+
+if __name__ == "__main__":
+    unittest.main()
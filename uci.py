@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+A Universal Chess Interface (UCI) front-end for the pyChess engine.
+
+Chess GUIs and tournament managers talk to the engine over standard
+input and output. The search runs on a background thread, so the input
+loop keeps reading and 'stop' ends a search within a few milliseconds.
+With an opening book (the BookFile option or pyChess.py --book) a book
+move is answered at once, without searching; with endgame tablebases
+(TablebasePath or pyChess.py --tablebases) the positions they cover are
+scored exactly. Start it with python -m uci or pyChess.py --uci.
+"""
+
+import sys
+import threading
+
+from pyChess import START_FEN, WHITE, Position, move_to_text
+from engine import Engine
+from book import Book
+from tablebase import Tablebases
+
+__author__ = "Michael Krisper"
+
+ENGINE_NAME = "pyChess"
+ENGINE_AUTHOR = "Michael Krisper"
+
+# Time kept back per move for the GUI and process overhead, in seconds.
+MOVE_OVERHEAD = 0.05
+
+class UciEngine(object):
+    """Reads UCI commands, keeps the position and runs searches in the background."""
+
+    def __init__(self, out=None, book_path=None, tablebase_path=None):
+        """
+        Initializes a UciEngine.
+
+        Args:
+            out: The file object responses are written to, by default standard output.
+            book_path (str): The opening book to play from, or None.
+            tablebase_path (str): The directory of the endgame tablebases, or None.
+        """
+        self.out = out or sys.stdout
+        self.engine = Engine()
+        self.book = Book(book_path) if book_path else None
+        self.engine.tablebases = Tablebases(tablebase_path) if tablebase_path else None
+        self.position = Position.from_fen(START_FEN)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def send(self, line):
+        """Writes one line of output; the search thread and the input loop may both call this."""
+        with self._lock:
+            self.out.write(line + "\n")
+            self.out.flush()
+
+    def run(self, lines=None):
+        """
+        Processes commands until 'quit' or the end of the input.
+
+        Args:
+            lines: An iterable of command lines, by default standard input.
+        """
+        for line in lines if lines is not None else sys.stdin:
+            if not self.handle(line):
+                break
+        self.stop_search()
+
+    def handle(self, line):
+        """
+        Processes one command line.
+
+        Returns:
+            bool: False if the engine should quit.
+        """
+        words = line.split()
+        if not words:
+            return True
+        command, params = words[0], words[1:]
+        if command == "quit":
+            return False
+        if command == "uci":
+            self.send("id name %s" % ENGINE_NAME)
+            self.send("id author %s" % ENGINE_AUTHOR)
+            self.send("option name Hash type spin default %d min 1 max 4096" % self.engine.tt.size_mb)
+            self.send("option name BookFile type string default %s" % (self.book.path if self.book else "<empty>"))
+            self.send("option name TablebasePath type string default %s"
+                      % (self.engine.tablebases.directory if self.engine.tablebases else "<empty>"))
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "ucinewgame":
+            self.stop_search()
+            self.engine.clear()
+        elif command == "setoption":
+            self.set_option(params)
+        elif command == "position":
+            self.stop_search()
+            self.set_position(params)
+        elif command == "go":
+            self.stop_search()
+            self.go(params)
+        elif command == "stop":
+            self.stop_search()
+        return True
+
+    def set_option(self, params):
+        """Handles 'setoption name NAME value VALUE'."""
+        if "name" not in params or "value" not in params:
+            return
+        name = " ".join(params[params.index("name") + 1:params.index("value")]).lower()
+        value = " ".join(params[params.index("value") + 1:])
+        if name == "hash":
+            try:
+                size = int(value)
+            except ValueError:
+                self.send("info string Invalid value for Hash")
+                return
+            self.stop_search()
+            self.engine.tt.resize(max(1, size))
+        elif name == "bookfile":
+            if self.book is not None:
+                self.book.close()
+                self.book = None
+            if value and value != "<empty>":
+                try:
+                    self.book = Book(value)
+                except OSError as e:
+                    self.send("info string %s" % e)
+        elif name == "tablebasepath":
+            self.stop_search()
+            if self.engine.tablebases is not None:
+                self.engine.tablebases.close()
+            self.engine.tablebases = Tablebases(value) if value and value != "<empty>" else None
+
+    def set_position(self, params):
+        """Handles 'position startpos|fen FEN [moves MOVE...]'."""
+        if "moves" in params:
+            index = params.index("moves")
+            params, moves = params[:index], params[index + 1:]
+        else:
+            moves = []
+        try:
+            if params and params[0] == "fen":
+                position = Position.from_fen(" ".join(params[1:]))
+            else:
+                position = Position.from_fen(START_FEN)
+        except ValueError as e:
+            self.send("info string %s" % e)
+            return
+        for text in moves:
+            move = next((move for move in position.generate_moves() if move_to_text(move) == text), None)
+            if move is None:
+                self.send("info string Illegal move: %s" % text)
+                break
+            position.make_move(move)
+        self.position = position
+
+    def go(self, params):
+        """
+        Handles 'go' with wtime/btime/winc/binc/movestogo, movetime, depth, nodes or infinite.
+
+        A limit without a valid number is reported and ignored. In infinite
+        mode the best move is held back until 'stop', even if the search
+        ends by itself, e.g. on finding a mate.
+        """
+        if self.book is not None and "infinite" not in params:
+            move = self.book.choose(self.position)
+            if move:
+                self.send("info string book move, probe %d us" % (self.book.last_probe_time * 1e6))
+                self.send("bestmove %s" % move_to_text(move))
+                return
+        values = {}
+        for i, name in enumerate(params):
+            if name in ("wtime", "btime", "winc", "binc", "movestogo", "movetime", "depth", "nodes"):
+                try:
+                    values[name] = int(params[i + 1])
+                except (ValueError, IndexError):
+                    self.send("info string Invalid value for %s" % name)
+        max_time = None
+        if "movetime" in values:
+            max_time = max(0.001, values["movetime"] / 1000.0 - MOVE_OVERHEAD)
+        elif "infinite" not in params:
+            white = self.position.side == WHITE
+            time_left = values.get("wtime" if white else "btime")
+            if time_left is not None:
+                increment = values.get("winc" if white else "binc", 0) / 1000.0
+                time_left /= 1000.0
+                max_time = time_left / values.get("movestogo", 30) + increment * 0.75
+                max_time = max(0.001, min(max_time, time_left / 2) - MOVE_OVERHEAD)
+        kwargs = {"max_time": max_time, "max_nodes": values.get("nodes")}
+        if "depth" in values:
+            kwargs["max_depth"] = values["depth"]
+        self._stopped = threading.Event()
+        if "infinite" not in params:
+            self._stopped.set()
+        self._thread = threading.Thread(target=self._search, args=(self.position.copy(), kwargs, self._stopped))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop_search(self):
+        """Stops a running search and waits until it has sent its best move."""
+        self._stopped.set()
+        while self._thread is not None and self._thread.is_alive():
+            # The engine resets its stop flag when a search starts; repeat until it is seen.
+            self.engine.stop()
+            self._thread.join(0.01)
+        self._thread = None
+
+    def _search(self, position, kwargs, stopped):
+        """
+        Runs on the search thread: searches, reports every iteration and sends
+        the best move once stopped is set.
+        """
+        result = self.engine.search(position, info=self._info, **kwargs)
+        stopped.wait()
+        self.send("bestmove %s" % (move_to_text(result.move) if result.move else "0000"))
+
+    def _info(self, result):
+        """Sends the statistics of a completed iteration."""
+        if result.mate_in is not None:
+            score = "mate %d" % result.mate_in
+        else:
+            score = "cp %d" % result.score
+        self.send("info depth %d score %s nodes %d nps %d time %d hashfull %d pv %s"
+                  % (result.depth, score, result.nodes, result.nps, result.time * 1000,
+                     self.engine.tt.hashfull(), " ".join(move_to_text(move) for move in result.pv)))
+
+def main(book_path=None, tablebase_path=None):
+    UciEngine(book_path=book_path, tablebase_path=tablebase_path).run()
+
+if __name__ == '__main__':
+    main()